@@ -0,0 +1,94 @@
+"""Compare benchmark results against a baseline and flag regressions.
+
+Usage:
+    python benchmarks/compare.py baseline.json results.json --tolerance 0.2
+
+Exits with status 1 if any metric of a benchmark present in both files is worse than
+in the baseline by more than the tolerance, relative to the baseline.
+"""
+
+import argparse
+import json
+import sys
+from typing import Dict, List, Optional, Tuple
+
+# Metrics for which higher is better. For all others, lower is better.
+THROUGHPUT_METRICS = (
+    "simulations_per_second",
+    "epochs_per_second",
+    "posterior_samples_per_second",
+    "ess_per_second",
+    "ess_per_evaluation",
+)
+COST_METRICS = (
+    "wall_time",
+    "simulation_time",
+    "training_time",
+    "proposal_sampling_time",
+    "sampling_time",
+    "warmup_time",
+    "peak_rss_bytes",
+)
+
+
+def compare(
+    baseline: Dict, results: Dict, tolerance: float
+) -> List[Tuple[str, str, float, float, float, bool]]:
+    """Return a row per benchmark and metric: benchmark name, metric, baseline value,
+    new value, relative change and whether it is a regression.
+
+    The relative change is positive when the metric got better.
+    """
+
+    baseline_results = {result["name"]: result for result in baseline["results"]}
+    rows = []
+    for result in results["results"]:
+        reference = baseline_results.get(result["name"])
+        if reference is None:
+            continue
+        for metric in THROUGHPUT_METRICS + COST_METRICS:
+            old, new = reference.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if metric in COST_METRICS:
+                change = -change
+            rows.append(
+                (result["name"], metric, old, new, change, change < -tolerance)
+            )
+    return rows
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "baseline", help="JSON results of `benchmarks/run.py` or `mcmc.py`."
+    )
+    parser.add_argument("results", help="JSON results to compare to the baseline.")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="relative worsening of a metric that is flagged as regression.",
+    )
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.results) as f:
+        results = json.load(f)
+
+    rows = compare(baseline, results, args.tolerance)
+    for name, metric, old, new, change, regression in rows:
+        flag = "REGRESSION" if regression else ""
+        print(
+            f"{name:40} {metric:30} {old:12.4g} {new:12.4g} {change:+8.1%} {flag}"
+        )
+
+    num_regressions = sum(row[-1] for row in rows)
+    print(f"{num_regressions} regressions in {len(rows)} metrics.")
+    sys.exit(1 if num_regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
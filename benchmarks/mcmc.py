@@ -0,0 +1,178 @@
+"""Benchmark the MCMC methods of the posterior on the potentials of SNPE, SNL and SRE.
+
+Usage:
+    python benchmarks/mcmc.py --methods slice-np nuts --output mcmc-results.json
+
+For every algorithm and task, a posterior is trained once, then sampled with every
+MCMC method. Reported are the effective sample size (ESS) per second and per
+evaluation of the potential function, the cost of warmup, and the squared MMD between
+the samples and reference posterior samples of the task. Results are written as JSON,
+to be compared against a baseline with `benchmarks/compare.py`.
+"""
+
+import argparse
+import json
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import torch
+from pyro.ops.stats import effective_sample_size
+from torch import Tensor
+
+from run import SCALES, TASKS, make_inference, make_task, metadata
+from sbi.simulators.linear_gaussian import (
+    get_true_posterior_samples_linear_gaussian_uniform_prior,
+)
+from sbi.simulators.nonlinear_gaussian import (
+    get_ground_truth_posterior_samples_nonlinear_gaussian,
+)
+from sbi.utils.mmd import unbiased_mmd_squared
+
+ALGORITHMS = ("snpe_c", "snl", "sre")
+MCMC_METHODS = ("slice-np", "slice", "hmc", "nuts")
+
+
+def reference_samples(task: str, observation: Tensor, prior, num_samples: int):
+    """Return samples of the true posterior of a task."""
+
+    if task == "linear_gaussian":
+        return get_true_posterior_samples_linear_gaussian_uniform_prior(
+            observation, prior, num_samples=num_samples
+        )
+    return get_ground_truth_posterior_samples_nonlinear_gaussian(num_samples)
+
+
+def min_effective_sample_size(samples: Tensor) -> float:
+    """Return the smallest ESS over the parameters of a single chain."""
+    ess = effective_sample_size(samples.unsqueeze(0), chain_dim=0, sample_dim=1)
+    return ess.min().item()
+
+
+def run_sampler(
+    posterior, method: str, reference: Tensor, thin: int, warmup: int
+) -> Dict:
+    """Sample the posterior with an MCMC method and return performance metrics.
+
+    As many samples are drawn as there are reference samples, to compute the MMD.
+
+    The cost of warmup is measured by a separate run of a single step after warmup.
+    ESS rates include warmup, i.e. they are those of drawing the samples from scratch.
+    """
+
+    # Posterior has no public setters, SNPE samples with rejection by default.
+    posterior._sample_with_mcmc = True
+    posterior._mcmc_method = method
+
+    num_samples = reference.shape[0]
+    start_time = time.perf_counter()
+    posterior.sample(1, thin=1, warmup=warmup)
+    warmup_time = time.perf_counter() - start_time
+    warmup_evaluations = posterior.potential_statistics.num_evaluations
+
+    start_time = time.perf_counter()
+    samples = posterior.sample(num_samples, thin=thin, warmup=warmup)
+    sampling_time = time.perf_counter() - start_time
+    statistics = posterior.potential_statistics
+
+    ess = min_effective_sample_size(samples)
+    return dict(
+        num_samples=num_samples,
+        wall_time=sampling_time,
+        warmup_time=warmup_time,
+        warmup_evaluations=warmup_evaluations,
+        potential_evaluations=statistics.num_evaluations,
+        network_time=statistics.network_time,
+        prior_time=statistics.prior_time,
+        fraction_outside_prior=statistics.fraction_outside_prior,
+        effective_sample_size=ess,
+        ess_per_second=ess / sampling_time,
+        ess_per_evaluation=ess / statistics.num_evaluations,
+        mmd_squared=unbiased_mmd_squared(samples.float(), reference.float()).item(),
+    )
+
+
+def run_benchmarks(
+    algorithm: str,
+    task: str,
+    methods: List[str],
+    scale: str,
+    num_samples: int,
+    thin: int,
+    warmup: int,
+    seed: int = 0,
+) -> List[Dict]:
+    """Train a posterior once, then benchmark every MCMC method on it."""
+
+    settings = SCALES[scale]
+    torch.manual_seed(seed)
+
+    simulator, prior, observation = make_task(task)
+    with tempfile.TemporaryDirectory() as log_dir:
+        inference = make_inference(algorithm, simulator, prior, observation, log_dir)
+        posterior = inference(
+            num_rounds=settings["num_rounds"],
+            num_simulations_per_round=settings["num_simulations_per_round"],
+        )
+
+    reference = reference_samples(task, observation, prior, num_samples)
+
+    results = []
+    for method in methods:
+        torch.manual_seed(seed)
+        result = run_sampler(posterior, method, reference, thin, warmup)
+        results.append(dict(name=f"{algorithm}/{task}/{method}", **result))
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--algorithms", nargs="+", choices=ALGORITHMS, default=list(ALGORITHMS)
+    )
+    parser.add_argument("--tasks", nargs="+", choices=TASKS, default=list(TASKS))
+    parser.add_argument(
+        "--methods", nargs="+", choices=MCMC_METHODS, default=list(MCMC_METHODS)
+    )
+    parser.add_argument(
+        "--scale",
+        choices=SCALES,
+        default="small",
+        help="scale of the inference that trains the posterior.",
+    )
+    parser.add_argument("--num-samples", type=int, default=500)
+    parser.add_argument("--thin", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="mcmc-benchmark-results.json")
+    args = parser.parse_args(argv)
+
+    results = []
+    for task in args.tasks:
+        for algorithm in args.algorithms:
+            print(f"Training {algorithm}/{task}...", flush=True)
+            for result in run_benchmarks(
+                algorithm,
+                task,
+                args.methods,
+                args.scale,
+                args.num_samples,
+                args.thin,
+                args.warmup,
+                args.seed,
+            ):
+                print(
+                    f"  {result['name']}: {result['ess_per_second']:.1f} ESS/s, "
+                    f"{result['ess_per_evaluation']:.4f} ESS/evaluation, "
+                    f"MMD^2 {result['mmd_squared']:.4f}",
+                    flush=True,
+                )
+                results.append(result)
+
+    with open(args.output, "w") as f:
+        json.dump(dict(metadata=metadata(), results=results), f, indent=2)
+    print(f"Results written to {args.output}.")
+
+
+if __name__ == "__main__":
+    main()
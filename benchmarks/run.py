@@ -0,0 +1,240 @@
+"""Run end-to-end performance benchmarks of SNPE, SNL and SRE.
+
+Usage:
+    python benchmarks/run.py --scales small medium --output results.json
+
+Every benchmark runs inference on a task at a given scale, in a fresh process, such
+that peak memory and global state are per benchmark. Results are written as JSON, to
+be compared against a baseline with `benchmarks/compare.py`.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+import torch
+from torch.utils.tensorboard import SummaryWriter
+
+import sbi.utils as utils
+from sbi.inference import SNL, SRE, SnpeB, SnpeC
+from sbi.simulators.linear_gaussian import linear_gaussian
+from sbi.simulators.nonlinear_gaussian import non_linear_gaussian
+from sbi.utils.torchutils import BoxUniform
+from sbi.version import __version__
+
+ALGORITHMS = ("snpe_c", "snpe_b", "snl", "sre")
+TASKS = ("linear_gaussian", "nonlinear_gaussian")
+
+# Rounds, simulations per round and posterior samples drawn at every scale.
+SCALES = {
+    "small": dict(num_rounds=1, num_simulations_per_round=500, num_samples=100),
+    "medium": dict(num_rounds=2, num_simulations_per_round=2000, num_samples=500),
+    "large": dict(num_rounds=2, num_simulations_per_round=10000, num_samples=1000),
+}
+
+
+class TimedSimulator:
+    """Simulator wrapper measuring the time spent simulating."""
+
+    def __init__(self, simulator: Callable):
+        self._simulator = simulator
+        self.num_simulations = 0
+        self.seconds = 0.0
+
+    def __call__(self, parameters):
+        start_time = time.perf_counter()
+        x = self._simulator(parameters)
+        self.seconds += time.perf_counter() - start_time
+        self.num_simulations += len(parameters)
+        return x
+
+
+def make_task(task: str):
+    """Return simulator, prior and observation of a task."""
+
+    if task == "linear_gaussian":
+        prior = BoxUniform(-2 * torch.ones(3), 2 * torch.ones(3))
+        return linear_gaussian, prior, torch.zeros(3)
+    if task == "nonlinear_gaussian":
+        prior = BoxUniform(-3 * torch.ones(5), 3 * torch.ones(5))
+        # Observation of the ground truth parameters of 'Sequential Neural Likelihood'.
+        observation = torch.tensor(
+            [-0.9707, -2.9461, -0.4495, -3.4232, -0.1329, -3.3640, -0.8537, -2.4272]
+        )
+        return non_linear_gaussian, prior, observation
+    raise ValueError(f"Unknown task '{task}', must be one of {TASKS}.")
+
+
+def make_inference(algorithm: str, simulator: Callable, prior, observation, log_dir):
+    """Return the inference object of an algorithm, with the default neural nets."""
+
+    common_args = dict(
+        simulator=simulator,
+        prior=prior,
+        true_observation=observation,
+        simulation_batch_size=100,
+        summary_writer=SummaryWriter(log_dir),
+    )
+    if algorithm in ("snpe_c", "snpe_b"):
+        density_estimator = utils.posterior_nn(
+            model="maf", prior=prior, context=observation
+        )
+        inference_class = SnpeC if algorithm == "snpe_c" else SnpeB
+        return inference_class(density_estimator=density_estimator, **common_args)
+    if algorithm == "snl":
+        density_estimator = utils.likelihood_nn(
+            model="maf", prior=prior, context=observation
+        )
+        return SNL(
+            density_estimator=density_estimator, mcmc_method="slice-np", **common_args
+        )
+    if algorithm == "sre":
+        classifier = utils.classifier_nn(
+            model="resnet", prior=prior, context=observation
+        )
+        return SRE(classifier=classifier, mcmc_method="slice-np", **common_args)
+    raise ValueError(f"Unknown algorithm '{algorithm}', must be one of {ALGORITHMS}.")
+
+
+def run_benchmark(algorithm: str, task: str, scale: str, seed: int = 0) -> Dict:
+    """Run inference once and return its performance metrics.
+
+    Simulation time is measured around the simulator calls, training and proposal
+    sampling times are taken from the summary of inference. Peak RSS is that of the
+    whole process, so every benchmark should run in a process of its own.
+    """
+
+    settings = SCALES[scale]
+    torch.manual_seed(seed)
+
+    simulator, prior, observation = make_task(task)
+    timed_simulator = TimedSimulator(simulator)
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        start_time = time.perf_counter()
+        inference = make_inference(
+            algorithm, timed_simulator, prior, observation, log_dir
+        )
+        posterior = inference(
+            num_rounds=settings["num_rounds"],
+            num_simulations_per_round=settings["num_simulations_per_round"],
+        )
+        inference_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        posterior.sample(settings["num_samples"])
+        sampling_time = time.perf_counter() - start_time
+
+    epochs = sum(inference._summary["epochs"])
+    training_time = sum(inference._summary["neural_net_fit_times"])
+
+    return dict(
+        name=f"{algorithm}/{task}/{scale}",
+        num_simulations=timed_simulator.num_simulations,
+        epochs=epochs,
+        wall_time=inference_time + sampling_time,
+        simulation_time=timed_simulator.seconds,
+        training_time=training_time,
+        proposal_sampling_time=sum(inference._summary["proposal_sampling_times"]),
+        sampling_time=sampling_time,
+        simulations_per_second=timed_simulator.num_simulations
+        / max(timed_simulator.seconds, 1e-9),
+        epochs_per_second=epochs / training_time,
+        posterior_samples_per_second=settings["num_samples"] / sampling_time,
+        peak_rss_bytes=utils.peak_memory_bytes(),
+    )
+
+
+def metadata() -> Dict:
+    """Return the versions and the machine the benchmarks ran with."""
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    return dict(
+        sbi_version=__version__,
+        git_commit=commit,
+        torch_version=torch.__version__,
+        python_version=platform.python_version(),
+        machine=platform.platform(),
+        num_cpus=os.cpu_count(),
+        time=time.strftime("%Y-%m-%dT%H:%M:%S"),
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--algorithms", nargs="+", choices=ALGORITHMS, default=list(ALGORITHMS)
+    )
+    parser.add_argument("--tasks", nargs="+", choices=TASKS, default=list(TASKS))
+    parser.add_argument("--scales", nargs="+", choices=SCALES, default=["small"])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument(
+        "--single",
+        action="store_true",
+        help="run a single benchmark in this process and print its result as JSON.",
+    )
+    args = parser.parse_args(argv)
+
+    if args.single:
+        result = run_benchmark(
+            args.algorithms[0], args.tasks[0], args.scales[0], args.seed
+        )
+        print(json.dumps(result))
+        return
+
+    results = []
+    for scale in args.scales:
+        for task in args.tasks:
+            for algorithm in args.algorithms:
+                name = f"{algorithm}/{task}/{scale}"
+                print(f"Running {name}...", flush=True)
+                process = subprocess.run(
+                    [
+                        sys.executable,
+                        os.path.abspath(__file__),
+                        "--single",
+                        "--algorithms",
+                        algorithm,
+                        "--tasks",
+                        task,
+                        "--scales",
+                        scale,
+                        "--seed",
+                        str(args.seed),
+                    ],
+                    capture_output=True,
+                    text=True,
+                )
+                if process.returncode != 0:
+                    print(process.stderr, file=sys.stderr)
+                    raise RuntimeError(f"Benchmark {name} failed.")
+                results.append(json.loads(process.stdout.strip().splitlines()[-1]))
+                print(
+                    f"  {results[-1]['wall_time']:.1f} s, "
+                    f"{results[-1]['simulations_per_second']:.0f} simulations/s, "
+                    f"{results[-1]['epochs_per_second']:.2f} epochs/s",
+                    flush=True,
+                )
+
+    with open(args.output, "w") as f:
+        json.dump(dict(metadata=metadata(), results=results), f, indent=2)
+    print(f"Results written to {args.output}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,3 +3,4 @@ from sbi.inference.snpe.snpe_a import SnpeA
 from sbi.inference.snpe.snpe_b import SnpeB
 from sbi.inference.snpe.snpe_c import SnpeC
 from sbi.inference.sre import SRE
+from sbi.inference.trainer import Trainer, TrainingHook
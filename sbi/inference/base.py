@@ -1,17 +1,34 @@
 
 from abc import ABC
+import math
 import os.path
-from typing import Callable, Optional
+import time
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple, Union
 import warnings
 
 import torch
-from torch import Tensor
+from torch import Tensor, nn
 from torch.distributions import Uniform
+from torch.optim import Optimizer
 from torch.utils.tensorboard import SummaryWriter
 
-from sbi.simulators.simutils import prepare_sbi_problem
-from sbi.utils import get_log_root, get_timestamp
-from sbi.utils.torchutils import get_default_device
+from sbi.inference.simulation_bank import SimulationBank
+from sbi.inference.trainer import Trainer, TrainingHook
+from sbi.simulators.cache import SimulationCache
+from sbi.simulators.stream import SimulationStream
+from sbi.simulators.supervision import SimulationFailures, is_valid
+from sbi.simulators.simutils import (
+    SIMULATION_EXECUTORS,
+    SimulationProcessPool,
+    SimulatorSignature,
+    prepare_sbi_problem_and_probe,
+    simulate_in_batches,
+    simulation_process_pool,
+    tune_simulation_batch_size,
+)
+from sbi.utils import PriorDesign, get_log_root, get_timestamp, load_simulations
+from sbi.utils.profiling import add_span
+from sbi.utils.torchutils import TensorBatches, get_default_device
 
 
 class NeuralInference(ABC):
@@ -22,41 +39,200 @@ class NeuralInference(ABC):
         simulator: Callable,
         prior,
         true_observation: Tensor,
-        simulation_batch_size: int = 1,
+        simulation_batch_size: Union[int, str] = 1,
         device: Optional[torch.device] = None,
         summary_writer: Optional[SummaryWriter] = None, 
         simulator_name: Optional[str] = "simulator",
+        simulation_executor: str = "serial",
+        num_workers: int = 1,
+        simulation_cache: Optional[SimulationCache] = None,
+        simulation_bank_storage: str = "memory",
+        simulation_bank_directory: Optional[str] = None,
+        stream_simulations: bool = False,
+        stream_chunk_size: int = 100,
+        max_concurrent_simulations: int = 16,
+        simulation_timeout: Optional[float] = None,
+        max_simulation_retries: int = 0,
+        max_batch_memory_bytes: int = 2 ** 30,
+        simulator_signature: Optional[SimulatorSignature] = None,
+        prior_design: str = "iid",
+        lr_scheduler: Optional[Callable[[Optimizer], Any]] = None,
+        accumulate_grad_batches: int = 1,
+        validate_every_epochs: int = 1,
+        training_hooks: Sequence[TrainingHook] = (),
+        replay_size: Optional[int] = None,
+        replay_decay: float = 1.0,
     ):
 
         """
         Args:
 
             simulator: a regular function parameter->result
-                Both parameters and result can be multi-dimensional.         
+                Both parameters and result can be multi-dimensional. If None,
+                inference can only use simulations provided with
+                `append_simulations` or `append_simulations_from_files`. A
+                `SimulationFarm` runs the simulations on socket-connected workers.
             prior: distribution-like object with `log_prob`and `sample` methods.
             true_observation: tensor containing the observation x_o.
                 If it has more than one dimension, the leading dimension will be interpreted as a batch dimension but *currently* only the first batch element will be used to condition on.
             simulation_batch_size: number of parameter sets that the 
                 simulator accepts and converts to data x at once. If -1, we simulate all parameter sets at the same time. If >= 1, the simulator has to process data of shape (simulation_batch_size, parameter_dimension).
+                If 'auto', the batch size with the highest throughput is chosen on
+                the first simulations, see `tune_simulation_batch_size`, and stored
+                in the summary along with the measured throughputs.
             summary_writer: an optional SummaryWriter to control, among others, log     
                 file location (default is <current working directory>/logs.)
             device: torch.device on which to compute (optional).
+            simulation_executor: how batches of simulations are run, one of
+                ['serial', 'threads', 'processes']. Parallel executors distribute the
+                batches of size `simulation_batch_size` over `num_workers` workers.
+            num_workers: number of threads or processes used by a parallel
+                `simulation_executor`.
+            simulation_cache: optional on-disk cache of simulations. If given, the
+                simulator is only called for parameters that were not simulated
+                before, e.g. in an earlier run of the same seeded experiment.
+            simulation_bank_storage: where simulations are stored for training, one
+                of ['memory', 'memmap']. With 'memmap', parameters and observations
+                are kept in memory-mapped files and read from disk during training,
+                for datasets larger than the available memory.
+            simulation_bank_directory: directory for the files of a 'memmap' bank.
+            stream_simulations: whether to overlap simulation with training. The
+                simulations of a round are then run in a background thread, and
+                training starts as soon as the first chunk is finished. Training is
+                resumed with every chunk that finishes while training, and the round
+                ends with a final training run on all simulations. Only simulators run
+                by 'processes' have their own RNGs and are reproducible when streamed.
+            stream_chunk_size: number of simulations per chunk when streaming.
+            max_concurrent_simulations: for simulators defined as `async def`
+                functions of a single parameter set, the maximal number of
+                simulations awaited at the same time. All simulations of a round, or of
+                a chunk when streaming, are run concurrently up to this limit,
+                independent of `simulation_batch_size` and `simulation_executor`.
+            simulation_timeout: time in seconds after which a simulator call counts
+                as failed, i.e. a batch of `simulation_batch_size` simulations, or a
+                single simulation of an `async def` simulator. With a timeout, calls
+                run in worker processes, also with the 'serial' executor, and a
+                worker is killed and replaced when its call times out. Not
+                supported by the 'threads' executor.
+            max_simulation_retries: number of times a simulator call that raised or
+                timed out is repeated. Simulations of calls that fail for good, or
+                with non-finite data, are quarantined instead of trained on and
+                replaced by simulations of newly sampled parameters, such that every
+                round still reaches its number of simulations. Failures are counted
+                per round in the summary.
+            max_batch_memory_bytes: upper bound on the memory of a batch of
+                simulations when tuning `simulation_batch_size='auto'`.
+            simulator_signature: declared signature of the simulator, i.e. whether it
+                simulates batches, takes numpy arrays and the shape of its output.
+                If None, the simulator is probed once on a batch of two parameter
+                sets (and once more on a single one if it can't simulate batches),
+                sampled from the `prior_design`. The probe simulations are part of
+                the first round and count towards its number of simulations.
+            prior_design: how parameters are sampled from the prior for the pilot
+                run and the first round, one of 'iid', 'sobol' (scrambled Sobol
+                points) or 'lhs' (Latin hypercube), see `utils.PriorDesign`.
+                Space-filling designs need uniform or normal priors.
+            lr_scheduler: function returning a learning rate scheduler of the
+                optimizer of a training run, e.g.
+                `lambda optimizer: StepLR(optimizer, step_size=50)`. Schedulers are
+                stepped after every epoch, `ReduceLROnPlateau` after every validation.
+            accumulate_grad_batches: number of training batches whose gradients are
+                accumulated for a single optimizer step.
+            validate_every_epochs: number of training epochs between validation
+                passes. Training stops after `stop_after_epochs` epochs without
+                improvement as checked at validation.
+            training_hooks: callbacks of the trainer, see `Trainer` and
+                `TrainingHook`.
+            replay_size: if given, every round trains on the simulations of the
+                latest round and a replay sample of at most this many simulations of
+                earlier rounds, instead of on all simulations. The cost of a round
+                then stays bounded as simulations accumulate.
+            replay_decay: weight of the simulations of a round in the replay sample
+                relative to those of the round after it. With 1, the replay sample
+                is uniform over earlier rounds.
             mcmc_method: MCMC method to use for posterior sampling, one of 
                 ['slice', 'hmc', 'nuts'].
         """
 
-        self._simulator, self._prior, self._true_observation = prepare_sbi_problem(
+        # The probe simulations are part of the first round, so their parameters are
+        # sampled from its design.
+        self._prior_design: Optional[PriorDesign] = None
+
+        def probe_sampler(prior) -> Callable[[int], Tensor]:
+            self._prior_design = PriorDesign(prior, prior_design)
+            return self._prior_design.sample
+
+        (
+            self._simulator,
+            self._prior,
+            self._true_observation,
+            probe,
+            simulator_signature,
+        ) = prepare_sbi_problem_and_probe(
             simulator, 
             prior, 
-            true_observation
+            true_observation,
+            max_concurrent_simulations=max_concurrent_simulations,
+            simulation_timeout=simulation_timeout,
+            simulator_signature=simulator_signature,
+            probe_sampler=probe_sampler,
         )
+        if self._prior_design is None:
+            self._prior_design = PriorDesign(self._prior, prior_design)
 
+        assert simulation_batch_size == "auto" or isinstance(
+            simulation_batch_size, int
+        ), "`simulation_batch_size` must be an integer or 'auto'."
         self._simulation_batch_size = simulation_batch_size
+        self._max_batch_memory_bytes = max_batch_memory_bytes
+
+        assert (
+            simulation_executor in SIMULATION_EXECUTORS
+        ), f"`simulation_executor` must be one of {SIMULATION_EXECUTORS}."
+        self._simulation_executor = simulation_executor
+        self._num_workers = num_workers
+        self._simulation_cache = simulation_cache
+        self._simulation_dtype = (
+            None if simulator_signature is None else simulator_signature.output_dtype
+        )
+        self._simulation_timeout = simulation_timeout
+        self._max_simulation_retries = max_simulation_retries
+
+        self._stream_simulations = stream_simulations
+        self._stream_chunk_size = stream_chunk_size
+        self._simulation_stream = None
 
         self._device = get_default_device() if device is None else device
 
+        self._lr_scheduler = lr_scheduler
+        self._accumulate_grad_batches = accumulate_grad_batches
+        self._validate_every_epochs = validate_every_epochs
+        self._training_hooks = list(training_hooks)
+        assert replay_size is None or replay_size >= 0, "`replay_size` must be >= 0."
+        assert 0 < replay_decay <= 1, "`replay_decay` must be in (0, 1]."
+        self._replay_size = replay_size
+        self._replay_decay = replay_decay
+
+        # Number of rounds run so far, further calls continue from here.
+        self._round = 0
+
         # Initialize roundwise (parameter, observation) storage.
-        self._parameter_bank, self._observation_bank = [], []
+        # Simulator outputs keep their dtype until they are converted to float32
+        # while being copied into the bank.
+        self._simulation_bank = SimulationBank(
+            storage=simulation_bank_storage,
+            directory=simulation_bank_directory,
+            dtype=torch.float32,
+        )
+        # Simulations that failed or returned non-finite data, kept out of training.
+        self._quarantine = SimulationBank(dtype=torch.float32)
+
+        # Simulations run to probe the simulator are prior samples, so keep them.
+        # They count towards the simulations of the first round.
+        self._num_probe_simulations = 0
+        if probe is not None:
+            self.append_simulations(*probe)
+            self._num_probe_simulations = len(probe[0])
 
         # XXX We could instantiate here the Posterior for all children. Two problems:
         # XXX 1. We must dispatch to right PotentialProvider for mcmc based on name
@@ -79,7 +255,510 @@ class NeuralInference(ABC):
             mmds=[],
             median_observation_distances=[],
             negative_log_probs_true_parameters=[],
-            neural_net_fit_times= [], #XXX unused elsewhere
             epochs=[],
             best_validation_log_probs=[],
+            # Why training stopped in each round, one of `trainer.STOP_REASONS`.
+            stop_reasons=[],
+            num_failed_simulation_calls=[],
+            num_simulation_retries=[],
+            num_invalid_simulations=[],
+            # Seconds spent per round in each phase. Simulating overlaps training
+            # when streaming. Fitting the neural net includes validation, and epoch
+            # times are the mean training time of an epoch, without validation.
+            simulation_times=[],
+            proposal_sampling_times=[],
+            neural_net_fit_times=[],
+            training_times=[],
+            validation_times=[],
+            leakage_estimation_times=[],
+            epoch_times=[],
+            # Batches passed through the neural net while training and validating.
+            num_forward_passes=[],
+            # Peak resident memory of the process at the end of each round.
+            peak_memory_bytes=[],
+        )
+
+    @property
+    def quarantined_simulations(self) -> Optional[Tuple[Tensor, Tensor]]:
+        """Parameters and data of all simulations that failed or returned non-finite
+        data, or None if there were none. Failed simulator calls have NaN data."""
+        if len(self._quarantine) == 0:
+            return None
+        return self._quarantine.get("parameters"), self._quarantine.get("observations")
+
+    def append_simulations(self, parameters: Tensor, observations: Tensor) -> None:
+        """Add simulations of parameters sampled from the prior to the first round.
+
+        The simulations are trained on in the first round, together with the
+        simulations run in that round, if any. Run the first round with
+        `num_simulations_per_round=0` to train on the provided simulations only.
+        Subsequent rounds continue sequentially and require a simulator.
+
+        Args:
+            parameters: parameters sampled from the prior, (num_simulations, dim).
+            observations: corresponding simulator outputs.
+        """
+
+        if self._round > 0:
+            raise ValueError(
+                "Simulations can only be appended before the first round is run."
+            )
+
+        # Numpy arrays are wrapped without copying, the bank converts them to float32.
+        parameters = torch.as_tensor(parameters)
+        observations = torch.as_tensor(observations)
+        if observations.shape[1:] != self._true_observation.shape[1:]:
+            raise ValueError(
+                f"Observations have shape {observations.shape[1:]}, but the observed "
+                f"data has shape {self._true_observation.shape[1:]}."
+            )
+
+        self._simulation_bank.extend(
+            **self._bank_fields(parameters, observations, round_=0)
+        )
+
+    def append_simulations_from_files(
+        self, paths: Union[str, Sequence[str]], **kwargs
+    ) -> None:
+        """Stream prior simulations from shards on disk into the first round.
+
+        Args:
+            paths: paths of .npz or HDF5 shards, see `utils.load_simulations`.
+            kwargs: passed on to `utils.load_simulations`.
+        """
+        for parameters, observations in load_simulations(paths, **kwargs):
+            self.append_simulations(parameters, observations)
+
+    def _store_simulations(
+        self, round_: int, parameters: Tensor, observations: Tensor
+    ) -> None:
+        """Store simulations of a round in the simulation bank.
+
+        Simulations of a round that is already in the bank are added to it, e.g. to
+        simulations appended by the user, or to earlier chunks of a streamed round.
+        """
+        fields = self._bank_fields(parameters, observations, round_)
+        if round_ < self._simulation_bank.num_rounds:
+            self._simulation_bank.extend(**fields)
+        else:
+            self._simulation_bank.append_round(**fields)
+
+    def _bank_fields(
+        self, parameters: Tensor, observations: Tensor, round_: int
+    ) -> Dict[str, Tensor]:
+        """Return the fields stored in the simulation bank for simulations of a round."""
+        return dict(parameters=parameters, observations=observations)
+
+    def _simulate_round(
+        self, round_: int, parameter_sample_fn: Callable, num_samples: int
+    ) -> None:
+        """Simulate `num_samples` parameter sets and store them as round `round_`.
+
+        When streaming, the parameters are sampled right away but simulated in the
+        background, and only the first chunk is waited for. The remaining chunks are
+        stored by `_receive_simulations` as they finish. Invalid simulations of a
+        chunk are replaced by simulations of parameters sampled with
+        `parameter_sample_fn` when chunks are received, i.e. from the proposal
+        while training pauses, see `SimulationStream`.
+
+        The simulations run to probe the simulator count towards the first round.
+        """
+
+        if round_ == 0:
+            num_samples = max(0, num_samples - self._num_probe_simulations)
+        if num_samples == 0:
+            return
+
+        if not self._stream_simulations:
+            parameters, observations = self._simulate(parameter_sample_fn, num_samples)
+            self._store_simulations(round_, parameters, observations)
+            return
+
+        start_time = time.perf_counter()
+        parameters = parameter_sample_fn(num_samples)
+        self._end_phase("proposal_sampling_times", start_time)
+        self._simulation_stream = SimulationStream(
+            simulate_chunk=lambda chunk, sample_replacements: self._simulate(
+                _presampled(chunk, sample_replacements), len(chunk)
+            ),
+            parameters=parameters,
+            chunk_size=self._stream_chunk_size,
+            sample_replacements=parameter_sample_fn,
+        )
+        self._stream_round = round_
+        self._receive_simulations(block=True)
+
+    def _receive_simulations(self, block: bool = False) -> bool:
+        """Store chunks of streamed simulations that finished in the meantime.
+
+        Args:
+            block: whether to wait for the next chunk if none is finished yet.
+
+        Returns:
+            Whether any simulations were stored.
+        """
+
+        if self._simulation_stream is None:
+            return False
+
+        try:
+            chunks = self._simulation_stream.receive(block=block)
+        finally:
+            if self._simulation_stream.exhausted:
+                self._simulation_stream = None
+
+        for parameters, observations in chunks:
+            self._store_simulations(self._stream_round, parameters, observations)
+        return bool(chunks)
+
+    def _train_on_simulation_stream(self, train: Callable[[], None]) -> None:
+        """Call `train` until it has seen all simulations of the current round.
+
+        Without streaming, `train` is called once. When streaming, it is called again
+        on all simulations received so far whenever chunks finished during the last
+        call, continuing from the current network weights. The summary gets a single
+        entry for the round, with the total number of epochs. Training budgets apply
+        to every call.
+
+        Args:
+            train: function training the neural net on the simulation bank and
+                appending its epochs and validation performance to the summary.
+        """
+
+        def timed_train():
+            start_time = time.perf_counter()
+            train()
+            self._end_phase("neural_net_fit_times", start_time)
+
+        num_entries = len(self._summary["epochs"])
+        try:
+            timed_train()
+            while self._receive_simulations(block=True):
+                timed_train()
+        finally:
+            if self._simulation_stream is not None:
+                self._simulation_stream.close()
+                self._simulation_stream = None
+
+        epochs = self._summary["epochs"][num_entries:]
+        best_validation_log_prob = self._summary["best_validation_log_probs"][-1]
+        del self._summary["epochs"][num_entries:]
+        stop_reason = self._summary["stop_reasons"][-1]
+        del self._summary["best_validation_log_probs"][num_entries:]
+        del self._summary["stop_reasons"][num_entries:]
+        self._summary["epochs"].append(sum(epochs))
+        self._summary["best_validation_log_probs"].append(best_validation_log_prob)
+        self._summary["stop_reasons"].append(stop_reason)
+
+    def _split_simulations(
+        self, validation_fraction: float, start_round: int = 0
+    ) -> Tuple[Tensor, Tensor]:
+        """Return random training and validation indices of the simulations to train
+        on, into the views of the simulation bank from `start_round` on.
+
+        With a `replay_size`, these are all simulations of the latest round, and a
+        replay sample of simulations of earlier rounds. Every simulation of a round
+        `k` rounds before the latest is sampled with weight `replay_decay ** k`,
+        without replacement, by weighted reservoir sampling (Efraimidis & Spirakis,
+        2006): the simulations with the largest keys `log(u) / weight` are chosen,
+        for uniform random `u`.
+
+        Args:
+            validation_fraction: fraction of the simulations used for validation.
+            start_round: first round to train on.
+        """
+
+        bank = self._simulation_bank
+        rounds = bank.round_indices(start_round)
+        indices = torch.arange(len(rounds))
+
+        if self._replay_size is not None:
+            latest_round = bank.num_rounds - 1
+            is_replayed = rounds < latest_round
+            replayed = indices[is_replayed]
+            if len(replayed) > self._replay_size:
+                ages = (latest_round - rounds[is_replayed]).float()
+                log_weights = ages * math.log(self._replay_decay)
+                keys = torch.rand(len(replayed)).log() / log_weights.exp()
+                replayed = replayed[keys.topk(self._replay_size).indices]
+            indices = torch.cat((replayed, indices[~is_replayed]))
+
+        permuted_indices = indices[torch.randperm(len(indices))]
+        num_training_examples = int((1 - validation_fraction) * len(indices))
+        return (
+            permuted_indices[:num_training_examples],
+            permuted_indices[num_training_examples:],
+        )
+
+    def _fit(
+        self,
+        model: nn.Module,
+        optimizer: Optimizer,
+        loss_fn: Callable[..., Tensor],
+        train_loader: TensorBatches,
+        val_loader: TensorBatches,
+        stop_after_epochs: int,
+        clip_max_norm: Optional[float] = None,
+        max_num_epochs: Optional[int] = None,
+        max_training_seconds: Optional[float] = None,
+        max_num_steps: Optional[int] = None,
+        stop_tolerance: float = 0.0,
+        validation_smoothing: float = 0.0,
+    ) -> None:
+        """Train `model` on the loss of an algorithm with the training settings of
+        this object, and append epochs, validation performance and the reason why
+        training stopped to the summary.
+
+        Args:
+            model: neural net that is trained and whose best state is restored.
+            optimizer: optimizer of the neural net, and possibly of further modules.
+            loss_fn: mean loss of a batch, see `Trainer`.
+            train_loader: training batches.
+            val_loader: validation batches.
+            stop_after_epochs: number of epochs without validation improvement after
+                which training stops.
+            clip_max_norm: if given, gradients are clipped to this norm.
+            max_num_epochs: maximal number of epochs.
+            max_training_seconds: maximal training time in seconds.
+            max_num_steps: maximal number of gradient steps.
+            stop_tolerance: relative improvement of the validation performance below
+                which it is not counted as improvement.
+            validation_smoothing: factor of the exponential moving average of the
+                validation performance checked for improvement.
+        """
+
+        trainer = Trainer(
+            model,
+            optimizer,
+            loss_fn,
+            train_loader,
+            val_loader,
+            stop_after_epochs=stop_after_epochs,
+            device=self._device,
+            clip_max_norm=clip_max_norm,
+            lr_scheduler=(
+                None if self._lr_scheduler is None else self._lr_scheduler(optimizer)
+            ),
+            accumulate_grad_batches=self._accumulate_grad_batches,
+            validate_every_epochs=self._validate_every_epochs,
+            max_num_epochs=max_num_epochs,
+            max_seconds=max_training_seconds,
+            max_num_steps=max_num_steps,
+            stop_tolerance=stop_tolerance,
+            validation_smoothing=validation_smoothing,
+            hooks=[_RoundSummaryHook(self)] + self._training_hooks,
+        )
+        trainer.train()
+
+        self._summary["epochs"].append(trainer.epoch)
+        self._summary["best_validation_log_probs"].append(
+            trainer.best_validation_log_prob
+        )
+        self._summary["stop_reasons"].append(trainer.stop_reason)
+
+    def _simulate(
+        self, parameter_sample_fn: Callable, num_samples: int
+    ) -> Tuple[Tensor, Tensor]:
+        """Return parameters and simulated data for `num_samples` parameter sets.
+
+        Runs `simulate_in_batches` with the simulation settings of this object. The
+        time spent sampling parameters and simulating is added to the summary.
+
+        Args:
+            parameter_sample_fn: function to call for generating parameters, e.g. prior
+                sampling.
+            num_samples: number of simulations to run.
+
+        Raises:
+            ValueError: if no simulator was provided.
+        """
+
+        if self._simulator is None:
+            raise ValueError(
+                "No simulator was provided, so only appended simulations can be "
+                "trained on. Use `num_simulations_per_round=0` in the first round."
+            )
+
+        sampling_time = 0.0
+
+        def timed_parameter_sample_fn(num_samples: int) -> Tensor:
+            nonlocal sampling_time
+            start_time = time.perf_counter()
+            parameters = parameter_sample_fn(num_samples)
+            sampling_time += time.perf_counter() - start_time
+            return parameters
+
+        start_time = time.perf_counter()
+        failures = SimulationFailures()
+        # Worker processes are shared by tuning and the simulations that follow.
+        process_pool = simulation_process_pool(
+            self._simulator, self._simulation_executor, self._num_workers
+        )
+        try:
+            sample_fn = timed_parameter_sample_fn
+            if self._simulation_batch_size == "auto":
+                # Parameters are sampled once, and those not simulated while tuning
+                # are simulated next, e.g. to keep a space-filling design intact.
+                parameters = timed_parameter_sample_fn(num_samples).detach()
+                (
+                    tuned_parameters,
+                    tuned_xs,
+                    num_tuned,
+                ) = self._tune_simulation_batch_size(
+                    parameters, failures, process_pool
+                )
+                num_samples -= len(tuned_parameters)
+                if num_samples == 0:
+                    return tuned_parameters, tuned_xs
+                sample_fn = _presampled(parameters[num_tuned:], sample_fn)
+            else:
+                tuned_parameters, tuned_xs = None, None
+
+            parameters, xs = simulate_in_batches(
+                simulator=self._simulator,
+                parameter_sample_fn=sample_fn,
+                num_samples=num_samples,
+                simulation_batch_size=self._simulation_batch_size,
+                x_dim=self._true_observation.shape[1:],  # do not pass batch_dim
+                simulation_executor=self._simulation_executor,
+                num_workers=self._num_workers,
+                simulation_cache=self._simulation_cache,
+                max_retries=self._max_simulation_retries,
+                timeout=self._simulation_timeout,
+                failures=failures,
+                x_dtype=self._simulation_dtype,
+                process_pool=process_pool,
+            )
+        finally:
+            process_pool.close()
+            self._record_simulation_failures(failures)
+            self._add_to_round_summary("proposal_sampling_times", sampling_time)
+            self._add_to_round_summary(
+                "simulation_times", time.perf_counter() - start_time - sampling_time
+            )
+
+        if tuned_parameters is not None:
+            parameters = torch.cat((tuned_parameters, parameters))
+            xs = torch.cat((tuned_xs, xs))
+        return parameters, xs
+
+    def _tune_simulation_batch_size(
+        self,
+        parameters: Tensor,
+        failures: SimulationFailures,
+        process_pool: SimulationProcessPool,
+    ) -> Tuple[Tensor, Tensor, int]:
+        """Set the simulation batch size with the highest throughput.
+
+        Tunes on the first of `parameters` with the worker processes of the round,
+        and returns the valid simulations run while tuning and the number of
+        parameters simulated.
+        """
+
+        batch_size, xs, throughputs = tune_simulation_batch_size(
+            self._simulator,
+            parameters,
+            x_dim=self._true_observation.shape[1:],
+            simulation_executor=self._simulation_executor,
+            num_workers=self._num_workers,
+            max_batch_memory_bytes=self._max_batch_memory_bytes,
+            max_retries=self._max_simulation_retries,
+            timeout=self._simulation_timeout,
+            failures=failures,
+            x_dtype=self._simulation_dtype,
+            simulation_cache=self._simulation_cache,
+            process_pool=process_pool,
+        )
+        self._simulation_batch_size = batch_size
+        self._summary["simulation_batch_size"] = batch_size
+        self._summary["simulation_throughputs"] = throughputs
+
+        parameters = parameters[: len(xs)]
+        valid = is_valid(xs)
+        if not valid.all():
+            failures.quarantine(parameters[~valid], xs[~valid])
+        return parameters[valid], xs[valid], len(xs)
+
+    def _record_simulation_failures(self, failures: SimulationFailures) -> None:
+        """Add failure counts to the summary of the current round and quarantine
+        invalid simulations."""
+
+        counts = dict(
+            num_failed_simulation_calls=failures.num_failed_calls,
+            num_simulation_retries=failures.num_retries,
+            num_invalid_simulations=failures.num_invalid,
+        )
+        for key, count in counts.items():
+            self._add_to_round_summary(key, count)
+
+        for parameters, observations in zip(failures.parameters, failures.observations):
+            self._quarantine.extend(parameters=parameters, observations=observations)
+
+    def _add_to_round_summary(self, key: str, value: float) -> None:
+        """Add a count or duration to the summary entry of the current round.
+
+        Phases may run several times per round, e.g. training when streaming, or not
+        at all, so entries are accumulated and missing rounds are filled with zeros.
+        """
+        per_round = self._summary[key]
+        per_round.extend([0] * (self._round + 1 - len(per_round)))
+        per_round[self._round] += value
+
+    def _end_phase(self, key: str, start_time: float) -> None:
+        """Add the time since `start_time` to the summary entry `key` of the current
+        round, and record it as a profiling span named after the phase.
+
+        Args:
+            key: summary entry of the phase, e.g. 'training_times'.
+            start_time: start of the phase, in seconds of `time.perf_counter`.
+        """
+        end_time = time.perf_counter()
+        self._add_to_round_summary(key, end_time - start_time)
+        add_span(key[: -len("_times")], start_time, end_time, round=self._round)
+
+
+def _presampled(
+    parameters: Tensor, parameter_sample_fn: Callable[[int], Tensor]
+) -> Callable[[int], Tensor]:
+    """Return a sampler handing out `parameters` in order, and sampling with
+    `parameter_sample_fn` once they are used up, e.g. to replace invalid
+    simulations of presampled parameters."""
+
+    remaining = parameters
+
+    def sample(num_samples: int) -> Tensor:
+        nonlocal remaining
+        samples, remaining = remaining[:num_samples], remaining[num_samples:]
+        if len(samples) < num_samples:
+            new_samples = parameter_sample_fn(num_samples - len(samples))
+            samples = torch.cat((samples, new_samples.detach()))
+        return samples
+
+    return sample
+
+
+class _RoundSummaryHook(TrainingHook):
+    """Adds the training and validation times and forward passes of a trainer to the
+    summary of the current round of an inference."""
+
+    def __init__(self, inference: NeuralInference):
+        self._inference = inference
+        self._num_batches = 0
+
+    def on_epoch_end(self, trainer: Trainer, start_time: float) -> None:
+        self._inference._end_phase("training_times", start_time)
+        self._add_forward_passes(trainer)
+
+    def on_validation_end(
+        self, trainer: Trainer, start_time: float, validation_log_prob: float
+    ) -> None:
+        self._inference._end_phase("validation_times", start_time)
+        self._add_forward_passes(trainer)
+
+    def _add_forward_passes(self, trainer: Trainer) -> None:
+        """Add the batches run since the last callback, one forward pass each."""
+        num_batches = trainer.num_train_batches + trainer.num_validation_batches
+        self._inference._add_to_round_summary(
+            "num_forward_passes", num_batches - self._num_batches
         )
+        self._num_batches = num_batches
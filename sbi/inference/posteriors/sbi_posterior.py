@@ -1,3 +1,4 @@
+from collections import Counter
 from typing import Callable, Optional
 from warnings import warn
 
@@ -10,12 +11,71 @@ from torch import multiprocessing as mp
 
 from sbi.mcmc import Slice, SliceSampler
 import sbi.utils as utils
+from sbi.utils.profiling import span
 from sbi.utils.torchutils import atleast_2d
 
 
 NEG_INF = torch.tensor(float("-inf"), dtype=torch.float32)
 
 
+class PotentialStatistics:
+    """Counts and timings of the evaluations of a potential function.
+
+    Potential function providers keep a record of the evaluations of the potential
+    functions they return, see `Posterior.potential_statistics`.
+
+    Attributes:
+        num_calls: number of calls of the potential function.
+        num_evaluations: number of parameter sets evaluated, over all calls.
+        num_outside_prior: number of parameter sets outside the prior support, whose
+            potential is infinite.
+        batch_sizes: number of calls per number of parameter sets in a call.
+        network_time: seconds spent evaluating the neural net.
+        prior_time: seconds spent evaluating the prior.
+    """
+
+    def __init__(self):
+        self.num_calls = 0
+        self.num_evaluations = 0
+        self.num_outside_prior = 0
+        self.batch_sizes = Counter()
+        self.network_time = 0.0
+        self.prior_time = 0.0
+
+    def record(self, log_prior: Tensor, prior_time: float, network_time: float):
+        """Record a call of the potential function.
+
+        Args:
+            log_prior: prior log probabilities of the parameters of the call.
+            prior_time: seconds spent evaluating the prior.
+            network_time: seconds spent evaluating the neural net.
+        """
+        batch_size = log_prior.numel()
+        self.num_calls += 1
+        self.num_evaluations += batch_size
+        self.num_outside_prior += int((~torch.isfinite(log_prior)).sum())
+        self.batch_sizes[batch_size] += 1
+        self.prior_time += prior_time
+        self.network_time += network_time
+
+    @property
+    def mean_batch_size(self) -> float:
+        return self.num_evaluations / max(self.num_calls, 1)
+
+    @property
+    def fraction_outside_prior(self) -> float:
+        return self.num_outside_prior / max(self.num_evaluations, 1)
+
+    def __repr__(self) -> str:
+        return (
+            f"PotentialStatistics(num_calls={self.num_calls}, "
+            f"num_evaluations={self.num_evaluations}, "
+            f"fraction_outside_prior={self.fraction_outside_prior:.3f}, "
+            f"network_time={self.network_time:.3f}, "
+            f"prior_time={self.prior_time:.3f})"
+        )
+
+
 class Posterior:
     """Posterior with evaluation and sampling methods.
     
@@ -187,6 +247,15 @@ class Posterior:
         else:
             return torch.as_tensor(self._leakage_density_correction_factor)
 
+    @property
+    def potential_statistics(self) -> Optional[PotentialStatistics]:
+        """Evaluations of the potential function by the last MCMC run of `sample`,
+        None before the first one.
+
+        Evaluations in the worker processes of parallel chains are not counted.
+        """
+        return getattr(self._get_potential_function, "statistics", None)
+
     def sample(self, num_samples: int, context: Tensor = None, **kwargs) -> Tensor:
         """
         Return samples from posterior distribution.
@@ -202,19 +271,20 @@ class Posterior:
 
         context = self._context if context is None else atleast_2d(context)
 
-        if self._sample_with_mcmc:
-            return self._sample_posterior_mcmc(
-                context=context,
-                num_samples=num_samples,
-                mcmc_method=self._mcmc_method,
-                **kwargs,
-            )
-        else:
-            # rejection sampling
-            samples, _ = utils.sample_posterior_within_prior(
-                self.neural_net, self._prior, context, num_samples=num_samples
-            )
-            return samples
+        with span("posterior_sample", num_samples=num_samples):
+            if self._sample_with_mcmc:
+                return self._sample_posterior_mcmc(
+                    context=context,
+                    num_samples=num_samples,
+                    mcmc_method=self._mcmc_method,
+                    **kwargs,
+                )
+            else:
+                # rejection sampling
+                samples, _ = utils.sample_posterior_within_prior(
+                    self.neural_net, self._prior, context, num_samples=num_samples
+                )
+                return samples
 
     def _sample_posterior_mcmc(
         self,
@@ -351,7 +421,8 @@ class Posterior:
             num_chains=num_chains,
             mp_context="fork",
         )
-        sampler.run()
+        with span("pyro_mcmc", method=mcmc_method, num_chains=num_chains):
+            sampler.run()
         samples = next(iter(sampler.get_samples().values())).reshape(
             -1, len(self._prior.mean)  # len(prior.mean) = dim of theta
         )
@@ -0,0 +1,214 @@
+import os
+import tempfile
+from typing import Dict, List, Optional
+
+import numpy as np
+import torch
+from torch import Tensor
+
+SIMULATION_BANK_STORAGES = ("memory", "memmap")
+
+
+class SimulationBank:
+    """Append-only storage of simulations, organized in rounds.
+
+    Every field, e.g. parameters and observations, is stored in a single preallocated
+    tensor whose capacity is doubled whenever it runs full. Appending a round thus
+    copies the existing simulations only O(log N) times in total, and all rounds from
+    a given round on are available as a view into the storage, without copying.
+
+    Views returned by the bank are only valid until the next append, which might move
+    the storage.
+
+    With a `dtype`, floating point fields are stored in that dtype, whatever the
+    dtype of the appended tensors. They are converted while being copied into the
+    storage, such that e.g. float64 simulator outputs are never copied twice.
+
+    With `storage='memmap'`, every field is backed by a memory-mapped file on disk
+    instead of RAM. The operating system then pages simulations in and out as
+    minibatches are read, such that the bank can grow beyond the available memory.
+    """
+
+    def __init__(
+        self,
+        initial_capacity: int = 1024,
+        storage: str = "memory",
+        directory: Optional[str] = None,
+        dtype: Optional[torch.dtype] = None,
+    ):
+        """
+        Args:
+            initial_capacity: number of simulations to preallocate storage for.
+            storage: one of 'memory' or 'memmap'.
+            directory: directory for the files of a 'memmap' bank, ideally on a
+                fast local disk. If None, the system's temporary directory is used,
+                which is held in memory on some systems.
+            dtype: dtype of floating point fields. If None, fields keep the dtype
+                of the first tensors appended.
+        """
+
+        if storage not in SIMULATION_BANK_STORAGES:
+            raise ValueError(
+                f"`storage` must be one of {SIMULATION_BANK_STORAGES}, but is "
+                f"'{storage}'."
+            )
+
+        self._capacity = initial_capacity
+        self._storage_type = storage
+        self._dtype = dtype
+        self._storage: Dict[str, Tensor] = {}
+        self._num_simulations = 0
+        self._round_starts: List[int] = []
+
+        self._directory = directory
+        if storage == "memmap" and directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def __len__(self) -> int:
+        return self._num_simulations
+
+    @property
+    def num_rounds(self) -> int:
+        return len(self._round_starts)
+
+    @property
+    def fields(self) -> List[str]:
+        return list(self._storage.keys())
+
+    def append_round(self, **fields: Tensor) -> None:
+        """Store the simulations of a new round.
+
+        Args:
+            fields: tensors with one row per simulation, e.g.
+                `parameters=theta, observations=x`. All rounds must have the same
+                fields, with the same shape except for the leading dimension.
+        """
+
+        self._check_fields(fields)
+        self._round_starts.append(self._num_simulations)
+        self.extend(**fields)
+
+    def extend(self, **fields: Tensor) -> None:
+        """Add simulations to the most recent round, or to a new first round.
+
+        Args:
+            fields: tensors with one row per simulation, see `append_round`.
+        """
+
+        num_new = self._check_fields(fields)
+
+        if not self._round_starts:
+            self._round_starts.append(0)
+        self._reserve(self._num_simulations + num_new)
+        for name, values in fields.items():
+            self._storage[name][
+                self._num_simulations : self._num_simulations + num_new
+            ] = values.detach()
+        self._num_simulations += num_new
+
+    def get(self, name: str, start_round: int = 0) -> Tensor:
+        """Return a view of field `name` for all rounds from `start_round` on.
+
+        Args:
+            name: name of the field, e.g. 'parameters'.
+            start_round: first round to include. Negative values count from the end.
+        """
+        start = self._round_starts[start_round] if self.num_rounds else 0
+        return self._storage[name][start : self._num_simulations]
+
+    def get_round(self, name: str, round_: int) -> Tensor:
+        """Return a view of field `name` for a single round.
+
+        Args:
+            name: name of the field, e.g. 'parameters'.
+            round_: index of the round. Negative values count from the end.
+        """
+        round_ = range(self.num_rounds)[round_]
+        start = self._round_starts[round_]
+        end = (
+            self._round_starts[round_ + 1]
+            if round_ + 1 < self.num_rounds
+            else self._num_simulations
+        )
+        return self._storage[name][start:end]
+
+    def round_indices(self, start_round: int = 0) -> Tensor:
+        """Return the round of every simulation in the views returned by `get`.
+
+        Args:
+            start_round: first round of the view. Negative values count from the end.
+        """
+        if not self.num_rounds:
+            return torch.zeros(0, dtype=torch.long)
+        start_round = range(self.num_rounds)[start_round]
+        starts = torch.tensor(self._round_starts[start_round:] + [len(self)])
+        return torch.arange(start_round, self.num_rounds).repeat_interleave(
+            starts[1:] - starts[:-1]
+        )
+
+    def rounds(self, name: str) -> List[Tensor]:
+        """Return a list with a view of field `name` for every round."""
+        return [self.get_round(name, round_) for round_ in range(self.num_rounds)]
+
+    def _check_fields(self, fields: Dict[str, Tensor]) -> int:
+        num_new = {values.shape[0] for values in fields.values()}
+        if len(num_new) != 1:
+            raise ValueError("All fields must have the same number of simulations.")
+
+        if self._storage:
+            if set(fields) != set(self._storage):
+                raise ValueError(
+                    f"Expected fields {sorted(self._storage)}, got {sorted(fields)}."
+                )
+            for name, values in fields.items():
+                if values.shape[1:] != self._storage[name].shape[1:]:
+                    raise ValueError(
+                        f"Field '{name}' has shape {values.shape[1:]} per simulation, "
+                        f"expected {self._storage[name].shape[1:]}."
+                    )
+        else:
+            for name, values in fields.items():
+                dtype = values.dtype
+                if self._dtype is not None and dtype.is_floating_point:
+                    dtype = self._dtype
+                self._storage[name] = self._allocate(
+                    self._capacity, values.shape[1:], dtype
+                )
+
+        return num_new.pop()
+
+    def _reserve(self, num_simulations: int) -> None:
+        """Grow the storage such that it can hold `num_simulations` simulations."""
+
+        if num_simulations <= self._capacity:
+            return
+
+        self._capacity = max(num_simulations, 2 * self._capacity)
+        for name, old_storage in self._storage.items():
+            new_storage = self._allocate(
+                self._capacity, old_storage.shape[1:], old_storage.dtype
+            )
+            new_storage[: self._num_simulations] = old_storage[: self._num_simulations]
+            self._storage[name] = new_storage
+
+    def _allocate(
+        self, capacity: int, shape: torch.Size, dtype: Optional[torch.dtype]
+    ) -> Tensor:
+        if self._storage_type == "memory":
+            return torch.empty((capacity, *shape), dtype=dtype)
+
+        # The file is unlinked right after mapping it: its disk space stays in use as
+        # long as the storage or views of it are alive, and is released afterwards
+        # even if the process dies.
+        fd, path = tempfile.mkstemp(
+            prefix="simulation-bank-", suffix=".dat", dir=self._directory
+        )
+        os.close(fd)
+        numpy_dtype = torch.empty(0, dtype=dtype).numpy().dtype
+        try:
+            memmap = np.memmap(
+                path, dtype=numpy_dtype, mode="w+", shape=(capacity, *shape)
+            )
+        finally:
+            os.remove(path)
+        return torch.from_numpy(memmap)
@@ -1,23 +1,19 @@
 from __future__ import annotations
 
-from copy import deepcopy
-from typing import Any, Callable, Dict, List, Optional, Union
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 import numpy as np
 import torch
 from pyro.infer.mcmc import HMC, NUTS
 from pyro.infer.mcmc.api import MCMC
 from torch import Tensor, nn, optim
-from torch.nn.utils import clip_grad_norm_
-from torch.utils import data
-from torch.utils.data.sampler import SubsetRandomSampler
 from torch.utils.tensorboard import SummaryWriter
 from tqdm import tqdm
 
-import sbi.simulators as simulators
 import sbi.utils as utils
 from sbi.inference.base import NeuralInference
-from sbi.inference.posteriors.sbi_posterior import Posterior
+from sbi.inference.posteriors.sbi_posterior import Posterior, PotentialStatistics
 
 
 class SNL(NeuralInference):
@@ -27,27 +23,31 @@ class SNL(NeuralInference):
         prior,
         true_observation: Tensor,
         density_estimator: Optional[nn.Module],
-        simulation_batch_size: int = 1,
+        simulation_batch_size: Union[int, str] = 1,
         summary_writer: SummaryWriter = None,
         device: torch.device = None,
         mcmc_method: str = "slice-np",
+        **kwargs,
     ):
         r"""Sequential Neural Likelihood
         
         Implementation of
         _Sequential Neural Likelihood: Fast Likelihood-free Inference with Autoregressive Flows_ by Papamakarios et al., AISTATS 2019, https://arxiv.org/abs/1805.07226
 
+        See NeuralInference docstring for all other arguments.
+
         Args:
             density_estimator: Conditional density estimator $q(x|\theta)$, a nn.Module with `log_prob` and `sample` methods
         """
 
         super().__init__(
-            simulator,
-            prior,
-            true_observation,
-            simulation_batch_size,
-            device,
-            summary_writer,
+            simulator=simulator,
+            prior=prior,
+            true_observation=true_observation,
+            simulation_batch_size=simulation_batch_size,
+            device=device,
+            summary_writer=summary_writer,
+            **kwargs,
         )
 
         if density_estimator is None:
@@ -68,9 +68,6 @@ class SNL(NeuralInference):
         # XXX why not density_estimator.train(True)???
         self._neural_posterior.neural_net.train(True)
 
-        # SNL-specific summary_writer fields
-        self._summary.update({"mcmc_times": []})
-
     def __call__(
         self,
         num_rounds: int,
@@ -79,6 +76,11 @@ class SNL(NeuralInference):
         learning_rate: float = 5e-4,
         validation_fraction: float = 0.1,
         stop_after_epochs: int = 20,
+        max_num_epochs: Optional[int] = None,
+        max_training_seconds: Optional[float] = None,
+        max_num_steps: Optional[int] = None,
+        stop_tolerance: float = 0.0,
+        validation_smoothing: float = 0.0,
     ) -> Posterior:
         """Run SNL
 
@@ -86,19 +88,30 @@ class SNL(NeuralInference):
         the simulator
         
         Args:
-            num_rounds: Number of rounds to run
+            num_rounds: Number of rounds to run. Repeated calls continue with the
+                next round.
             num_simulations_per_round: Number of simulator calls per round
             batch_size: Size of batch to use for training.
             learning_rate: Learning rate for Adam optimizer.
             validation_fraction: The fraction of data to use for validation.
             stop_after_epochs: The number of epochs to wait for improvement on the
                 validation set before terminating training.
+            max_num_epochs: Maximal number of training epochs per round.
+            max_training_seconds: Maximal training time per round in seconds. It is
+                checked after every gradient step, and the last epoch is validated
+                before training stops.
+            max_num_steps: Maximal number of gradient steps per round.
+            stop_tolerance: Relative improvement of the validation performance below
+                which it does not count as improvement for `stop_after_epochs`.
+            validation_smoothing: Factor in [0, 1) of the exponential moving average
+                of the validation performance that is checked for improvement, to
+                stop on the trend of a noisy validation curve.
 
         Returns:
             Posterior that can be sampled and evaluated
         """
         round_description = ""
-        tbar = tqdm(range(num_rounds))
+        tbar = tqdm(range(self._round, self._round + num_rounds))
         for round_ in tbar:
 
             tbar.set_description(round_description)
@@ -106,36 +119,34 @@ class SNL(NeuralInference):
             # Generate parameters from prior in first round, and from most recent posterior
             # estimate in subsequent rounds.
             if round_ == 0:
-                parameters, observations = simulators.simulate_in_batches(
-                    simulator=self._simulator,
-                    parameter_sample_fn=lambda num_samples: self._prior.sample(
-                        (num_samples,)
-                    ),
-                    num_samples=num_simulations_per_round,
-                    simulation_batch_size=self._simulation_batch_size,
-                    x_dim=self._true_observation.shape[1:],  # do not pass batch_dim
-                )
+                parameter_sample_fn = self._prior_design.sample
             else:
-                parameters, observations = simulators.simulate_in_batches(
-                    simulator=self._simulator,
-                    parameter_sample_fn=lambda num_samples: self._neural_posterior.sample(
-                        num_samples
-                    ),
-                    num_samples=num_simulations_per_round,
-                    simulation_batch_size=self._simulation_batch_size,
-                    x_dim=self._true_observation.shape[1:],  # do not pass batch_dim
+                parameter_sample_fn = lambda num_samples: self._neural_posterior.sample(
+                    num_samples
                 )
 
-            # Store (parameter, observation) pairs.
-            self._parameter_bank.append(torch.as_tensor(parameters))
-            self._observation_bank.append(torch.as_tensor(observations))
+            # Simulate and store (parameter, observation) pairs. The first round may
+            # consist of appended simulations only.
+            self._simulate_round(
+                round_,
+                parameter_sample_fn=parameter_sample_fn,
+                num_samples=num_simulations_per_round,
+            )
 
             # Fit neural likelihood to newly aggregated dataset.
-            self._train(
-                batch_size=batch_size,
-                learning_rate=learning_rate,
-                validation_fraction=validation_fraction,
-                stop_after_epochs=stop_after_epochs,
+            # When streaming, this resumes training as further simulations finish.
+            self._train_on_simulation_stream(
+                lambda: self._train(
+                    batch_size=batch_size,
+                    learning_rate=learning_rate,
+                    validation_fraction=validation_fraction,
+                    stop_after_epochs=stop_after_epochs,
+                    max_num_epochs=max_num_epochs,
+                    max_training_seconds=max_training_seconds,
+                    max_num_steps=max_num_steps,
+                    stop_tolerance=stop_tolerance,
+                    validation_smoothing=validation_smoothing,
+                )
             )
 
             # Update description for progress bar.
@@ -153,116 +164,82 @@ class SNL(NeuralInference):
                 summary=self._summary,
                 round_=round_,
                 true_observation=self._true_observation,
-                parameter_bank=self._parameter_bank,
-                observation_bank=self._observation_bank,
+                parameter_bank=self._simulation_bank.rounds("parameters"),
+                observation_bank=self._simulation_bank.rounds("observations"),
                 simulator=self._simulator,
             )
 
-        self._neural_posterior._num_trained_rounds = num_rounds
+            self._round = round_ + 1
+
+        self._neural_posterior._num_trained_rounds = self._round
         return self._neural_posterior
 
-    def _train(self, batch_size, learning_rate, validation_fraction, stop_after_epochs):
+    def _train(
+        self,
+        batch_size,
+        learning_rate,
+        validation_fraction,
+        stop_after_epochs,
+        max_num_epochs,
+        max_training_seconds,
+        max_num_steps,
+        stop_tolerance,
+        validation_smoothing,
+    ):
         """
         Trains the conditional density estimator for the likelihood by maximum likelihood
         on the most recently aggregated bank of (parameter, observation) pairs.
         Uses early stopping on a held-out validation set as a terminating condition.
         """
 
-        # Get total number of training examples.
-        num_examples = torch.cat(self._parameter_bank).shape[0]
+        # Views of the simulations to train on.
+        parameters = self._simulation_bank.get("parameters")
+        observations = self._simulation_bank.get("observations")
 
         # Select random train and validation splits from (parameter, observation) pairs.
-        permuted_indices = torch.randperm(num_examples)
-        num_training_examples = int((1 - validation_fraction) * num_examples)
-        num_validation_examples = num_examples - num_training_examples
-        train_indices, val_indices = (
-            permuted_indices[:num_training_examples],
-            permuted_indices[num_training_examples:],
-        )
-
-        # Dataset is shared for training and validation loaders.
-        dataset = data.TensorDataset(
-            torch.cat(self._observation_bank), torch.cat(self._parameter_bank)
-        )
-
-        # Create neural_net and validation loaders using a subset sampler.
-        train_loader = data.DataLoader(
-            dataset,
+        train_indices, val_indices = self._split_simulations(validation_fraction)
+        num_training_examples = len(train_indices)
+        num_validation_examples = len(val_indices)
+
+        # Training and validation batches are gathered from the same tensors.
+        tensors = (observations, parameters)
+        train_loader = utils.TensorBatches(
+            tensors,
+            train_indices,
             batch_size=min(batch_size, num_training_examples),
             drop_last=True,
-            sampler=SubsetRandomSampler(train_indices),
         )
-        val_loader = data.DataLoader(
-            dataset,
+        val_loader = utils.TensorBatches(
+            tensors,
+            val_indices,
             batch_size=min(batch_size, num_validation_examples),
             shuffle=False,
-            drop_last=False,
-            sampler=SubsetRandomSampler(val_indices),
         )
 
         optimizer = optim.Adam(
             self._neural_posterior.neural_net.parameters(), lr=learning_rate
         )
-        # Keep track of best_validation log_prob seen so far.
-        best_validation_log_prob = -1e100
-        # Keep track of number of epochs since last improvement.
-        epochs_since_last_improvement = 0
-        # Keep track of model with best validation performance.
-        best_model_state_dict = None
-
-        epochs = 0
-        while True:
-
-            # Train for a single epoch.
-            self._neural_posterior.neural_net.train()
-            for batch in train_loader:
-                optimizer.zero_grad()
-                inputs, context = batch[0].to(self._device), batch[1].to(self._device)
-                log_prob = self._neural_posterior.neural_net.log_prob(
-                    inputs, context=context
-                )
-                loss = -torch.mean(log_prob)
-                loss.backward()
-                clip_grad_norm_(
-                    self._neural_posterior.neural_net.parameters(), max_norm=5.0
-                )
-                optimizer.step()
-
-            epochs += 1
-
-            # Calculate validation performance.
-            self._neural_posterior.neural_net.eval()
-            log_prob_sum = 0
-            with torch.no_grad():
-                for batch in val_loader:
-                    inputs, context = (
-                        batch[0].to(self._device),
-                        batch[1].to(self._device),
-                    )
-                    log_prob = self._neural_posterior.neural_net.log_prob(
-                        inputs, context=context
-                    )
-                    log_prob_sum += log_prob.sum().item()
-            validation_log_prob = log_prob_sum / num_validation_examples
-
-            # Check for improvement in validation performance over previous epochs.
-            if validation_log_prob > best_validation_log_prob:
-                best_validation_log_prob = validation_log_prob
-                epochs_since_last_improvement = 0
-                best_model_state_dict = deepcopy(
-                    self._neural_posterior.neural_net.state_dict()
-                )
-            else:
-                epochs_since_last_improvement += 1
 
-            # If no validation improvement over many epochs, stop training.
-            if epochs_since_last_improvement > stop_after_epochs - 1:
-                self._neural_posterior.neural_net.load_state_dict(best_model_state_dict)
-                break
-
-        # Update summary.
-        self._summary["epochs"].append(epochs)
-        self._summary["best_validation_log_probs"].append(best_validation_log_prob)
+        def loss_fn(inputs, context):
+            log_prob = self._neural_posterior.neural_net.log_prob(
+                inputs, context=context
+            )
+            return -torch.mean(log_prob)
+
+        self._fit(
+            self._neural_posterior.neural_net,
+            optimizer,
+            loss_fn,
+            train_loader,
+            val_loader,
+            stop_after_epochs,
+            clip_max_norm=5.0,
+            max_num_epochs=max_num_epochs,
+            max_training_seconds=max_training_seconds,
+            max_num_steps=max_num_steps,
+            stop_tolerance=stop_tolerance,
+            validation_smoothing=validation_smoothing,
+        )
 
     @property
     def summary(self):
@@ -307,6 +284,7 @@ class PotentialFunctionProvider:
         self.likelihood_nn = likelihood_nn
         self.prior = prior
         self.observation = observation
+        self.statistics = PotentialStatistics()
 
         if mcmc_method in ("slice", "hmc", "nuts"):
             return self.pyro_potential
@@ -323,12 +301,10 @@ class PotentialFunctionProvider:
             Posterior log probability of the parameters, -Inf if impossible under prior.
         """
         parameters = torch.as_tensor(parameters, dtype=torch.float32)
-        log_likelihood = self.likelihood_nn.log_prob(
-            inputs=self.observation.reshape(1, -1), context=parameters.reshape(1, -1)
-        )
+        log_likelihood, log_prior = self._evaluate(parameters)
 
         # notice opposite sign to pyro potential
-        return log_likelihood + self.prior.log_prob(parameters)
+        return log_likelihood + log_prior
 
     def pyro_potential(self, parameters: Dict[str, Tensor]) -> Tensor:
         """Return posterior log prob. of parameters.
@@ -341,9 +317,23 @@ class PotentialFunctionProvider:
         """
 
         parameter = next(iter(parameters.values()))
+        log_likelihood, log_prior = self._evaluate(parameter)
+
+        return -(log_likelihood + log_prior)
 
+    def _evaluate(self, parameter: Tensor) -> Tuple[Tensor, Tensor]:
+        """Return log likelihood and prior log probability of a parameter set, and
+        record the evaluation in `statistics`."""
+
+        start_time = time.perf_counter()
         log_likelihood = self.likelihood_nn.log_prob(
             inputs=self.observation.reshape(1, -1), context=parameter.reshape(1, -1)
         )
-
-        return -(log_likelihood + self.prior.log_prob(parameter))
+        network_end_time = time.perf_counter()
+        log_prior = self.prior.log_prob(parameter)
+        self.statistics.record(
+            log_prior,
+            time.perf_counter() - network_end_time,
+            network_end_time - start_time,
+        )
+        return log_likelihood, log_prior
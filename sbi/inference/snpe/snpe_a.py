@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import os
+from typing import Union
 
 import torch
 from torch import distributions
@@ -20,17 +21,20 @@ class SnpeA(SnpeBase):
         density_estimator="maf",
         use_combined_loss=False,
         z_score_obs=True,
-        simulation_batch_size: int = 1,
+        simulation_batch_size: Union[int, str] = 1,
         retrain_from_scratch_each_round=False,
         discard_prior_samples=False,
         summary_writer=None,
         device=None,
+        **kwargs,
     ):
         """SNPE-A
 
         Implementation of _Fast epsilon-free Inference of Simulation Models with Bayesian Conditional Density Estimation_ by Papamakarios et al., NeurIPS 2016, 
         https://arxiv.org/abs/1605.06376
-        
+
+        See NeuralInference docstring for all other arguments.
+
         Args:
             num_pilot_samples: number of simulations that are run when
                 instantiating an object. Used to z-score the observations.   
@@ -56,6 +60,7 @@ class SnpeA(SnpeBase):
             retrain_from_scratch_each_round=retrain_from_scratch_each_round,
             discard_prior_samples=discard_prior_samples,
             device=device,
+            **kwargs,
         )
 
     def _get_log_prob_proposal_posterior(self, inputs, context, masks):
@@ -93,12 +98,7 @@ class SnpeA(SnpeBase):
         # we sample without replacement num_atoms - 1 times from the rest
         # of the parameters in the batch.
         assert 0 < num_atoms - 1 < batch_size
-        probs = (
-            (1 / (batch_size - 1))
-            * torch.ones(batch_size, batch_size)
-            * (1 - torch.eye(batch_size))
-        )
-        choices = torch.multinomial(probs, num_samples=num_atoms - 1, replacement=False)
+        choices = utils.sample_contrasting_indices(batch_size, num_atoms - 1)
         contrasting_inputs = inputs[choices]
 
         # We can now create our sets of atoms from the contrasting parameter sets
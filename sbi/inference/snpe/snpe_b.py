@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import os
+from typing import Union
 
 import torch
 from torch import distributions
@@ -21,16 +22,19 @@ class SnpeB(SnpeBase):
         calibration_kernel=None,
         use_combined_loss=False,
         z_score_obs=True,
-        simulation_batch_size: int = 1,
+        simulation_batch_size: Union[int, str] = 1,
         retrain_from_scratch_each_round=False,
         discard_prior_samples=False,
         summary_writer=None,
         device=None,
+        **kwargs,
     ):
         """
 
         Implementation of __Flexible statistical inference for mechanistic models of neural dynamics__ by Lueckmann et al., NeurIPS 2017, https://arxiv.org/abs/1711.01861
-        
+
+        See NeuralInference docstring for all other arguments.
+
         Args:
             num_pilot_samples: number of simulations that are run when
                 instantiating an object. Used to z-score the observations.   
@@ -58,6 +62,7 @@ class SnpeB(SnpeBase):
             retrain_from_scratch_each_round=retrain_from_scratch_each_round,
             discard_prior_samples=discard_prior_samples,
             device=device,
+            **kwargs,
         )
 
     def _get_log_prob_proposal_posterior(
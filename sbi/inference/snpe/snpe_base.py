@@ -1,3 +1,4 @@
+import time
 import warnings
 from abc import ABC
 from copy import deepcopy
@@ -8,16 +9,12 @@ import torch
 from pyknos.mdn.mdn import MultivariateGaussianMDN
 from torch import Tensor, float32, nn, optim
 from torch.distributions import Distribution
-from torch.nn.utils import clip_grad_norm_
-from torch.utils import data
-from torch.utils.data.sampler import SubsetRandomSampler
 from torch.utils.tensorboard import SummaryWriter
 from tqdm import tqdm
 
 import sbi.utils as utils
 from sbi.inference.base import NeuralInference
-from sbi.inference.posteriors.sbi_posterior import Posterior
-from sbi.simulators.simutils import simulate_in_batches
+from sbi.inference.posteriors.sbi_posterior import Posterior, PotentialStatistics
 from sbi.utils.torchutils import get_default_device
 
 
@@ -31,7 +28,7 @@ class SnpeBase(NeuralInference, ABC):
         density_estimator=None,
         calibration_kernel: Optional[Callable] = None,
         z_score_obs: bool = True,
-        simulation_batch_size: int = 1,
+        simulation_batch_size: Union[int, str] = 1,
         use_combined_loss: bool = False,
         retrain_from_scratch_each_round: bool = False,
         discard_prior_samples: bool = False,
@@ -39,6 +36,7 @@ class SnpeBase(NeuralInference, ABC):
         sample_with_mcmc: bool = False,
         mcmc_method: str = "slice-np",
         summary_writer: Optional[SummaryWriter] = None,
+        **kwargs,
     ):
         """
         See NeuralInference docstring for all other arguments.
@@ -58,12 +56,13 @@ class SnpeBase(NeuralInference, ABC):
         """
 
         super().__init__(
-            simulator,
-            prior,
-            true_observation,
-            simulation_batch_size,
-            device,
-            summary_writer,
+            simulator=simulator,
+            prior=prior,
+            true_observation=true_observation,
+            simulation_batch_size=simulation_batch_size,
+            device=device,
+            summary_writer=summary_writer,
+            **kwargs,
         )
 
         self.z_score_obs = z_score_obs
@@ -72,19 +71,18 @@ class SnpeBase(NeuralInference, ABC):
         self._use_combined_loss = use_combined_loss
         self._discard_prior_samples = discard_prior_samples
 
-        self._prior_masks = []
         self._model_bank = []
 
         self._retrain_from_scratch_each_round = retrain_from_scratch_each_round
 
-        # run prior samples
-        (self.pilot_parameters, self.pilot_observations,) = simulate_in_batches(
-            simulator=self._simulator,
-            parameter_sample_fn=lambda num_samples: self._prior.sample((num_samples,)),
-            num_samples=num_pilot_samples,
-            simulation_batch_size=self._simulation_batch_size,
-            x_dim=self._true_observation.shape[1:],  # do not pass batch_dim
-        )
+        # run prior samples, unless all simulations are provided by the user
+        if self._simulator is not None:
+            (self.pilot_parameters, self.pilot_observations,) = self._simulate(
+                parameter_sample_fn=self._prior_design.sample,
+                num_samples=num_pilot_samples,
+            )
+        else:
+            self.pilot_parameters, self.pilot_observations = None, None
 
         # create the deep neural density estimator
         if density_estimator is None:
@@ -103,12 +101,14 @@ class SnpeBase(NeuralInference, ABC):
         )
 
         # obtain z-score for observations and define embedding net
-        if self.z_score_obs:
-            self.obs_mean = torch.mean(self.pilot_observations, dim=0)
-            self.obs_std = torch.std(self.pilot_observations, dim=0)
+        if self.z_score_obs and self.pilot_observations is not None:
+            # Simulator outputs can be float64 until they are stored in the bank.
+            self.obs_mean = torch.mean(self.pilot_observations, dim=0).float()
+            self.obs_std = torch.std(self.pilot_observations, dim=0).float()
         else:
-            self.obs_mean = torch.zeros(self._true_observation.shape)
-            self.obs_std = torch.ones(self._true_observation.shape)
+            # Without pilot run, z-scores are set from appended simulations later.
+            self.obs_mean = torch.zeros(self._true_observation.shape[1:])
+            self.obs_std = torch.ones(self._true_observation.shape[1:])
 
         # new embedding_net contains z-scoring
         if not isinstance(self._neural_posterior.neural_net, MultivariateGaussianMDN):
@@ -144,20 +144,37 @@ class SnpeBase(NeuralInference, ABC):
         validation_fraction: float = 0.1,
         stop_after_epochs: int = 20,
         clip_grad_norm: bool = True,
+        max_num_epochs: Optional[int] = None,
+        max_training_seconds: Optional[float] = None,
+        max_num_steps: Optional[int] = None,
+        stop_tolerance: float = 0.0,
+        validation_smoothing: float = 0.0,
     ) -> Posterior:
         """Run SNPE
 
         Return posterior density after inference over several rounds.
 
         Args:
-            num_rounds: Number of rounds to run
-            num_simulations_per_round: Number of simulator calls per round
+            num_rounds: Number of rounds to run. Repeated calls continue with the
+                rounds after those already run.
+            num_simulations_per_round: Number of simulator calls per round. In the
+                first round, this includes the simulations of the pilot run.
             batch_size: Size of batch to use for training.
             learning_rate: Learning rate for Adam optimizer.
             validation_fraction: The fraction of data to use for validation.
             stop_after_epochs: The number of epochs to wait for improvement on the
                 validation set before terminating training.
             clip_grad_norm: Whether to clip norm of gradients or not.
+            max_num_epochs: Maximal number of training epochs per round.
+            max_training_seconds: Maximal training time per round in seconds. It is
+                checked after every gradient step, and the last epoch is validated
+                before training stops.
+            max_num_steps: Maximal number of gradient steps per round.
+            stop_tolerance: Relative improvement of the validation performance below
+                which it does not count as improvement for `stop_after_epochs`.
+            validation_smoothing: Factor in [0, 1) of the exponential moving average
+                of the validation performance that is checked for improvement, to
+                stop on the trend of a noisy validation curve.
             
         Returns:
             Posterior that can be sampled and evaluated.
@@ -169,23 +186,40 @@ class SnpeBase(NeuralInference, ABC):
         except TypeError:
             num_simulations_per_round = [num_simulations_per_round] * num_rounds
 
+        if self._round == 0 and self.pilot_observations is None:
+            self._z_score_from_appended_simulations()
+
         round_description = ""
-        tbar = tqdm(range(num_rounds))
+        first_round = self._round
+        tbar = tqdm(range(first_round, first_round + num_rounds))
         for round_ in tbar:
 
             tbar.set_description(round_description)
 
             # run simulations for the round
-            self._run_sims(round_, num_simulations_per_round[round_])
-
-            # Fit posterior using newly aggregated data set.
-            self._train(
-                round_=round_,
-                batch_size=batch_size,
-                learning_rate=learning_rate,
-                validation_fraction=validation_fraction,
-                stop_after_epochs=stop_after_epochs,
-                clip_grad_norm=clip_grad_norm,
+            self._run_sims(round_, num_simulations_per_round[round_ - first_round])
+
+            # If we're retraining from scratch each round, reset the neural posterior
+            # to the untrained copy we made at the start.
+            if self._retrain_from_scratch_each_round and round_ > 0:
+                self._neural_posterior = deepcopy(self._untrained_neural_posterior)
+
+            # Fit posterior using newly aggregated data set. When streaming, this
+            # resumes training as further simulations finish.
+            self._train_on_simulation_stream(
+                lambda: self._train(
+                    round_=round_,
+                    batch_size=batch_size,
+                    learning_rate=learning_rate,
+                    validation_fraction=validation_fraction,
+                    stop_after_epochs=stop_after_epochs,
+                    clip_grad_norm=clip_grad_norm,
+                    max_num_epochs=max_num_epochs,
+                    max_training_seconds=max_training_seconds,
+                    max_num_steps=max_num_steps,
+                    stop_tolerance=stop_tolerance,
+                    validation_smoothing=validation_smoothing,
+                )
             )
 
             # Store models at end of each round.
@@ -201,23 +235,43 @@ class SnpeBase(NeuralInference, ABC):
                 f"Best validation performance: {self._summary['best_validation_log_probs'][-1]:.4f}\n\n"
             )
 
+            start_time = time.perf_counter()
+            acceptance_rate = self._neural_posterior.get_leakage_correction(
+                context=self._true_observation
+            )
+            self._end_phase("leakage_estimation_times", start_time)
+
             # Update tensorboard and summary dict.
             self._summary_writer, self._summary = utils.summarize(
                 summary_writer=self._summary_writer,
                 summary=self._summary,
                 round_=round_,
                 true_observation=self._true_observation,
-                parameter_bank=self._parameter_bank,
-                observation_bank=self._observation_bank,
+                parameter_bank=self._simulation_bank.rounds("parameters"),
+                observation_bank=self._simulation_bank.rounds("observations"),
                 simulator=self._simulator,
-                posterior_samples_acceptance_rate=self._neural_posterior.get_leakage_correction(
-                    context=self._true_observation
-                ),
+                posterior_samples_acceptance_rate=acceptance_rate,
             )
 
-        self._neural_posterior._num_trained_rounds = num_rounds
+            self._round = round_ + 1
+
+        self._neural_posterior._num_trained_rounds = self._round
         return self._neural_posterior
 
+    def _z_score_from_appended_simulations(self):
+        """Set the z-scores of the observations from simulations appended by the user.
+
+        Used when there is no pilot run. The mean and standard deviation are updated
+        in place, since they are shared with the embedding net.
+        """
+        if not self.z_score_obs or len(self._simulation_bank) == 0:
+            return
+
+        observations = self._simulation_bank.get("observations")
+        self.obs_mean.copy_(torch.mean(observations, dim=0))
+        self.obs_std.copy_(torch.std(observations, dim=0))
+        self._untrained_neural_posterior = deepcopy(self._neural_posterior)
+
     def _get_log_prob_proposal_posterior(self, inputs, context, masks):
         """
         Evaluate the log-probability used for the loss. Depending on
@@ -243,51 +297,47 @@ class SnpeBase(NeuralInference, ABC):
             round_: int. Round
             num_simulations_per_round: int. Number of simulations in current round
 
-        Returns:
-            self._parameter_bank: torch.tensor. theta used for training
-            self._observation_bank: torch.tensor. x used for training
-            self._prior_masks: torch.tensor. Masks of 0/1 for each prior sample,
+        Stores in `self._simulation_bank`:
+            parameters: torch.tensor. theta used for training
+            observations: torch.tensor. x used for training
+            prior_masks: torch.tensor. Masks of 0/1 for each prior sample,
                 indicating whether prior sample will be used in current round
         """
         # Generate parameters from prior in first round, and from most recent posterior
         # estimate in subsequent rounds.
         if round_ == 0:
-            parameters, observations = simulate_in_batches(
-                simulator=self._simulator,
-                parameter_sample_fn=lambda num_samples: self._prior.sample(
-                    (num_samples,)
-                ),
-                num_samples=np.maximum(
-                    0, num_simulations_per_round - self._num_pilot_samples
-                ),
-                simulation_batch_size=self._simulation_batch_size,
-                x_dim=self._true_observation.shape[1:],  # do not pass batch_dim
-            )
-            parameters = torch.cat(
-                (parameters, self.pilot_parameters[:num_simulations_per_round]), dim=0
-            )
-            observations = torch.cat(
-                (observations, self.pilot_observations[:num_simulations_per_round]),
-                dim=0,
+            # Simulations of the pilot run are reused, if any.
+            self._simulate_round(
+                round_,
+                parameter_sample_fn=self._prior_design.sample,
+                num_samples=num_simulations_per_round
+                if self.pilot_parameters is None
+                else max(0, num_simulations_per_round - self._num_pilot_samples),
             )
+            if self.pilot_parameters is not None:
+                self._store_simulations(
+                    round_,
+                    self.pilot_parameters[:num_simulations_per_round],
+                    self.pilot_observations[:num_simulations_per_round],
+                )
         else:
-            parameters, observations = simulate_in_batches(
-                simulator=self._simulator,
+            self._simulate_round(
+                round_,
                 parameter_sample_fn=lambda num_samples: self._neural_posterior.sample(
                     num_samples, context=self._true_observation,
                 ),
                 num_samples=num_simulations_per_round,
-                simulation_batch_size=self._simulation_batch_size,
-                x_dim=self._true_observation.shape[1:],  # do not pass batch_dim
             )
 
-        # Store (parameter, observation) pairs.
-        self._parameter_bank.append(parameters)
-        self._observation_bank.append(observations)
-        self._prior_masks.append(
-            torch.ones(num_simulations_per_round, 1)
+    def _bank_fields(self, parameters, observations, round_):
+        """Adds masks of 0/1 for each simulation, indicating whether its parameters
+        were sampled from the prior."""
+        return dict(
+            parameters=parameters,
+            observations=observations,
+            prior_masks=torch.ones(len(parameters), 1)
             if round_ == 0
-            else torch.zeros(num_simulations_per_round, 1)
+            else torch.zeros(len(parameters), 1),
         )
 
     def _train(
@@ -298,6 +348,11 @@ class SnpeBase(NeuralInference, ABC):
         validation_fraction,
         stop_after_epochs,
         clip_grad_norm,
+        max_num_epochs,
+        max_training_seconds,
+        max_num_steps,
+        stop_tolerance,
+        validation_smoothing,
     ):
         """Train
 
@@ -311,129 +366,60 @@ class SnpeBase(NeuralInference, ABC):
         # get the start index for what training set to use. Either 0 or 1
         ix = int(self._discard_prior_samples and (round_ > 0))
 
-        # Get total number of training examples.
-        num_examples = torch.cat(self._parameter_bank[ix:]).shape[0]
-
-        # Select random neural_net and validation splits from (parameter, observation) pairs.
-        permuted_indices = torch.randperm(num_examples)
-        num_training_examples = int((1 - validation_fraction) * num_examples)
-        num_validation_examples = num_examples - num_training_examples
-        train_indices, val_indices = (
-            permuted_indices[:num_training_examples],
-            permuted_indices[num_training_examples:],
-        )
+        # Views of the simulations to train on.
+        parameters = self._simulation_bank.get("parameters", start_round=ix)
+        observations = self._simulation_bank.get("observations", start_round=ix)
+        prior_masks = self._simulation_bank.get("prior_masks", start_round=ix)
 
-        # Dataset is shared for training and validation loaders.
-        dataset = data.TensorDataset(
-            torch.cat(self._parameter_bank[ix:]),
-            torch.cat(self._observation_bank[ix:]),
-            torch.cat(self._prior_masks[ix:]),
+        # Select random train and validation splits from (parameter, observation) pairs.
+        train_indices, val_indices = self._split_simulations(
+            validation_fraction, start_round=ix
         )
-
-        # Create neural_net and validation loaders using a subset sampler.
-        train_loader = data.DataLoader(
-            dataset,
+        num_training_examples = len(train_indices)
+        num_validation_examples = len(val_indices)
+
+        # Training and validation batches are gathered from the same tensors.
+        tensors = (parameters, observations, prior_masks)
+        train_loader = utils.TensorBatches(
+            tensors,
+            train_indices,
             batch_size=min(batch_size, num_training_examples),
             drop_last=True,
-            sampler=SubsetRandomSampler(train_indices),
         )
-        val_loader = data.DataLoader(
-            dataset,
+        val_loader = utils.TensorBatches(
+            tensors,
+            val_indices,
             batch_size=min(batch_size, num_validation_examples),
             shuffle=False,
             drop_last=True,
-            sampler=SubsetRandomSampler(val_indices),
         )
 
         optimizer = optim.Adam(
             list(self._neural_posterior.neural_net.parameters()), lr=learning_rate,
         )
-        # Keep track of best_validation log_prob seen so far.
-        best_validation_log_prob = -1e100
-        # Keep track of number of epochs since last improvement.
-        epochs_since_last_improvement = 0
-        # Keep track of model with best validation performance.
-        best_model_state_dict = None
-
-        # If we're retraining from scratch each round, reset the neural posterior
-        # to the untrained copy we made at the start.
-        if self._retrain_from_scratch_each_round and round_ > 0:
-            self._neural_posterior = deepcopy(self._untrained_neural_posterior)
-            # self._neural_posterior = deepcopy(self._model_bank[0])
-
-        epochs = 0
-        converged = False
-        while not converged:
-
-            # Train for a single epoch.
-            self._neural_posterior.neural_net.train()
-            for batch in train_loader:
-                optimizer.zero_grad()
-                inputs, context, masks = (
-                    batch[0].to(self._device),
-                    batch[1].to(self._device),
-                    batch[2].to(self._device),
-                )
-
-                # just do maximum likelihood in the first round
-                if round_ == 0:
-                    log_prob = self._neural_posterior.neural_net.log_prob(
-                        inputs, context
-                    )
-                else:  # or call the APT loss
-                    log_prob = self._get_log_prob_proposal_posterior(
-                        inputs, context, masks
-                    )
-                loss = -torch.mean(log_prob)
-                loss.backward()
-                if clip_grad_norm:
-                    clip_grad_norm_(
-                        self._neural_posterior.neural_net.parameters(), max_norm=5.0
-                    )
-                optimizer.step()
-
-            epochs += 1
-
-            # Calculate validation performance.
-            self._neural_posterior.neural_net.eval()
-            log_prob_sum = 0
-            with torch.no_grad():
-                for batch in val_loader:
-                    inputs, context, masks = (
-                        batch[0].to(self._device),
-                        batch[1].to(self._device),
-                        batch[2].to(self._device),
-                    )
-                    # just do maximum likelihood in the first round
-                    if round_ == 0:
-                        log_prob = self._neural_posterior.neural_net.log_prob(
-                            inputs, context
-                        )
-                    else:
-                        log_prob = self._get_log_prob_proposal_posterior(
-                            inputs, context, masks
-                        )
-                    log_prob_sum += log_prob.sum().item()
-            validation_log_prob = log_prob_sum / num_validation_examples
-
-            # Check for improvement in validation performance over previous epochs.
-            if validation_log_prob > best_validation_log_prob:
-                best_validation_log_prob = validation_log_prob
-                epochs_since_last_improvement = 0
-                best_model_state_dict = deepcopy(
-                    self._neural_posterior.neural_net.state_dict()
-                )
-            else:
-                epochs_since_last_improvement += 1
 
-            # If no validation improvement over many epochs, stop training.
-            if epochs_since_last_improvement > stop_after_epochs - 1:
-                self._neural_posterior.neural_net.load_state_dict(best_model_state_dict)
-                converged = True
-
-        # Update summary.
-        self._summary["epochs"].append(epochs)
-        self._summary["best_validation_log_probs"].append(best_validation_log_prob)
+        def loss_fn(inputs, context, masks):
+            # just do maximum likelihood in the first round
+            if round_ == 0:
+                log_prob = self._neural_posterior.neural_net.log_prob(inputs, context)
+            else:  # or call the APT loss
+                log_prob = self._get_log_prob_proposal_posterior(inputs, context, masks)
+            return -torch.mean(log_prob)
+
+        self._fit(
+            self._neural_posterior.neural_net,
+            optimizer,
+            loss_fn,
+            train_loader,
+            val_loader,
+            stop_after_epochs,
+            clip_max_norm=5.0 if clip_grad_norm else None,
+            max_num_epochs=max_num_epochs,
+            max_training_seconds=max_training_seconds,
+            max_num_steps=max_num_steps,
+            stop_tolerance=stop_tolerance,
+            validation_smoothing=validation_smoothing,
+        )
 
 
 class PotentialFunctionProvider:
@@ -462,6 +448,7 @@ class PotentialFunctionProvider:
         self.posterior_nn = posterior_nn
         self.prior = prior
         self.observation = observation
+        self.statistics = PotentialStatistics()
 
         if mcmc_method in ("slice", "hmc", "nuts"):
             return self.pyro_potential
@@ -479,7 +466,10 @@ class PotentialFunctionProvider:
         """
         parameters = torch.as_tensor(parameters, dtype=torch.float32)
 
-        is_within_prior = torch.isfinite(self.prior.log_prob(parameters))
+        start_time = time.perf_counter()
+        log_prior = self.prior.log_prob(parameters)
+        prior_end_time = time.perf_counter()
+        is_within_prior = torch.isfinite(log_prior)
         if is_within_prior:
             target_log_prob = self.posterior_nn.log_prob(
                 inputs=parameters.reshape(1, -1),
@@ -487,6 +477,11 @@ class PotentialFunctionProvider:
             )
         else:
             target_log_prob = -float("Inf")
+        self.statistics.record(
+            log_prior,
+            prior_end_time - start_time,
+            time.perf_counter() - prior_end_time,
+        )
 
         return target_log_prob
 
@@ -502,10 +497,17 @@ class PotentialFunctionProvider:
 
         parameter = next(iter(parameters.values()))
         # XXX: notice sign, check convention pyro vs. numpy
+        start_time = time.perf_counter()
         log_prob_posterior = -self.posterior_nn.log_prob(
             inputs=parameter, context=self.observation,
         )
+        network_end_time = time.perf_counter()
         log_prob_prior = self.prior.log_prob(parameter)
+        self.statistics.record(
+            log_prob_prior,
+            time.perf_counter() - network_end_time,
+            network_end_time - start_time,
+        )
 
         within_prior = torch.isfinite(log_prob_prior)
 
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import os
+from typing import Union
 
 import torch
 from torch import distributions
@@ -22,19 +23,22 @@ class SnpeC(SnpeBase):
         calibration_kernel=None,
         use_combined_loss=False,
         z_score_obs=True,
-        simulation_batch_size: int = 1,
+        simulation_batch_size: Union[int, str] = 1,
         retrain_from_scratch_each_round=False,
         discard_prior_samples=False,
         summary_writer=None,
         device=None,
         sample_with_mcmc=False,
         mcmc_method="slice-np",
+        **kwargs,
     ):
         """SNPE-C / APT
 
         Implementation of _Automatic Posterior Transformation for Likelihood-free
         Inference_ by Greenberg et al., ICML 2019, https://arxiv.org/abs/1905.07488
 
+        See NeuralInference docstring for all other arguments.
+
         Args:
             num_pilot_samples: number of simulations that are run when
                 instantiating an object. Used to z-score the observations.   
@@ -67,6 +71,7 @@ class SnpeC(SnpeBase):
             device=device,
             sample_with_mcmc=sample_with_mcmc,
             mcmc_method=mcmc_method,
+            **kwargs,
         )
 
         assert isinstance(num_atoms, int), "Number of atoms must be an integer."
@@ -105,12 +110,7 @@ class SnpeC(SnpeBase):
         # we sample without replacement num_atoms - 1 times from the rest
         # of the parameters in the batch.
         assert 0 < num_atoms - 1 < batch_size
-        probs = (
-            (1 / (batch_size - 1))
-            * torch.ones(batch_size, batch_size)
-            * (1 - torch.eye(batch_size))
-        )
-        choices = torch.multinomial(probs, num_samples=num_atoms - 1, replacement=False)
+        choices = utils.sample_contrasting_indices(batch_size, num_atoms - 1)
         contrasting_inputs = inputs[choices]
 
         # We can now create our sets of atoms from the contrasting parameter sets
@@ -1,22 +1,20 @@
 from __future__ import annotations
 
+import time
 from copy import deepcopy
-from typing import Any, Callable, Dict, List, Optional, Union
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 import numpy as np
 import torch
 from pyro.infer.mcmc import HMC, NUTS
 from pyro.infer.mcmc.api import MCMC
 from torch import Tensor, nn, optim
-from torch.utils import data
-from torch.utils.data.sampler import SubsetRandomSampler
 from torch.utils.tensorboard import SummaryWriter
 from tqdm import tqdm
 
-import sbi.simulators as simulators
 import sbi.utils as utils
 from sbi.inference.base import NeuralInference
-from sbi.inference.posteriors.sbi_posterior import Posterior
+from sbi.inference.posteriors.sbi_posterior import Posterior, PotentialStatistics
 from sbi.utils.torchutils import ensure_observation_batched, ensure_parameter_batched
 
 
@@ -28,13 +26,14 @@ class SRE(NeuralInference):
         true_observation: Tensor,
         classifier: nn.Module,
         num_atoms: int = -1,
-        simulation_batch_size: int = 1,
+        simulation_batch_size: Union[int, str] = 1,
         mcmc_method: str = "slice-np",
         summary_net: Optional[nn.Module] = None,
         classifier_loss: str = "sre",
         retrain_from_scratch_each_round: bool = False,
         summary_writer: Optional[SummaryWriter] = None,
         device: Optional[torch.device] = None,
+        **kwargs,
     ):
         """Sequential Ratio Estimation
 
@@ -55,12 +54,13 @@ class SRE(NeuralInference):
         """
 
         super().__init__(
-            simulator,
-            prior,
-            true_observation,
-            simulation_batch_size,
-            device,
-            summary_writer,
+            simulator=simulator,
+            prior=prior,
+            true_observation=true_observation,
+            simulation_batch_size=simulation_batch_size,
+            device=device,
+            summary_writer=summary_writer,
+            **kwargs,
         )
 
         self._classifier_loss = classifier_loss
@@ -101,9 +101,6 @@ class SRE(NeuralInference):
         else:
             self._untrained_classifier = None
 
-        # SRE-specific summary_writer fields
-        self._summary.update({"mcmc_times": []})
-
     def __call__(
         self,
         num_rounds: int,
@@ -112,6 +109,11 @@ class SRE(NeuralInference):
         learning_rate: float = 5e-4,
         validation_fraction: float = 0.1,
         stop_after_epochs: int = 20,
+        max_num_epochs: Optional[int] = None,
+        max_training_seconds: Optional[float] = None,
+        max_num_steps: Optional[int] = None,
+        stop_tolerance: float = 0.0,
+        validation_smoothing: float = 0.0,
     ) -> Posterior:
         """Run SRE
 
@@ -119,19 +121,30 @@ class SRE(NeuralInference):
         the simulator
         
         Args:
-            num_rounds: Number of rounds to run
+            num_rounds: Number of rounds to run. Repeated calls continue with the
+                next round.
             num_simulations_per_round: Number of simulator calls per round
             batch_size: Size of batch to use for training.
             learning_rate: Learning rate for Adam optimizer.
             validation_fraction: The fraction of data to use for validation.
             stop_after_epochs: The number of epochs to wait for improvement on the
                 validation set before terminating training.
+            max_num_epochs: Maximal number of training epochs per round.
+            max_training_seconds: Maximal training time per round in seconds. It is
+                checked after every gradient step, and the last epoch is validated
+                before training stops.
+            max_num_steps: Maximal number of gradient steps per round.
+            stop_tolerance: Relative improvement of the validation performance below
+                which it does not count as improvement for `stop_after_epochs`.
+            validation_smoothing: Factor in [0, 1) of the exponential moving average
+                of the validation performance that is checked for improvement, to
+                stop on the trend of a noisy validation curve.
             
         Returns: 
             Posterior that can be sampled and evaluated.
         """
         round_description = ""
-        tbar = tqdm(range(num_rounds))
+        tbar = tqdm(range(self._round, self._round + num_rounds))
         for round_ in tbar:
 
             tbar.set_description(round_description)
@@ -139,36 +152,34 @@ class SRE(NeuralInference):
             # Generate parameters from prior in first round, and from most recent posterior
             # estimate in subsequent rounds.
             if round_ == 0:
-                parameters, observations = simulators.simulate_in_batches(
-                    simulator=self._simulator,
-                    parameter_sample_fn=lambda num_samples: self._prior.sample(
-                        (num_samples,)
-                    ),
-                    num_samples=num_simulations_per_round,
-                    simulation_batch_size=self._simulation_batch_size,
-                    x_dim=self._true_observation.shape[1:],  # do not pass batch_dim
-                )
+                parameter_sample_fn = self._prior_design.sample
             else:
-                parameters, observations = simulators.simulate_in_batches(
-                    simulator=self._simulator,
-                    parameter_sample_fn=lambda num_samples: self._neural_posterior.sample(
-                        num_samples
-                    ),
-                    num_samples=num_simulations_per_round,
-                    simulation_batch_size=self._simulation_batch_size,
-                    x_dim=self._true_observation.shape[1:],  # do not pass batch_dim
+                parameter_sample_fn = lambda num_samples: self._neural_posterior.sample(
+                    num_samples
                 )
 
-            # Store (parameter, observation) pairs.
-            self._parameter_bank.append(torch.Tensor(parameters))
-            self._observation_bank.append(torch.Tensor(observations))
+            # Simulate and store (parameter, observation) pairs. The first round may
+            # consist of appended simulations only.
+            self._simulate_round(
+                round_,
+                parameter_sample_fn=parameter_sample_fn,
+                num_samples=num_simulations_per_round,
+            )
 
             # Fit posterior using newly aggregated data set.
-            self._train(
-                batch_size=batch_size,
-                learning_rate=learning_rate,
-                validation_fraction=validation_fraction,
-                stop_after_epochs=stop_after_epochs,
+            # When streaming, this resumes training as further simulations finish.
+            self._train_on_simulation_stream(
+                lambda: self._train(
+                    batch_size=batch_size,
+                    learning_rate=learning_rate,
+                    validation_fraction=validation_fraction,
+                    stop_after_epochs=stop_after_epochs,
+                    max_num_epochs=max_num_epochs,
+                    max_training_seconds=max_training_seconds,
+                    max_num_steps=max_num_steps,
+                    stop_tolerance=stop_tolerance,
+                    validation_smoothing=validation_smoothing,
+                )
             )
 
             # Update description for progress bar.
@@ -186,16 +197,27 @@ class SRE(NeuralInference):
                 summary=self._summary,
                 round_=round_,
                 true_observation=self._true_observation,
-                parameter_bank=self._parameter_bank,
-                observation_bank=self._observation_bank,
+                parameter_bank=self._simulation_bank.rounds("parameters"),
+                observation_bank=self._simulation_bank.rounds("observations"),
                 simulator=self._simulator,
             )
 
-        self._neural_posterior._num_trained_rounds = num_rounds
+            self._round = round_ + 1
+
+        self._neural_posterior._num_trained_rounds = self._round
         return self._neural_posterior
 
     def _train(
-        self, batch_size, learning_rate, validation_fraction, stop_after_epochs,
+        self,
+        batch_size,
+        learning_rate,
+        validation_fraction,
+        stop_after_epochs,
+        max_num_epochs,
+        max_training_seconds,
+        max_num_steps,
+        stop_tolerance,
+        validation_smoothing,
     ):
         """
         Trains the classifier by maximizing a Bernoulli likelihood which distinguishes
@@ -204,39 +226,24 @@ class SRE(NeuralInference):
         Uses early stopping on a held-out validation set as a terminating condition.
         """
 
-        # Get total number of training examples.
-        num_examples = torch.cat(self._parameter_bank).shape[0]
+        # Views of the simulations to train on.
+        parameters = self._simulation_bank.get("parameters")
+        observations = self._simulation_bank.get("observations")
 
         # Select random train and validation splits from (parameter, observation) pairs.
-        permuted_indices = torch.randperm(num_examples)
-        num_training_examples = int((1 - validation_fraction) * num_examples)
-        num_validation_examples = num_examples - num_training_examples
-        train_indices, val_indices = (
-            permuted_indices[:num_training_examples],
-            permuted_indices[num_training_examples:],
-        )
-
-        # Dataset is shared for training and validation loaders.
-        dataset = data.TensorDataset(
-            torch.cat(self._parameter_bank), torch.cat(self._observation_bank)
-        )
-
-        # Create neural_net and validation loaders using a subset sampler.
+        train_indices, val_indices = self._split_simulations(validation_fraction)
+        num_training_examples = len(train_indices)
+        num_validation_examples = len(val_indices)
 
+        # Training and validation batches are gathered from the same tensors.
         # NOTE: The batch_size is clipped to num_validation samples
         clipped_batch_size = min(batch_size, num_validation_examples)
-        train_loader = data.DataLoader(
-            dataset,
-            batch_size=clipped_batch_size,
-            drop_last=True,
-            sampler=SubsetRandomSampler(train_indices),
+        tensors = (parameters, observations)
+        train_loader = utils.TensorBatches(
+            tensors, train_indices, batch_size=clipped_batch_size, drop_last=True
         )
-        val_loader = data.DataLoader(
-            dataset,
-            batch_size=clipped_batch_size,
-            shuffle=False,
-            drop_last=False,
-            sampler=SubsetRandomSampler(val_indices),
+        val_loader = utils.TensorBatches(
+            tensors, val_indices, batch_size=clipped_batch_size, shuffle=False
         )
 
         optimizer = optim.Adam(
@@ -248,13 +255,6 @@ class SRE(NeuralInference):
         # only used if classifier_loss == "aalr"
         criterion = nn.BCELoss()
 
-        # Keep track of best_validation log_prob seen so far.
-        best_validation_log_prob = -1e100
-        # Keep track of number of epochs since last improvement.
-        epochs_since_last_improvement = 0
-        # Keep track of model with best validation performance.
-        best_model_state_dict = None
-
         # If we're retraining from scratch each round, reset the neural posterior
         # to the untrained copy we made at the start.
         if self._retrain_from_scratch_each_round:
@@ -273,13 +273,8 @@ class SRE(NeuralInference):
             # Choose between 1 and num_atoms - 1 parameters from the rest
             # of the batch for each observation.
             assert 0 < num_atoms - 1 < clipped_batch_size
-            probs = (
-                (1 / (clipped_batch_size - 1))
-                * torch.ones(clipped_batch_size, clipped_batch_size)
-                * (1 - torch.eye(clipped_batch_size))
-            )
-            choices = torch.multinomial(
-                probs, num_samples=num_atoms - 1, replacement=False
+            choices = utils.sample_contrasting_indices(
+                clipped_batch_size, num_atoms - 1
             )
             contrasting_parameters = parameters[choices]
 
@@ -312,46 +307,19 @@ class SRE(NeuralInference):
 
             return loss
 
-        epochs = 0
-        while True:
-
-            # Train for a single epoch.
-            self._neural_posterior.neural_net.train()
-            for parameters, observations in train_loader:
-                optimizer.zero_grad()
-                loss = _get_loss(parameters, observations)
-                loss.backward()
-                optimizer.step()
-
-            epochs += 1
-
-            # calculate validation performance
-            self._neural_posterior.neural_net.eval()
-            log_prob_sum = 0
-            with torch.no_grad():
-                for parameters, observations in val_loader:
-                    log_prob = _get_loss(parameters, observations)
-                    log_prob_sum += log_prob.sum().item()
-                validation_log_prob = log_prob_sum / num_validation_examples
-
-            # check for improvement
-            if validation_log_prob > best_validation_log_prob:
-                best_model_state_dict = deepcopy(
-                    self._neural_posterior.neural_net.state_dict()
-                )
-                best_validation_log_prob = validation_log_prob
-                epochs_since_last_improvement = 0
-            else:
-                epochs_since_last_improvement += 1
-
-            # if no validation improvement over many epochs, stop training
-            if epochs_since_last_improvement > stop_after_epochs - 1:
-                self._neural_posterior.neural_net.load_state_dict(best_model_state_dict)
-                break
-
-        # Update summary.
-        self._summary["epochs"].append(epochs)
-        self._summary["best_validation_log_probs"].append(best_validation_log_prob)
+        self._fit(
+            self._neural_posterior.neural_net,
+            optimizer,
+            _get_loss,
+            train_loader,
+            val_loader,
+            stop_after_epochs,
+            max_num_epochs=max_num_epochs,
+            max_training_seconds=max_training_seconds,
+            max_num_steps=max_num_steps,
+            stop_tolerance=stop_tolerance,
+            validation_smoothing=validation_smoothing,
+        )
 
     @property
     def summary(self):
@@ -397,6 +365,7 @@ class PotentialFunctionProvider:
         self.classifier = classifier
         self.prior = prior
         self.observation = observation
+        self.statistics = PotentialStatistics()
 
         if mcmc_method in ("slice", "hmc", "nuts"):
             return self.pyro_potential
@@ -413,17 +382,10 @@ class PotentialFunctionProvider:
             [tensor or -inf]: posterior log probability of the parameters.
         """
         parameter = torch.as_tensor(parameters, dtype=torch.float32)
-
-        # parameter and observation should have shape (1, dim)
-        parameter = ensure_parameter_batched(parameter)
-        observation = ensure_observation_batched(self.observation)
-
-        log_ratio = self.classifier(
-            torch.cat((parameter, observation), dim=1).reshape(1, -1)
-        )
+        log_ratio, log_prior = self._evaluate(parameter)
 
         # notice opposite sign to pyro potential
-        return log_ratio + self.prior.log_prob(parameter)
+        return log_ratio + log_prior
 
     def pyro_potential(self, parameters: Dict[str, Tensor]) -> Tensor:
         """Return potential for Pyro sampler.
@@ -436,13 +398,27 @@ class PotentialFunctionProvider:
         """
 
         parameter = next(iter(parameters.values()))
+        log_ratio, log_prior = self._evaluate(parameter)
+
+        return -(log_ratio + log_prior)
+
+    def _evaluate(self, parameter: Tensor) -> Tuple[Tensor, Tensor]:
+        """Return log ratio and prior log probability of a parameter set, and record
+        the evaluation in `statistics`."""
 
         # parameter and observation should have shape (1, dim)
         parameter = ensure_parameter_batched(parameter)
         observation = ensure_observation_batched(self.observation)
 
+        start_time = time.perf_counter()
         log_ratio = self.classifier(
             torch.cat((parameter, observation), dim=1).reshape(1, -1)
         )
-
-        return -(log_ratio + self.prior.log_prob(parameter))
+        network_end_time = time.perf_counter()
+        log_prior = self.prior.log_prob(parameter)
+        self.statistics.record(
+            log_prior,
+            time.perf_counter() - network_end_time,
+            network_end_time - start_time,
+        )
+        return log_ratio, log_prior
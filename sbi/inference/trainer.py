@@ -0,0 +1,295 @@
+import time
+from typing import Any, Callable, Optional, Sequence
+
+import torch
+from torch import Tensor, nn
+from torch.nn.utils import clip_grad_norm_
+from torch.optim import Optimizer
+from torch.optim.lr_scheduler import ReduceLROnPlateau
+
+from sbi.utils.torchutils import TensorBatches
+
+
+class TrainingHook:
+    """Callbacks of a `Trainer`, e.g. for logging or instrumentation.
+
+    Subclasses override the callbacks they need, all others do nothing. The trainer
+    is passed to every callback, whose attributes such as `epoch`, `num_steps`,
+    `num_train_batches` and `best_validation_log_prob` describe the state of
+    training.
+    """
+
+    def on_train_begin(self, trainer: "Trainer") -> None:
+        """Called before the first epoch."""
+
+    def on_epoch_end(self, trainer: "Trainer", start_time: float) -> None:
+        """Called after the training pass of every epoch, which started at
+        `start_time`, in seconds of `time.perf_counter`."""
+
+    def on_validation_end(
+        self, trainer: "Trainer", start_time: float, validation_log_prob: float
+    ) -> None:
+        """Called after every validation pass, which started at `start_time`."""
+
+    def on_train_end(self, trainer: "Trainer") -> None:
+        """Called after the best model was restored."""
+
+
+# Reasons why training stopped, as recorded in `Trainer.stop_reason`.
+STOP_REASONS = ("converged", "max_num_epochs", "max_seconds", "max_num_steps")
+
+
+class Trainer:
+    """Minibatch training with early stopping on a held-out validation set.
+
+    The algorithms plug in the loss of a batch, the trainer runs the epochs, steps
+    the optimizer and learning rate scheduler, validates and keeps the model with the
+    best validation performance, which is restored at the end.
+
+    The best model is snapshotted by copying its state into buffers allocated once
+    per trainer, instead of a `deepcopy` of the state dict on every improvement. The
+    validation loss is accumulated on the device and read once per validation pass.
+
+    Training converges when the validation log probability has not improved for
+    `stop_after_epochs` epochs. To tolerate noisy validation losses, the curve can be
+    smoothed with an exponential moving average, and improvements smaller than a
+    relative tolerance can be ignored. Independently, training stops when a budget of
+    epochs, seconds or gradient steps is exhausted. Step and time budgets are checked
+    after every step, such that a long epoch is cut short. The reason is recorded
+    in `stop_reason`, one of `STOP_REASONS`.
+    """
+
+    def __init__(
+        self,
+        model: nn.Module,
+        optimizer: Optimizer,
+        loss_fn: Callable[..., Tensor],
+        train_loader: TensorBatches,
+        val_loader: TensorBatches,
+        stop_after_epochs: int = 20,
+        device: Optional[torch.device] = None,
+        clip_max_norm: Optional[float] = None,
+        lr_scheduler: Optional[Any] = None,
+        accumulate_grad_batches: int = 1,
+        validate_every_epochs: int = 1,
+        max_num_epochs: Optional[int] = None,
+        max_seconds: Optional[float] = None,
+        max_num_steps: Optional[int] = None,
+        stop_tolerance: float = 0.0,
+        validation_smoothing: float = 0.0,
+        hooks: Sequence[TrainingHook] = (),
+    ):
+        """
+        Args:
+            model: module that is trained and whose best state is restored.
+            optimizer: optimizer of the parameters of the model, and possibly of
+                further modules used by the loss.
+            loss_fn: mean loss of a batch, called with the tensors of the batch.
+            train_loader: batches to train on in every epoch.
+            val_loader: batches to validate on.
+            stop_after_epochs: number of epochs without improvement of the
+                validation log probability after which training stops.
+            device: device the batches are moved to. If None, they stay where they
+                are.
+            clip_max_norm: if given, the norm of the gradients of the model is
+                clipped to this value before every step.
+            lr_scheduler: learning rate scheduler of the optimizer, stepped after
+                every epoch. A `ReduceLROnPlateau` is stepped after every validation
+                with the validation loss.
+            accumulate_grad_batches: number of batches whose gradients are
+                accumulated for a single optimizer step.
+            validate_every_epochs: number of epochs between validation passes.
+            max_num_epochs: maximal number of epochs to train.
+            max_seconds: maximal training time in seconds.
+            max_num_steps: maximal number of optimizer steps.
+            stop_tolerance: improvements of the smoothed validation log probability
+                by less than this fraction of its best value are not counted as
+                improvements when checking for convergence.
+            validation_smoothing: factor of the exponential moving average of the
+                validation log probability checked for convergence, in [0, 1). With
+                0, the validation log probability itself is checked.
+            hooks: callbacks at the beginning and end of training, epochs and
+                validation passes.
+        """
+
+        assert validate_every_epochs >= 1, "`validate_every_epochs` must be >= 1."
+        assert accumulate_grad_batches >= 1, "`accumulate_grad_batches` must be >= 1."
+        assert (
+            0 <= validation_smoothing < 1
+        ), "`validation_smoothing` must be in [0, 1)."
+
+        self.model = model
+        self.optimizer = optimizer
+        self.train_loader = train_loader
+        self.val_loader = val_loader
+        self._loss_fn = loss_fn
+        self._stop_after_epochs = stop_after_epochs
+        self._device = device
+        self._clip_max_norm = clip_max_norm
+        self._lr_scheduler = lr_scheduler
+        self._accumulate_grad_batches = accumulate_grad_batches
+        self._validate_every_epochs = validate_every_epochs
+        self._max_num_epochs = max_num_epochs
+        self._max_seconds = max_seconds
+        self._max_num_steps = max_num_steps
+        self._stop_tolerance = stop_tolerance
+        self._validation_smoothing = validation_smoothing
+        self._hooks = list(hooks)
+
+        self.epoch = 0
+        self.num_steps = 0
+        # Batches run so far, fewer than the loaders hold if an epoch was cut short.
+        self.num_train_batches = 0
+        self.num_validation_batches = 0
+        self.best_validation_log_prob = -float("inf")
+        self.best_epoch = 0
+        self.validation_log_probs = []
+        self.stop_reason: Optional[str] = None
+
+        # Smoothed validation curve checked for convergence.
+        self._smoothed_log_prob: Optional[float] = None
+        self._best_smoothed_log_prob = -float("inf")
+        self._last_improvement_epoch = 0
+
+        # Buffers of the best model state, copied into on every improvement.
+        self._best_state = {
+            name: tensor.detach().clone()
+            for name, tensor in model.state_dict().items()
+        }
+        self._has_best_state = False
+
+    def train(self) -> float:
+        """Train until the validation performance stops improving or a budget is
+        exhausted, then restore the best model.
+
+        Returns:
+            Best validation log probability, i.e. negative mean validation loss.
+        """
+
+        self._start_time = time.perf_counter()
+        self._call_hooks("on_train_begin")
+
+        while self.stop_reason is None:
+            self._train_epoch()
+            if self.stop_reason is None:
+                self.stop_reason = self._exhausted_budget()
+
+            # The last epochs are compared to the best model before stopping.
+            if (
+                self.epoch % self._validate_every_epochs == 0
+                or self.stop_reason is not None
+            ):
+                self._validate()
+                epochs_without_improvement = self.epoch - self._last_improvement_epoch
+                if (
+                    self.stop_reason is None
+                    and epochs_without_improvement >= self._stop_after_epochs
+                ):
+                    self.stop_reason = "converged"
+
+        if self._has_best_state:
+            self.model.load_state_dict(self._best_state)
+        self._call_hooks("on_train_end")
+
+        return self.best_validation_log_prob
+
+    def _train_epoch(self) -> None:
+        self.model.train()
+        start_time = time.perf_counter()
+
+        num_batches = len(self.train_loader)
+        self.optimizer.zero_grad()
+        for batch_index, batch in enumerate(self.train_loader):
+            loss = self._loss_fn(*self._to_device(batch))
+            (loss / self._accumulate_grad_batches).backward()
+            self.num_train_batches += 1
+
+            # The gradients of the last batches of an epoch are never dropped.
+            num_accumulated = batch_index + 1
+            if (
+                num_accumulated % self._accumulate_grad_batches == 0
+                or num_accumulated == num_batches
+            ):
+                if self._clip_max_norm is not None:
+                    clip_grad_norm_(
+                        self.model.parameters(), max_norm=self._clip_max_norm
+                    )
+                self.optimizer.step()
+                self.optimizer.zero_grad()
+                self.num_steps += 1
+
+                self.stop_reason = self._exhausted_budget()
+                if self.stop_reason is not None:
+                    break
+
+        self.epoch += 1
+        if self._lr_scheduler is not None and not isinstance(
+            self._lr_scheduler, ReduceLROnPlateau
+        ):
+            self._lr_scheduler.step()
+        self._call_hooks("on_epoch_end", start_time)
+
+    def _validate(self) -> None:
+        self.model.eval()
+        start_time = time.perf_counter()
+
+        loss_sum = torch.zeros(())
+        num_examples = 0
+        with torch.no_grad():
+            for batch in self.val_loader:
+                batch = self._to_device(batch)
+                loss = self._loss_fn(*batch)
+                loss_sum = loss_sum.to(loss.device) + loss * batch[0].shape[0]
+                num_examples += batch[0].shape[0]
+                self.num_validation_batches += 1
+        validation_log_prob = -loss_sum.item() / max(num_examples, 1)
+        self.validation_log_probs.append(validation_log_prob)
+
+        if validation_log_prob > self.best_validation_log_prob:
+            self.best_validation_log_prob = validation_log_prob
+            self.best_epoch = self.epoch
+            for name, tensor in self.model.state_dict().items():
+                self._best_state[name].copy_(tensor)
+            self._has_best_state = True
+
+        if self._smoothed_log_prob is None:
+            self._smoothed_log_prob = validation_log_prob
+        else:
+            self._smoothed_log_prob = (
+                self._validation_smoothing * self._smoothed_log_prob
+                + (1 - self._validation_smoothing) * validation_log_prob
+            )
+        best_smoothed_log_prob = self._best_smoothed_log_prob
+        if best_smoothed_log_prob == -float("inf") or (
+            self._smoothed_log_prob
+            > best_smoothed_log_prob
+            + self._stop_tolerance * abs(best_smoothed_log_prob)
+        ):
+            self._best_smoothed_log_prob = self._smoothed_log_prob
+            self._last_improvement_epoch = self.epoch
+
+        if isinstance(self._lr_scheduler, ReduceLROnPlateau):
+            self._lr_scheduler.step(-validation_log_prob)
+        self._call_hooks("on_validation_end", start_time, validation_log_prob)
+
+    def _exhausted_budget(self) -> Optional[str]:
+        """Return the name of the first exhausted budget, None if there is none."""
+        if self._max_num_epochs is not None and self.epoch >= self._max_num_epochs:
+            return "max_num_epochs"
+        if self._max_num_steps is not None and self.num_steps >= self._max_num_steps:
+            return "max_num_steps"
+        if (
+            self._max_seconds is not None
+            and time.perf_counter() - self._start_time >= self._max_seconds
+        ):
+            return "max_seconds"
+        return None
+
+    def _to_device(self, batch: Sequence[Tensor]) -> Sequence[Tensor]:
+        if self._device is None:
+            return batch
+        return tuple(tensor.to(self._device) for tensor in batch)
+
+    def _call_hooks(self, name: str, *args) -> None:
+        for hook in self._hooks:
+            getattr(hook, name)(self, *args)
@@ -1,10 +1,13 @@
 import numpy as np
 import os
 import sys
+import time
 
 from matplotlib import pyplot as plt
 from tqdm import trange
 
+from sbi.utils.profiling import add_span
+
 # from .base import MCMCSampler
 
 
@@ -71,6 +74,7 @@ class SliceSampler(MCMCSampler):
 
         assert n_samples >= 0, "number of samples can't be negative"
 
+        start_time = time.perf_counter()
         order = list(range(self.n_dims))
         L_trace = []
         samples = np.empty([int(n_samples), int(self.n_dims)])
@@ -107,6 +111,7 @@ class SliceSampler(MCMCSampler):
             ax.set_xlabel("samples")
             plt.show(block=False)
 
+        add_span("slice_sampler", start_time, num_samples=int(n_samples))
         return samples
 
     def _tune_bracket_width(self, rng):
@@ -1,3 +1,9 @@
+from sbi.simulators.async_simulator import AsyncSimulator
+from sbi.simulators.cache import SimulationCache
+from sbi.simulators.farm import SimulationFarm
 from sbi.simulators.linear_gaussian import linear_gaussian
 from sbi.simulators.nonlinear_gaussian import NonlinearGaussianSimulator
-from sbi.simulators.simutils import simulate_in_batches
+from sbi.simulators.stream import SimulationStream
+from sbi.simulators.synthetic import SyntheticSimulator
+from sbi.simulators.supervision import SimulationFailures
+from sbi.simulators.simutils import SimulatorSignature, simulate_in_batches
@@ -0,0 +1,134 @@
+"""Support for simulators defined as `async def` functions."""
+
+import asyncio
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+import torch
+from torch import Tensor
+
+from sbi.simulators.supervision import SimulationFailures
+
+
+def is_async_simulator(simulator: Callable) -> bool:
+    """Return whether `simulator` is a coroutine function or has an async `__call__`."""
+    return inspect.iscoroutinefunction(simulator) or inspect.iscoroutinefunction(
+        getattr(simulator, "__call__", None)
+    )
+
+
+class AsyncSimulator:
+    """Synchronous batch simulator running a coroutine simulator concurrently.
+
+    The coroutine simulator receives a single parameter set and returns its data, e.g.
+    by sending a request to a solver daemon and awaiting the answer. A batch of
+    parameters is simulated by running the coroutines of all parameter sets in an
+    event loop, with at most `max_concurrency` of them in flight at once. Results are
+    returned in the order of the parameters.
+    """
+
+    def __init__(
+        self,
+        simulator: Callable,
+        max_concurrency: int = 16,
+        timeout: Optional[float] = None,
+        numpy_inputs: bool = False,
+    ):
+        """
+        Args:
+            simulator: `async def` function taking a single parameter set.
+            max_concurrency: maximal number of simulations awaited at the same time.
+            timeout: time in seconds after which a single simulation is cancelled and
+                a `TimeoutError` is raised. If None, simulations never time out.
+            numpy_inputs: whether the simulator expects numpy arrays as parameters
+                instead of Tensors.
+        """
+
+        assert max_concurrency >= 1, "max_concurrency must be at least 1."
+
+        self._simulator = simulator
+        self._max_concurrency = max_concurrency
+        self._timeout = timeout
+        self._numpy_inputs = numpy_inputs
+
+    def __call__(self, parameters: Tensor) -> Tensor:
+        """Return simulated data for a single parameter set or a batch of them.
+
+        Raises:
+            The error of the first failed simulation, if any.
+        """
+
+        parameters = torch.as_tensor(parameters)
+        if parameters.ndim < 2:
+            return self.simulate(parameters.unsqueeze(0))[0]
+        return self.simulate(parameters)
+
+    def simulate(
+        self,
+        parameters: Tensor,
+        x_dim: Optional[torch.Size] = None,
+        max_retries: int = 0,
+        failures: Optional[SimulationFailures] = None,
+    ) -> Tensor:
+        """Return simulated data for a batch of parameters.
+
+        Args:
+            parameters: batch of parameters of shape (batch_size, parameter_dim).
+            x_dim: shape of the data of a single simulation, required with `failures`.
+            max_retries: number of times a simulation that raised or timed out is
+                repeated.
+            failures: if given, simulations that failed after all retries have NaN
+                data and are recorded. Otherwise, the first error is raised.
+        """
+
+        results = self._run(self._simulate_batch(parameters.detach(), max_retries))
+
+        xs = []
+        for x, num_retries, error in results:
+            if failures is None:
+                if error is not None:
+                    raise error
+            else:
+                failures.record_call(num_retries, error)
+            xs.append(x if x is not None else torch.full(x_dim, float("nan")))
+        return torch.stack(xs)
+
+    async def _simulate_batch(
+        self, parameters: Tensor, max_retries: int
+    ) -> List[Tuple[Optional[Tensor], int, Optional[BaseException]]]:
+        semaphore = asyncio.Semaphore(self._max_concurrency)
+
+        async def simulate_one(theta: Tensor):
+            error = None
+            for attempt in range(max_retries + 1):
+                async with semaphore:
+                    try:
+                        x = await asyncio.wait_for(
+                            self._simulator(
+                                theta.numpy() if self._numpy_inputs else theta
+                            ),
+                            timeout=self._timeout,
+                        )
+                        return torch.as_tensor(x), attempt, None
+                    except asyncio.TimeoutError:
+                        error = TimeoutError(
+                            f"Simulation of parameters {theta} did not finish within "
+                            f"{self._timeout} seconds."
+                        )
+                    except Exception as e:
+                        error = e
+            return None, max_retries, error
+
+        return await asyncio.gather(*[simulate_one(theta) for theta in parameters])
+
+    @staticmethod
+    def _run(coroutine):
+        """Run a coroutine to completion, also when called from a running event loop,
+        e.g. in a Jupyter notebook, by running it in a thread with its own loop."""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(coroutine)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, coroutine).result()
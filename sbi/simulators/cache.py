@@ -0,0 +1,139 @@
+"""Persistent on-disk cache for simulations."""
+
+import hashlib
+import os
+import tempfile
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+import torch
+from torch import Tensor
+
+
+class SimulationCache:
+    """Content-addressed on-disk store of (parameter, data) pairs.
+
+    Every simulated data point is stored in its own file, named by a hash of the
+    parameter set it was simulated from. When the total size of the stored files
+    exceeds `max_size_bytes`, the least recently used entries are deleted.
+
+    The cache memoizes the simulator: a parameter set that was simulated before
+    always returns the stored data point, even for stochastic simulators. This is
+    what makes reruns of seeded experiments cheap, since they sample the same
+    parameters again.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        namespace: str = "simulator",
+        max_size_bytes: Optional[int] = 2 ** 30,
+    ):
+        """
+        Args:
+            directory: root directory of the cache. Created if it doesn't exist.
+            namespace: name of the simulator. Entries of different namespaces never
+                collide, such that one directory can serve several simulators.
+            max_size_bytes: upper bound on the size of all entries of the namespace.
+                If None, entries are never evicted.
+        """
+
+        self._directory = os.path.join(directory, namespace)
+        os.makedirs(self._directory, exist_ok=True)
+        self._max_size_bytes = max_size_bytes
+
+        self.num_hits = 0
+        self.num_misses = 0
+
+        # Index of the entries on disk: key -> file size, least recently used first.
+        entries = [
+            entry
+            for entry in os.scandir(self._directory)
+            if entry.is_file() and entry.name.endswith(".npy")
+        ]
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        self._index = OrderedDict(
+            (entry.name[: -len(".npy")], entry.stat().st_size) for entry in entries
+        )
+        self._size_bytes = sum(self._index.values())
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    @property
+    def size_bytes(self) -> int:
+        """Total size of all entries in bytes."""
+        return self._size_bytes
+
+    def lookup(self, parameters: Tensor) -> List[Optional[Tensor]]:
+        """Return the stored data for a batch of parameters, None where missing.
+
+        Args:
+            parameters: batch of parameters of shape (batch_size, parameter_dim).
+        """
+        return [self._get(self._key(theta)) for theta in parameters]
+
+    def store(self, parameters: Tensor, data: Tensor) -> None:
+        """Store a batch of simulations and evict entries beyond the size limit.
+
+        Args:
+            parameters: batch of parameters of shape (batch_size, parameter_dim).
+            data: batch of simulated data with the same leading dimension.
+        """
+        for theta, x in zip(parameters, data):
+            self._put(self._key(theta), x)
+        self._evict()
+
+    def _key(self, theta: Tensor) -> str:
+        theta = np.ascontiguousarray(theta.detach().cpu().numpy())
+        digest = hashlib.sha256()
+        digest.update(str(theta.dtype).encode())
+        digest.update(str(theta.shape).encode())
+        digest.update(theta.tobytes())
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._directory, key + ".npy")
+
+    def _get(self, key: str) -> Optional[Tensor]:
+        if key not in self._index:
+            self.num_misses += 1
+            return None
+        try:
+            x = np.load(self._path(key))
+        except (OSError, ValueError):
+            # Entry was evicted by another process or is corrupted, treat as miss.
+            self._size_bytes -= self._index.pop(key)
+            self.num_misses += 1
+            return None
+
+        # Mark as most recently used, also on disk for future sessions.
+        self._index.move_to_end(key)
+        os.utime(self._path(key))
+        self.num_hits += 1
+        return torch.from_numpy(x)
+
+    def _put(self, key: str, x: Tensor) -> None:
+        if key in self._index:
+            self._size_bytes -= self._index.pop(key)
+
+        # Write to a temporary file first, such that readers never see partial files.
+        fd, tmp_path = tempfile.mkstemp(dir=self._directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, x.detach().cpu().numpy())
+        os.replace(tmp_path, self._path(key))
+
+        self._index[key] = os.path.getsize(self._path(key))
+        self._size_bytes += self._index[key]
+
+    def _evict(self) -> None:
+        if self._max_size_bytes is None:
+            return
+        while self._size_bytes > self._max_size_bytes and self._index:
+            key, size = self._index.popitem(last=False)
+            self._size_bytes -= size
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,466 @@
+"""Simulation on a farm of worker processes connected over TCP or Unix sockets."""
+
+import json
+import os
+import socket
+import struct
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import torch
+from torch import Tensor
+
+# Length prefix of the JSON header of a message.
+_HEADER_LENGTH = struct.Struct("!I")
+
+
+class SimulationFarm:
+    """Batch simulator dispatching batches to simulation workers over sockets.
+
+    The farm listens on a TCP or Unix socket, and workers started with
+    `python -m sbi.simulators.worker ADDRESS --simulator module:function`, on this
+    or on other hosts, connect to it. Workers can join and leave at any time.
+
+    Batches are pulled by idle workers, such that fast workers simulate more batches
+    than slow ones. Once no batch is left, idle workers steal the batches still
+    running on other workers by simulating them as well, and the first result wins.
+    Workers send heartbeats while simulating. A worker that disconnects or misses
+    heartbeats for `heartbeat_timeout` seconds is dropped, and its batch is
+    dispatched again.
+
+    Every batch is simulated with its own seed, such that results do not depend on
+    the worker that runs it. The farm is passed to inference as the simulator, and
+    the simulation executor and number of workers are then ignored.
+
+    Messages are JSON headers followed by raw array data, so workers can't make the
+    farm run code. Still, only listen on networks whose hosts are trusted to send
+    simulations.
+    """
+
+    def __init__(
+        self,
+        address: str = "localhost:0",
+        heartbeat_timeout: float = 30.0,
+        max_redispatches: int = 3,
+    ):
+        """
+        Args:
+            address: 'host:port' to listen on TCP, or 'unix:path' to listen on a
+                Unix socket. With port 0, a free port is chosen, see `address`.
+            heartbeat_timeout: time in seconds after which a worker that neither sent
+                a result nor a heartbeat is considered lost.
+            max_redispatches: number of times a batch is dispatched again after the
+                worker simulating it was lost. After that, the batch has failed,
+                e.g. because it crashes every worker.
+        """
+
+        self._heartbeat_timeout = heartbeat_timeout
+        self._max_redispatches = max_redispatches
+
+        family, bind_address = parse_address(address)
+        self._listener = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_UNIX:
+            self._unix_path = bind_address
+            self._address = address
+        else:
+            self._unix_path = None
+            self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind(bind_address)
+        self._listener.listen()
+        if family != socket.AF_UNIX:
+            port = self._listener.getsockname()[1]
+            self._address = f"{bind_address[0]}:{port}"
+
+        self._condition = threading.Condition()
+        self._job: Optional[_FarmJob] = None
+        self._job_lock = threading.Lock()
+        self._num_workers = 0
+        self._closed = False
+
+        self._accept_thread = threading.Thread(target=self._accept, daemon=True)
+        self._accept_thread.start()
+
+    @property
+    def address(self) -> str:
+        """Address workers connect to, with the port chosen if it was 0."""
+        return self._address
+
+    @property
+    def num_workers(self) -> int:
+        """Number of workers currently connected."""
+        return self._num_workers
+
+    def wait_for_workers(self, num_workers: int, timeout: Optional[float] = None):
+        """Block until at least `num_workers` workers are connected.
+
+        Raises:
+            TimeoutError: if they did not connect within `timeout` seconds.
+        """
+        with self._condition:
+            if not self._condition.wait_for(
+                lambda: self._num_workers >= num_workers, timeout
+            ):
+                raise TimeoutError(
+                    f"Only {self._num_workers} of {num_workers} simulation workers "
+                    f"connected within {timeout} seconds."
+                )
+
+    def __call__(self, parameters: Tensor) -> Tensor:
+        """Return simulated data for a batch of parameters, simulated by one worker.
+
+        Raises:
+            The error of the simulation, if it failed.
+        """
+
+        parameters = torch.as_tensor(parameters)
+        seed = torch.randint(2 ** 31 - 1, (1,)).item()
+        ((x, _, error),) = self.simulate_batches([parameters], seed)
+        if error is not None:
+            raise error
+        return x
+
+    def simulate_batches(
+        self,
+        parameter_batches: Sequence[Tensor],
+        seed: int,
+        max_retries: int = 0,
+        timeout: Optional[float] = None,
+    ) -> List[Tuple[Optional[Tensor], int, Optional[BaseException]]]:
+        """Return simulator outputs for every batch, simulated by the workers.
+
+        Blocks until all batches are finished, waiting for workers to connect if
+        there are none.
+
+        Args:
+            parameter_batches: batches of parameters, each of shape (batch_size, dim).
+            seed: batch i is simulated with seed `seed + i`. Retry k of a batch uses
+                the seed of the batch plus `k` times the number of batches.
+            max_retries: number of times a batch whose simulator call raised or
+                timed out on the worker is simulated again.
+            timeout: time in seconds after which a simulator call on a worker counts
+                as failed. If None, calls are waited for indefinitely.
+
+        Raises:
+            RuntimeError: if the farm is closed while simulating.
+
+        Returns:
+            List with the simulated data or None, the number of retries and the
+            error of every batch, like `simulate_batches_in_parallel`.
+        """
+
+        job = _FarmJob(
+            [batch.detach().numpy() for batch in parameter_batches],
+            seed,
+            max_retries,
+            timeout,
+        )
+        if job.num_batches == 0:
+            return []
+
+        # Batches of concurrent calls wait until the batches of this call finished.
+        with self._job_lock, self._condition:
+            self._job = job
+            self._condition.notify_all()
+            try:
+                self._condition.wait_for(lambda: job.finished or self._closed)
+            finally:
+                self._job = None
+            if not job.finished:
+                raise RuntimeError("Simulation farm was closed while simulating.")
+        return job.results
+
+    def close(self) -> None:
+        """Stop listening and disconnect all workers, which then exit."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._listener.close()
+        if self._unix_path is not None and os.path.exists(self._unix_path):
+            os.remove(self._unix_path)
+
+    def __enter__(self) -> "SimulationFarm":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _accept(self) -> None:
+        while True:
+            try:
+                connection, _ = self._listener.accept()
+            except OSError:
+                # The listener was closed.
+                return
+            threading.Thread(
+                target=self._serve, args=(connection,), daemon=True
+            ).start()
+
+    def _serve(self, connection: socket.socket) -> None:
+        """Dispatch batches to a single worker until it is lost or the farm closes."""
+
+        connection.settimeout(self._heartbeat_timeout)
+        task = None
+        try:
+            header, _ = receive_message(connection)
+            if header.get("type") != "hello":
+                return
+            name = f"{header.get('host')}:{header.get('pid')}"
+            send_message(
+                connection,
+                {"type": "welcome", "heartbeat_interval": self._heartbeat_timeout / 4},
+            )
+            with self._condition:
+                self._num_workers += 1
+                self._condition.notify_all()
+
+            try:
+                while True:
+                    task = self._next_task()
+                    if task is None:
+                        send_message(connection, {"type": "stop"})
+                        return
+                    job, index, attempt = task
+                    send_message(
+                        connection,
+                        {
+                            "type": "simulate",
+                            "seed": job.seed(index, attempt),
+                            "timeout": job.timeout,
+                        },
+                        job.parameter_batches[index],
+                    )
+                    header, x = receive_message(connection, skip=("heartbeat",))
+                    if header.get("type") == "result":
+                        self._finish(task, torch.from_numpy(x), None)
+                    else:
+                        error = RuntimeError(
+                            f"Simulation on worker {name} failed: {header.get('error')}"
+                        )
+                        self._finish(task, None, error)
+                    task = None
+            finally:
+                with self._condition:
+                    self._num_workers -= 1
+                    self._condition.notify_all()
+        except (OSError, ValueError, struct.error) as error:
+            # Lost connection, missed heartbeats or a malformed message.
+            if task is not None:
+                self._lose(task, error)
+        finally:
+            connection.close()
+
+    def _next_task(self) -> Optional[Tuple["_FarmJob", int, int]]:
+        """Return the next batch to simulate as (job, batch index, attempt), waiting
+        for one if needed. Return None once the farm is closed."""
+
+        with self._condition:
+            while not self._closed:
+                job = self._job
+                if job is not None:
+                    task = job.next_task()
+                    if task is not None:
+                        return (job,) + task
+                self._condition.wait()
+            return None
+
+    def _finish(
+        self,
+        task: Tuple["_FarmJob", int, int],
+        x: Optional[Tensor],
+        error: Optional[BaseException],
+    ) -> None:
+        job, index, attempt = task
+        with self._condition:
+            job.finish(index, attempt, x, error)
+            self._condition.notify_all()
+
+    def _lose(self, task: Tuple["_FarmJob", int, int], error: BaseException) -> None:
+        job, index, attempt = task
+        with self._condition:
+            job.lose(index, attempt, error, self._max_redispatches)
+            self._condition.notify_all()
+
+
+class _FarmJob:
+    """Bookkeeping of the batches of a single `SimulationFarm.simulate_batches` call.
+
+    Not thread-safe, all methods are called with the lock of the farm held.
+    """
+
+    def __init__(
+        self,
+        parameter_batches: List[np.ndarray],
+        seed: int,
+        max_retries: int,
+        timeout: Optional[float],
+    ):
+        self.parameter_batches = parameter_batches
+        self.num_batches = len(parameter_batches)
+        self.timeout = timeout
+        self._seed = seed
+        self._max_retries = max_retries
+
+        self.results: List[
+            Optional[Tuple[Optional[Tensor], int, Optional[BaseException]]]
+        ] = [None] * self.num_batches
+        self._num_finished = 0
+        # Batches waiting for a worker, with the attempt to run.
+        self._pending = deque((index, 0) for index in range(self.num_batches))
+        # Batches running on workers, with the attempt and the number of copies.
+        self._running: Dict[int, Tuple[int, int]] = {}
+        self._dispatch_times: Dict[int, float] = {}
+        self._num_lost = [0] * self.num_batches
+
+    @property
+    def finished(self) -> bool:
+        return self._num_finished == self.num_batches
+
+    def seed(self, index: int, attempt: int) -> int:
+        return self._seed + index + attempt * self.num_batches
+
+    def next_task(self) -> Optional[Tuple[int, int]]:
+        """Return the next (batch index, attempt) to dispatch, or None."""
+
+        if self._pending:
+            index, attempt = self._pending.popleft()
+            self._dispatch_times[index] = time.monotonic()
+        else:
+            # Steal the batch that has been running alone for the longest time.
+            stealable = [
+                index
+                for index, (_, copies) in self._running.items()
+                if copies == 1 and self.results[index] is None
+            ]
+            if not stealable:
+                return None
+            index = min(stealable, key=self._dispatch_times.get)
+            attempt = self._running[index][0]
+
+        _, copies = self._running.get(index, (attempt, 0))
+        self._running[index] = (attempt, copies + 1)
+        return index, attempt
+
+    def finish(
+        self,
+        index: int,
+        attempt: int,
+        x: Optional[Tensor],
+        error: Optional[BaseException],
+    ) -> None:
+        copies_running = self._release(index)
+        if self.results[index] is not None:
+            # Another copy of the batch finished first.
+            return
+        if error is None:
+            self._set_result(index, (x, attempt, None))
+        elif copies_running:
+            # Leave retrying to the copy that is still running.
+            return
+        elif attempt < self._max_retries:
+            self._pending.append((index, attempt + 1))
+        else:
+            self._set_result(index, (None, attempt, error))
+
+    def lose(
+        self, index: int, attempt: int, error: BaseException, max_redispatches: int
+    ) -> None:
+        if self._release(index) or self.results[index] is not None:
+            return
+        self._num_lost[index] += 1
+        if self._num_lost[index] > max_redispatches:
+            self._set_result(
+                index,
+                (
+                    None,
+                    attempt,
+                    ConnectionError(
+                        f"Simulation workers were lost {self._num_lost[index]} times "
+                        f"while simulating the batch, last error: {error!r}"
+                    ),
+                ),
+            )
+        else:
+            # Same attempt and seed, the batch was never simulated to the end.
+            self._pending.appendleft((index, attempt))
+
+    def _release(self, index: int) -> bool:
+        """Mark a copy of a batch as returned, return whether copies still run."""
+        attempt, copies = self._running.pop(index)
+        if copies > 1:
+            self._running[index] = (attempt, copies - 1)
+            return True
+        return False
+
+    def _set_result(
+        self, index: int, result: Tuple[Optional[Tensor], int, Optional[BaseException]]
+    ) -> None:
+        self.results[index] = result
+        self._num_finished += 1
+
+
+def parse_address(address: str) -> Tuple[int, Union[str, Tuple[str, int]]]:
+    """Return the socket family and the socket address of a farm address."""
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[len("unix:") :]
+    host, _, port = address.rpartition(":")
+    if not host:
+        raise ValueError(
+            f"Address '{address}' must be of the form 'host:port' or 'unix:path'."
+        )
+    return socket.AF_INET, (host, int(port))
+
+
+def send_message(
+    connection: socket.socket, header: dict, array: Optional[np.ndarray] = None
+) -> None:
+    """Send a JSON header, followed by the data of `array` if given."""
+    if array is not None:
+        array = np.ascontiguousarray(array)
+        header = dict(header, dtype=array.dtype.str, shape=array.shape)
+    encoded = json.dumps(header).encode()
+    connection.sendall(_HEADER_LENGTH.pack(len(encoded)) + encoded)
+    if array is not None:
+        connection.sendall(memoryview(array).cast("B"))
+
+
+def receive_message(
+    connection: socket.socket, skip: Tuple[str, ...] = ()
+) -> Tuple[dict, Optional[np.ndarray]]:
+    """Receive a message sent by `send_message`.
+
+    Args:
+        connection: connected socket.
+        skip: types of messages to discard, e.g. heartbeats.
+
+    Raises:
+        ConnectionError: if the connection was closed.
+        socket.timeout: if the socket timed out.
+    """
+
+    while True:
+        (length,) = _HEADER_LENGTH.unpack(_receive_exactly(connection, 4))
+        header = json.loads(_receive_exactly(connection, length).decode())
+        array = None
+        if "dtype" in header:
+            dtype, shape = np.dtype(header["dtype"]), tuple(header["shape"])
+            num_bytes = dtype.itemsize * int(np.prod(shape))
+            array = np.frombuffer(
+                _receive_exactly(connection, num_bytes), dtype=dtype
+            ).reshape(shape)
+        if header.get("type") not in skip:
+            return header, array
+
+
+def _receive_exactly(connection: socket.socket, num_bytes: int) -> bytearray:
+    # A writable buffer, such that arrays received into it can back Tensors.
+    buffer = bytearray(num_bytes)
+    view = memoryview(buffer)
+    while view:
+        num_received = connection.recv_into(view)
+        if num_received == 0:
+            raise ConnectionError("Connection closed by the other side.")
+        view = view[num_received:]
+    return buffer
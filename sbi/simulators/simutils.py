@@ -1,9 +1,15 @@
 from __future__ import annotations
 import math
+import multiprocessing as mp
 import os
 import pickle
+import time
 import warnings
-from typing import Callable, Tuple, Union, Optional
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from multiprocessing.connection import Connection, wait
+from typing import Callable, Dict, List, Tuple, Union, Optional
 import numpy as np
 from scipy.stats._multivariate import multi_rv_frozen
 from scipy.stats._distn_infrastructure import rv_frozen
@@ -15,6 +21,15 @@ from torch import Tensor
 
 import sbi.simulators as simulators
 import sbi.utils as utils
+from sbi.simulators.async_simulator import AsyncSimulator, is_async_simulator
+from sbi.simulators.cache import SimulationCache
+from sbi.simulators.farm import SimulationFarm
+from sbi.simulators.supervision import (
+    SimulationFailures,
+    call_supervised,
+    is_valid,
+)
+from sbi.utils.profiling import get_profiler, span
 from sbi.utils.torchutils import BoxUniform, atleast_2d
 
 
@@ -365,6 +380,10 @@ def process_simulator(
 
     assert isinstance(user_simulator, Callable), "Simulator must be a function."
 
+    # Coroutine simulators are already wrapped to simulate batches of Tensors.
+    if isinstance(user_simulator, AsyncSimulator):
+        return user_simulator
+
     pytorch_simulator = wrap_as_pytorch_simulator(
         user_simulator, prior, is_numpy_simulator
     )
@@ -390,7 +409,7 @@ def wrap_as_pytorch_simulator(
 
         # Define a wrapper function to PyTorch
         def pytorch_simulator(theta: Tensor):
-            return torch.as_tensor(simulator(theta.numpy()), dtype=torch.float32)
+            return torch.as_tensor(simulator(theta.numpy()))
 
     else:
         pytorch_simulator = simulator
@@ -421,10 +440,13 @@ def wrap_as_batch_simulator(simulator: Callable, prior) -> Callable:
 
 
 def get_batched_simulator(simulator: Callable) -> Callable:
-    """Return simulator wrapped with `map` to handle batches of parameters."""
+    """Return simulator wrapped with `map` to handle batches of parameters.
+
+    The map runs serially within a batch. To simulate several parameters at once, use
+    `simulation_batch_size=1` together with a parallel `simulation_executor` in
+    `simulate_in_batches`, which distributes the batches over workers.
+    """
 
-    # XXX: this should be handled with more care, e.g., enable multiprocessing
-    # XXX: with Pool() as p: p.map(...)
     def batched_simulator(thetas: Tensor) -> Tensor:
         # use map to get data for every theta in batch
         # use stack to collect list of tensors in tensor
@@ -443,7 +465,7 @@ def process_observed_data(
     
     Args:
         observed_data: observed data as provided by the user.
-        simulator: simulator function as provided by the user.
+        simulator: simulator function as provided by the user, or None.
         prior: prior object.
     
     Returns:
@@ -456,27 +478,148 @@ def process_observed_data(
 
     check_for_possibly_batched_observations(observed_data)
 
-    # Get unbatched simulated data by sampling from prior and simulator.
-    # cast to tensor for comparison
-    simulated_data = torch.as_tensor(
-        simulator(prior.sample()), dtype=torch.float32
-    ).squeeze(0)
+    # Without simulator, e.g. when training on stored simulations only, the shape of
+    # the observed data can't be checked here.
+    if simulator is not None:
+        # Get unbatched simulated data by sampling from prior and simulator.
+        # cast to tensor for comparison
+        simulated_data = torch.as_tensor(
+            simulator(prior.sample()), dtype=torch.float32
+        ).squeeze(0)
+
+        # Get data shape by ommitting the batch dimension.
+        observed_data_shape = observed_data.shape[1:]
+
+        assert observed_data_shape == simulated_data.shape, (
+            f"Observed data shape ({observed_data_shape}) must match "
+            f"simulator output shape ({simulated_data.shape})."
+        )
+
+    observation_dim = observed_data[0, :].numel()
 
-    # Get data shape by ommitting the batch dimension.
-    observed_data_shape = observed_data.shape[1:]
+    return observed_data, observation_dim
+
+
+class SimulatorSignature:
+    """Declared properties of a simulator, such that it needs not be probed."""
+
+    def __init__(
+        self,
+        batched: bool,
+        numpy: bool = False,
+        output_shape: Optional[Tuple[int, ...]] = None,
+        output_dtype: Optional[torch.dtype] = None,
+    ):
+        """
+        Args:
+            batched: whether the simulator takes a batch of parameter sets of shape
+                (batch_size, parameter_dim) and returns a batch of data.
+            numpy: whether the simulator takes and returns numpy arrays instead of
+                Tensors.
+            output_shape: shape of the data of a single simulation. If given, it is
+                checked against the observed data.
+            output_dtype: torch dtype of the data, e.g. `torch.float64` for numpy
+                simulators returning float arrays. Worker processes hand data back
+                in this dtype, such that it is converted only once, when stored for
+                training. If None, they convert it to float32.
+        """
+        self.batched = batched
+        self.numpy = numpy
+        self.output_shape = None if output_shape is None else torch.Size(output_shape)
+        self.output_dtype = output_dtype
+
+
+def probe_simulator(
+    simulator: Callable,
+    prior,
+    prior_returns_numpy: bool,
+    parameter_sample_fn: Optional[Callable[[int], Tensor]] = None,
+) -> Tuple[SimulatorSignature, Tensor, Tensor]:
+    """Infer the signature of a simulator from as few calls as possible.
+
+    The simulator is called once on a batch of two parameter sets. Only if that fails,
+    or doesn't return a batch of two, it is called once more on a single parameter
+    set, and treated as unbatched.
+
+    Args:
+        simulator: simulator as provided by the user.
+        prior: PyTorch prior.
+        prior_returns_numpy: whether the user prior returns numpy arrays, in which case
+            the simulator is expected to take and return numpy arrays as well.
+        parameter_sample_fn: function sampling the probe parameters from the prior,
+            e.g. from a space-filling design. If None, the prior is sampled i.i.d.
 
-    assert observed_data_shape == simulated_data.shape, (
-        f"Observed data shape ({observed_data_shape}) must match "
-        f"simulator output shape ({simulated_data.shape})."
+    Returns:
+        The signature, and the parameters and data of the probe simulations, which
+        are valid simulations from the prior.
+    """
+
+    # Coroutine simulators and farm workers are handed Tensors, and convert them.
+    is_numpy_simulator = prior_returns_numpy and not isinstance(
+        simulator, (AsyncSimulator, SimulationFarm)
     )
 
-    observation_dim = observed_data[0, :].numel()
+    if parameter_sample_fn is None:
+        parameters = prior.sample((2,))
+    else:
+        parameters = parameter_sample_fn(2)
+    inputs = parameters.numpy() if is_numpy_simulator else parameters
+    try:
+        data = simulator(inputs)
+        batched = isinstance(data, (Tensor, np.ndarray)) and data.shape[0] == 2
+    except Exception:
+        batched = False
 
-    return observed_data, observation_dim
+    if not batched:
+        warnings.warn(
+            "Simulator can't handle batches of parameters. It will be wrapped using "
+            "'map', which can be inefficient."
+        )
+        parameters = parameters[:1]
+        data = simulator(inputs[0])
+        if isinstance(data, (Tensor, np.ndarray)):
+            data = data[None]
+
+    if is_numpy_simulator:
+        assert isinstance(
+            data, np.ndarray
+        ), f"Simulator output type {type(data)} should match simulator input type "
+        f"{type(inputs)}"
+    else:
+        assert isinstance(data, Tensor), "simulator output must be a Tensor."
+
+    output_dtype = torch.as_tensor(data).dtype
+    data = torch.as_tensor(data, dtype=torch.float32)
+    signature = SimulatorSignature(
+        batched, is_numpy_simulator, data.shape[1:], output_dtype
+    )
+
+    return signature, parameters, data
+
+
+def wrap_by_signature(simulator: Callable, signature: SimulatorSignature) -> Callable:
+    """Return a batch simulator of Tensors for a simulator of declared signature."""
+
+    if signature.numpy:
+
+        def pytorch_simulator(theta: Tensor):
+            return torch.as_tensor(simulator(theta.numpy()))
+
+    else:
+        pytorch_simulator = simulator
+
+    if signature.batched:
+        return pytorch_simulator
+    return get_batched_simulator(pytorch_simulator)
 
 
 def prepare_sbi_problem(
-    user_simulator: Callable, user_prior, user_observed_data: Union[Tensor, np.ndarray]
+    user_simulator: Callable,
+    user_prior,
+    user_observed_data: Union[Tensor, np.ndarray],
+    max_concurrent_simulations: int = 16,
+    simulation_timeout: Optional[float] = None,
+    simulator_signature: Optional[SimulatorSignature] = None,
 ) -> Tuple[Callable, Callable, Tensor]:
     """Prepare simulator, prior and observed data for usage in sbi. 
 
@@ -489,10 +632,21 @@ def prepare_sbi_problem(
     
     If this is not possible assertion erros or corresponding erros are raised.
 
+    Simulators defined as `async def` functions of a single parameter set are run
+    concurrently for all parameter sets of a batch, see `AsyncSimulator`.
+
     Args:
-        user_simulator: simulator as provided by the user
+        user_simulator: simulator as provided by the user. If None, the returned
+            simulator is None as well.
         user_prior: prior as provided by the user
         user_observed_data: observed data as provided by the user
+        max_concurrent_simulations: maximal number of simulations awaited at the
+            same time, for coroutine simulators only.
+        simulation_timeout: time in seconds after which a simulation of a coroutine
+            simulator is cancelled and a TimeoutError is raised. No timeout if None.
+        simulator_signature: declared signature of the simulator. If given, the
+            simulator is not called at all. Otherwise, it is probed once or twice,
+            see `probe_simulator`.
 
     Returns:
         simulator: adapted simulator ready to be used in sbi. 
@@ -500,21 +654,93 @@ def prepare_sbi_problem(
         observed_data: adapted observed data.
     """
 
+    simulator, prior, observed_data, _, _ = prepare_sbi_problem_and_probe(
+        user_simulator,
+        user_prior,
+        user_observed_data,
+        max_concurrent_simulations,
+        simulation_timeout,
+        simulator_signature,
+    )
+    return simulator, prior, observed_data
+
+
+def prepare_sbi_problem_and_probe(
+    user_simulator: Callable,
+    user_prior,
+    user_observed_data: Union[Tensor, np.ndarray],
+    max_concurrent_simulations: int = 16,
+    simulation_timeout: Optional[float] = None,
+    simulator_signature: Optional[SimulatorSignature] = None,
+    probe_sampler: Optional[Callable[[Distribution], Callable[[int], Tensor]]] = None,
+) -> Tuple[
+    Callable,
+    Callable,
+    Tensor,
+    Optional[Tuple[Tensor, Tensor]],
+    Optional[SimulatorSignature],
+]:
+    """Prepare the sbi problem like `prepare_sbi_problem`, and also return the
+    simulations of the probe, if the simulator was probed, and the signature of the
+    simulator.
+
+    The probe simulations use parameters sampled from the prior, such that they can
+    be trained on in the first round instead of being discarded. With a
+    `probe_sampler`, a function of the processed prior returning a sampler, they are
+    sampled like the parameters of the first round, e.g. from its design.
+
+    Returns:
+        simulator, prior and observed data as `prepare_sbi_problem`, the parameters
+        and data of the probe simulations or None, and the declared or probed
+        signature of the simulator, None without simulator.
+    """
+
     # check prior, return PyTorch prior
     prior, parameter_dim, prior_returns_numpy = process_prior(user_prior)
 
-    # check data, returns data with leading batch dimension
+    # coroutine simulators are run in an event loop, concurrently within batches
+    if user_simulator is not None and is_async_simulator(user_simulator):
+        user_simulator = AsyncSimulator(
+            user_simulator,
+            max_concurrency=max_concurrent_simulations,
+            timeout=simulation_timeout,
+            numpy_inputs=prior_returns_numpy,
+        )
+
+    # check data, returns data with leading batch dimension. The simulator output is
+    # checked against it below, with the probe or the declared signature.
     observed_data, observation_dim = process_observed_data(
-        user_observed_data, user_simulator, user_prior
+        user_observed_data, None, user_prior
     )
 
-    # check simulator, returns PyTorch simulator able to simulate batches.
-    simulator = process_simulator(user_simulator, prior, prior_returns_numpy)
+    # Without simulator, inference can only use simulations provided by the user.
+    if user_simulator is None:
+        return None, prior, observed_data, None, None
+
+    assert isinstance(user_simulator, Callable), "Simulator must be a function."
+
+    if simulator_signature is None:
+        simulator_signature, probe_parameters, probe_data = probe_simulator(
+            user_simulator,
+            prior,
+            prior_returns_numpy,
+            None if probe_sampler is None else probe_sampler(prior),
+        )
+        probe = (probe_parameters, probe_data)
+    else:
+        probe = None
+
+    # returns PyTorch simulator able to simulate batches.
+    simulator = wrap_by_signature(user_simulator, simulator_signature)
 
     # consistency check after making ready for SBI
-    check_sbi_problem(simulator, prior, observed_data)
+    if simulator_signature.output_shape is not None:
+        assert observed_data.shape[1:] == simulator_signature.output_shape, (
+            f"Observed data shape ({observed_data.shape[1:]}) must match "
+            f"simulator output shape ({simulator_signature.output_shape})."
+        )
 
-    return simulator, prior, observed_data
+    return simulator, prior, observed_data, probe, simulator_signature
 
 
 def check_sbi_problem(simulator: Callable, prior, observed_data: Tensor):
@@ -542,12 +768,27 @@ def check_sbi_problem(simulator: Callable, prior, observed_data: Tensor):
     ), f"Observed data shape must match simulated data shape."
 
 
+SIMULATION_EXECUTORS = ("serial", "threads", "processes")
+
+# Number of passes of replacements in a row without a single valid simulation after
+# which `simulate_in_batches` gives up.
+MAX_INVALID_PASSES = 10
+
+
 def simulate_in_batches(
     simulator: Callable,
     parameter_sample_fn: Callable,
     num_samples: int,
     simulation_batch_size: int,
     x_dim: torch.Size,
+    simulation_executor: str = "serial",
+    num_workers: int = 1,
+    simulation_cache: Optional[SimulationCache] = None,
+    max_retries: int = 0,
+    timeout: Optional[float] = None,
+    failures: Optional[SimulationFailures] = None,
+    x_dtype: Optional[torch.dtype] = None,
+    process_pool: Optional[SimulationProcessPool] = None,
 ) -> (Tensor, Tensor):
     """
     Return parameters and simulated data for `num_samples` parameter sets. 
@@ -557,6 +798,14 @@ def simulate_in_batches(
     Features: 
         Allows to simulate in batches of arbitrary size.
         If `simulation_batch_size==-1`, all simulations are run at the same time.
+        Batches can be distributed over a pool of threads or processes. The output
+        order always matches the order of the sampled parameters.
+        With a `simulation_cache`, only parameters without stored data are simulated.
+        Simulator calls that raise are retried up to `max_retries` times, and calls
+        that take longer than `timeout` count as failed. Simulations of calls that
+        failed for good, or with non-finite data, are quarantined in `failures` and
+        replaced by simulations of newly sampled parameters, until `num_samples`
+        valid simulations are reached.
 
     Args:
         simulator: simulator function.
@@ -566,6 +815,35 @@ def simulate_in_batches(
             If `simulation_batch_size == -1`, we run a batch with all simulations required,
             i.e. `simulation_batch_size = num_samples`
         x_dim: dimensionality of a single simulator output
+        simulation_executor: one of 'serial', 'threads' or 'processes'. With 'threads'
+            or 'processes', batches are run in parallel by `num_workers` workers.
+            Every batch run in a process is seeded with its own seed derived from the
+            global torch RNG, such that results are reproducible under
+            `torch.manual_seed` for any number of workers. Threads share the global
+            RNG, so stochastic simulators are not bit-reproducible with 'threads'.
+        num_workers: number of threads or processes to simulate with.
+        simulation_cache: optional on-disk cache of earlier simulations. With the
+            'serial' and 'processes' executors, the batches of a cached pass are
+            seeded like process batches, such that the global RNG advances
+            identically no matter how many parameters were cached. Threads and
+            coroutine simulators share the RNGs of the caller and can't be seeded
+            per batch, so with them the RNG stream depends on what was cached.
+        max_retries: number of times a simulator call that raised is repeated.
+        timeout: time in seconds after which a simulator call counts as failed.
+            Calls with a timeout run in worker processes, also with the 'serial'
+            executor, and a worker is killed and replaced when its call times out.
+            Not supported by the 'threads' executor.
+        failures: record of failed calls and quarantined simulations to update.
+        x_dtype: dtype of the simulator output, see `SimulatorSignature`. Data of
+            process workers is handed back in it, float32 if None.
+        process_pool: worker processes to simulate with, e.g. those of an earlier
+            call. If None, processes are started for this call, see
+            `simulation_process_pool`.
+
+    Raises:
+        RuntimeError: if not a single simulation of the first pass is valid, or of
+            `MAX_INVALID_PASSES` passes of replacements in a row, e.g. because the
+            simulator raises for every parameter set.
 
     Returns: Tensor simulation input parameters of shape (num_samples, num_dim_parameters),
              Tensor simulator outputs x of shape (num_samples, num_dim_x)
@@ -573,22 +851,781 @@ def simulate_in_batches(
 
     assert num_samples > 0, "number of samples must be larger than zero."
 
-    # generate parameters (simulation inputs) by sampling from prior
-    # (round 1) or proposal (round > 1)
-    parameters = parameter_sample_fn(num_samples)
+    if failures is None:
+        failures = SimulationFailures()
 
     if simulation_batch_size == -1:
         # run all simulations in a single batch
         simulation_batch_size = num_samples
 
+    valid_parameters, valid_xs = [], []
+    num_valid = 0
+    num_invalid_passes = 0
+    # Worker processes are started once, and reused by the passes of replacements.
+    if process_pool is None:
+        pool_context = simulation_process_pool(
+            simulator, simulation_executor, num_workers
+        )
+    else:
+        pool_context = nullcontext(process_pool)
+    with pool_context as process_pool:
+        while num_valid < num_samples:
+
+            # generate parameters (simulation inputs) by sampling from prior
+            # (round 1) or proposal (round > 1)
+            with span("sample_parameters", num_samples=num_samples - num_valid):
+                parameters = parameter_sample_fn(num_samples - num_valid)
+
+            with span("simulate", num_simulations=len(parameters)), torch.no_grad():
+                xs = simulate_or_lookup(
+                    simulator,
+                    parameters,
+                    simulation_batch_size,
+                    x_dim,
+                    simulation_executor,
+                    num_workers,
+                    simulation_cache,
+                    max_retries,
+                    timeout,
+                    failures,
+                    process_pool=process_pool,
+                    x_dtype=x_dtype,
+                )
+
+            valid = is_valid(xs)
+            # Small passes of replacements of a flaky simulator can fail entirely by
+            # chance, so only give up on them after several in a row.
+            num_invalid_passes = 0 if valid.any() else num_invalid_passes + 1
+            if not valid.all():
+                failures.quarantine(parameters[~valid], xs[~valid])
+                if num_invalid_passes > 0 and (
+                    num_valid == 0 or num_invalid_passes == MAX_INVALID_PASSES
+                ):
+                    raise RuntimeError(
+                        f"All {len(parameters)} simulations failed or returned "
+                        f"non-finite data, last simulator error: "
+                        f"{failures.last_error!r}"
+                    ) from failures.last_error
+                warnings.warn(
+                    f"{int((~valid).sum())} simulations failed or returned non-finite "
+                    f"data. They are replaced by simulations of new parameters."
+                )
+                parameters, xs = parameters[valid], xs[valid]
+
+            valid_parameters.append(parameters)
+            valid_xs.append(xs)
+            num_valid += len(parameters)
+
+    # The first pass is usually all valid, then nothing needs to be concatenated.
+    if len(valid_xs) == 1:
+        parameters, xs = valid_parameters[0], valid_xs[0]
+    else:
+        parameters, xs = torch.cat(valid_parameters), torch.cat(valid_xs)
+
+    # Parameters sampled from a proposal can be part of the graph of its density
+    # estimator. Detach them without copying, such that training on them does not
+    # backpropagate into the graph of an earlier round.
+    return parameters.detach(), xs
+
+
+def simulate_or_lookup(
+    simulator: Callable,
+    parameters: Tensor,
+    simulation_batch_size: int,
+    x_dim: torch.Size,
+    simulation_executor: str = "serial",
+    num_workers: int = 1,
+    simulation_cache: Optional[SimulationCache] = None,
+    max_retries: int = 0,
+    timeout: Optional[float] = None,
+    failures: Optional[SimulationFailures] = None,
+    process_pool: Optional[SimulationProcessPool] = None,
+    x_dtype: Optional[torch.dtype] = None,
+) -> Tensor:
+    """Return simulated data for parameters, from the cache where possible.
+
+    See `simulate_in_batches` and `simulate_batches` for the arguments. Only valid
+    data is cached.
+    """
+
+    if simulation_cache is None:
+        return simulate_batches(
+            simulator,
+            parameters,
+            simulation_batch_size,
+            simulation_executor,
+            num_workers,
+            x_dim=x_dim,
+            max_retries=max_retries,
+            timeout=timeout,
+            failures=failures,
+            process_pool=process_pool,
+            x_dtype=x_dtype,
+        )
+
+    seed = draw_seed()
+    cached_xs = simulation_cache.lookup(parameters)
+    missing = [i for i, x in enumerate(cached_xs) if x is None]
+    if missing:
+        missing_parameters = parameters[missing]
+        simulated_xs = simulate_batches(
+            simulator,
+            missing_parameters,
+            simulation_batch_size,
+            simulation_executor,
+            num_workers,
+            seed,
+            x_dim=x_dim,
+            max_retries=max_retries,
+            timeout=timeout,
+            failures=failures,
+            process_pool=process_pool,
+            x_dtype=x_dtype,
+        )
+        valid = is_valid(simulated_xs)
+        simulation_cache.store(missing_parameters[valid], simulated_xs[valid])
+        for i, x in zip(missing, simulated_xs):
+            cached_xs[i] = x
+    return torch.stack(cached_xs)
+
+
+def tune_simulation_batch_size(
+    simulator: Callable,
+    parameters: Tensor,
+    x_dim: torch.Size,
+    simulation_executor: str = "serial",
+    num_workers: int = 1,
+    max_batch_memory_bytes: int = 2 ** 30,
+    max_retries: int = 0,
+    timeout: Optional[float] = None,
+    failures: Optional[SimulationFailures] = None,
+    x_dtype: Optional[torch.dtype] = None,
+    simulation_cache: Optional[SimulationCache] = None,
+    process_pool: Optional[SimulationProcessPool] = None,
+) -> Tuple[int, Tensor, Dict[int, float]]:
+    """Return the simulation batch size with the highest throughput.
+
+    Batch sizes 1, 2, 4, ... are tried on consecutive parameter sets, with two batches
+    per worker, measuring simulations per second. Doubling stops once the throughput
+    improves by less than 5%, the parameters run out, or a batch of the next size
+    would need more than `max_batch_memory_bytes`. The memory of a simulation is
+    estimated from the size of its data and from the growth of the peak memory of
+    the process and its worker processes while simulating.
+
+    Worker processes are started before the first batch size is timed, and reused
+    for all of them. Parameters found in the `simulation_cache` are not simulated,
+    and batch sizes whose parameters were partly cached are not timed.
+
+    The simulations run while tuning are real simulations of the first parameters,
+    and are returned to be kept. Since the choice depends on timing, it is not
+    reproducible, unlike a fixed batch size.
+
+    Args:
+        simulator: batch simulator returning Tensors.
+        parameters: parameters to tune on, e.g. those of the first round.
+        x_dim: shape of the data of a single simulation.
+        simulation_executor: one of 'serial', 'threads' or 'processes'.
+        num_workers: number of threads or processes of parallel executors.
+        max_batch_memory_bytes: upper bound on the memory of a single batch.
+        max_retries: see `simulate_in_batches`.
+        timeout: see `simulate_in_batches`.
+        failures: see `simulate_in_batches`.
+        x_dtype: see `simulate_in_batches`.
+        simulation_cache: see `simulate_in_batches`.
+        process_pool: worker processes to simulate with, e.g. those simulating the
+            rest of the round. If None, processes are started for this call.
+
+    Returns:
+        The best batch size, the data simulated for the first `len(data)`
+        parameters, and the throughput in simulations per second per batch size.
+        Without any timed batch size, e.g. when all parameters were cached, the
+        best batch size is 1.
+    """
+
+    # Coroutine simulators simulate all parameters at once, whatever the batch size.
+    if isinstance(simulator, AsyncSimulator):
+        return 1, torch.empty(0, *x_dim), {}
+
+    if simulation_executor == "serial":
+        num_workers = 1
+    if isinstance(simulator, SimulationFarm):
+        num_workers = max(simulator.num_workers, 1)
+
+    if process_pool is None:
+        pool_context = simulation_process_pool(
+            simulator, simulation_executor, num_workers
+        )
+    else:
+        pool_context = nullcontext(process_pool)
+    def peak_memory() -> int:
+        # Where it is unknown, memory is estimated from the data only.
+        return max(
+            utils.peak_memory_bytes(include_children=True) or 0,
+            process_pool.peak_memory_bytes,
+        )
+
+    with pool_context as process_pool:
+        # Workers are started up front, such that their startup isn't timed.
+        uses_pool = simulation_executor == "processes" or timeout is not None
+        if uses_pool and not isinstance(simulator, SimulationFarm):
+            process_pool.start()
+
+        xs, throughputs = [], {}
+        num_simulated = 0
+        bytes_per_simulation = 0.0
+        batch_size = 1
+        while True:
+            num_trial = 2 * batch_size * num_workers
+            if num_simulated + num_trial > len(parameters):
+                break
+            if batch_size * bytes_per_simulation > max_batch_memory_bytes:
+                break
+
+            peak_before = peak_memory()
+            if simulation_cache is not None:
+                num_misses = simulation_cache.num_misses
+            start_time = time.perf_counter()
+            x = simulate_or_lookup(
+                simulator,
+                parameters[num_simulated : num_simulated + num_trial],
+                batch_size,
+                x_dim,
+                simulation_executor,
+                num_workers,
+                simulation_cache,
+                max_retries,
+                timeout,
+                failures,
+                process_pool=process_pool,
+                x_dtype=x_dtype,
+            )
+            elapsed_time = time.perf_counter() - start_time
+
+            xs.append(x)
+            num_simulated += num_trial
+            bytes_per_simulation = max(
+                bytes_per_simulation,
+                x[0].numel() * x.element_size(),
+                (peak_memory() - peak_before) / batch_size,
+            )
+
+            if (
+                simulation_cache is not None
+                and simulation_cache.num_misses - num_misses < num_trial
+            ):
+                # Lookups say nothing about the throughput of the simulator.
+                batch_size *= 2
+                continue
+            throughput = num_trial / elapsed_time
+            best_throughput = max(throughputs.values(), default=0.0)
+            throughputs[batch_size] = throughput
+            if throughput < 1.05 * best_throughput:
+                break
+            batch_size *= 2
+
+    best_batch_size = max(throughputs, key=throughputs.get, default=1)
+    data = torch.cat(xs) if xs else torch.empty(0, *x_dim)
+    return best_batch_size, data, throughputs
+
+
+def draw_seed() -> int:
+    """Return a seed for simulations, drawn from the global torch RNG."""
+    return torch.randint(2 ** 31 - 1, (1,)).item()
+
+
+def simulate_batches(
+    simulator: Callable,
+    parameters: Tensor,
+    simulation_batch_size: int,
+    simulation_executor: str = "serial",
+    num_workers: int = 1,
+    seed: Optional[int] = None,
+    x_dim: Optional[torch.Size] = None,
+    max_retries: int = 0,
+    timeout: Optional[float] = None,
+    failures: Optional[SimulationFailures] = None,
+    process_pool: Optional[SimulationProcessPool] = None,
+    x_dtype: Optional[torch.dtype] = None,
+) -> Tensor:
+    """Return simulated data for parameters, simulated in batches.
+
+    Coroutine simulators are not run batch by batch, but concurrently for all
+    parameters, with the concurrency limit of the `AsyncSimulator`. The executor is
+    not used for them, since they wait for I/O rather than compute. Neither is it
+    used for a `SimulationFarm`, whose workers simulate the batches.
+
+    Args:
+        simulator: batch simulator returning Tensors.
+        parameters: parameters of shape (num_samples, parameter_dim).
+        simulation_batch_size: number of parameters simulated in a single batch.
+        simulation_executor: one of 'serial', 'threads' or 'processes'.
+        num_workers: number of threads or processes of parallel executors.
+        seed: if given, batch i is simulated with seed `seed + i`. Seeded batches in
+            the main process don't advance the global RNG. Retry k of a batch uses
+            the seed of the batch plus `k` times the number of batches. Ignored by
+            the 'threads' executor and coroutine simulators, which share the global
+            RNGs.
+        x_dim: shape of the data of a single simulation. Required with `failures`.
+        max_retries: number of times a simulator call that raised is repeated.
+        timeout: time in seconds after which a simulator call counts as failed.
+            With the 'serial' executor, calls with a timeout run one at a time in a
+            worker process, see `SimulationProcessPool`.
+        failures: if given, the data of calls that failed after all retries is NaN
+            and the failures are recorded. Otherwise, the first error is raised.
+        process_pool: worker processes for `simulator` to reuse across calls, of
+            the 'processes' executor or of calls with a timeout. If None, processes
+            are started for this call.
+        x_dtype: dtype of the simulator output. Process workers write their data
+            into shared memory of this dtype, the default dtype if None.
+
+    Raises:
+        ValueError: if `simulation_executor` is not supported.
+
+    Returns:
+        Simulated data, in the order of the parameters.
+    """
+
+    if failures is None:
+        # Unsupervised: errors are raised right away.
+        failures, max_retries = _RaisingFailures(), 0
+    assert (
+        x_dim is not None or type(failures) is _RaisingFailures
+    ), "`x_dim` is required to fill in the data of failed simulator calls."
+
+    if isinstance(simulator, AsyncSimulator):
+        return simulator.simulate(parameters, x_dim, max_retries, failures)
+
     # split parameter set into batches of size (simulation_batch_size, num_dim_parameters)
-    n_chunks = math.ceil(num_samples / simulation_batch_size)
+    n_chunks = math.ceil(parameters.shape[0] / simulation_batch_size)
     parameter_batches = torch.chunk(parameters, chunks=n_chunks)
+    num_batches = len(parameter_batches)
+    out = None
+
+    if isinstance(simulator, SimulationFarm):
+        results = simulator.simulate_batches(
+            parameter_batches,
+            draw_seed() if seed is None else seed,
+            max_retries=max_retries,
+            timeout=timeout,
+        )
+    elif simulation_executor == "serial" and timeout is None:
+        results = [
+            call_supervised(
+                _batch_simulation(
+                    simulator,
+                    batch,
+                    None if seed is None else seed + i,
+                    seed_stride=num_batches,
+                ),
+                max_retries,
+            )
+            for i, batch in enumerate(parameter_batches)
+        ]
+    else:
+        if simulation_executor == "serial":
+            # Hanging calls can only be stopped by killing the process they run in.
+            simulation_executor, num_workers = "processes", 1
+        if simulation_executor == "processes" and x_dim is not None:
+            # Worker processes write their data into shared memory, such that only
+            # completion notices are pickled back. It keeps the dtype of the
+            # simulator, the data is converted once when it is stored for training.
+            # Failed calls are filled in with NaN, which needs a floating dtype.
+            if x_dtype is not None and not x_dtype.is_floating_point:
+                x_dtype = None
+            out = torch.empty(
+                parameters.shape[0], *x_dim, dtype=x_dtype
+            ).share_memory_()
+        results = simulate_batches_in_parallel(
+            simulator,
+            parameter_batches,
+            simulation_executor,
+            num_workers,
+            seed,
+            max_retries=max_retries,
+            timeout=timeout,
+            out=out,
+            process_pool=process_pool,
+        )
+
+    xs, start = [], 0
+    for batch, (x, num_retries, error) in zip(parameter_batches, results):
+        failures.record_call(num_retries, error)
+        if x is None:
+            x = torch.full((batch.shape[0], *x_dim), float("nan"))
+            if out is not None:
+                out[start : start + batch.shape[0]] = x
+        xs.append(x)
+        start += batch.shape[0]
+
+    return out if out is not None else torch.cat(xs)
+
+
+class _RaisingFailures(SimulationFailures):
+    """Failure record of unsupervised simulations, raising the first error."""
+
+    def record_call(self, num_retries: int, error: Optional[BaseException]) -> None:
+        if error is not None:
+            raise error
 
-    with torch.no_grad():
-        xs = torch.cat([simulator(batch) for batch in parameter_batches])
 
-    # XXX We construct a tensor here again because a memory-sharing cast
-    # XXX via as_tensor results in a RuntimeError: Trying to backward through the graph a second time
-    # XXX when doing multiple rounds in SNPE (gradient-tracking problem to investigate).
-    return torch.tensor(parameters), xs
+def _batch_simulation(
+    simulator: Callable,
+    parameters: Tensor,
+    seed: Optional[int],
+    seed_stride: int,
+) -> Callable[[int], Tensor]:
+    """Return a function simulating a batch, of the number of the attempt."""
+
+    def simulate(attempt: int) -> Tensor:
+        with span("simulator_call", batch_size=len(parameters), attempt=attempt):
+            if seed is None:
+                return simulator(parameters)
+            retry_seed = seed + attempt * seed_stride
+            return simulate_seeded_batch(simulator, parameters, retry_seed)
+
+    return simulate
+
+
+def simulate_seeded_batch(simulator: Callable, parameters: Tensor, seed: int) -> Tensor:
+    """Return simulator output for a batch, with the torch and numpy RNGs seeded.
+
+    The states of the global RNGs are restored afterwards.
+    """
+
+    numpy_state = np.random.get_state()
+    with torch.random.fork_rng(devices=[]):
+        torch.manual_seed(seed)
+        np.random.seed(seed)
+        try:
+            with torch.no_grad():
+                return simulator(parameters)
+        finally:
+            np.random.set_state(numpy_state)
+
+
+def simulate_batches_in_parallel(
+    simulator: Callable,
+    parameter_batches: Tuple[Tensor, ...],
+    simulation_executor: str,
+    num_workers: int,
+    seed: Optional[int] = None,
+    max_retries: int = 0,
+    timeout: Optional[float] = None,
+    out: Optional[Tensor] = None,
+    process_pool: Optional[SimulationProcessPool] = None,
+) -> List[Tuple[Optional[Tensor], int, Optional[BaseException]]]:
+    """Return simulator outputs for every batch, simulated by a pool of workers.
+
+    Args:
+        simulator: batch simulator returning Tensors.
+        parameter_batches: batches of parameters, each of shape (batch_size, dim).
+        simulation_executor: either 'threads' or 'processes'.
+        num_workers: number of threads or processes.
+        seed: batch i is simulated with seed `seed + i` by process workers. Drawn
+            from the global torch RNG if None. Thread workers share the global RNGs
+            and ignore it.
+        max_retries: number of times a simulator call that raised is repeated.
+        timeout: time in seconds after which a simulator call counts as failed. Not
+            supported by the 'threads' executor, since threads can't be stopped.
+        out: tensor in shared memory of shape (num_samples, *x_dim), see
+            `Tensor.share_memory_`. If given, process workers write the data of
+            successful batches into their slice of `out`, and the returned data are
+            views of it. Data of other dtypes is converted to the dtype of `out`.
+        process_pool: worker processes for `simulator` to reuse. If None, processes
+            are started for this call and stopped at its end.
+
+    Raises:
+        ValueError: if `simulation_executor` is not supported, or if it is 'threads'
+            and a `timeout` is given.
+
+    Returns:
+        List with one result of `call_supervised` per batch, i.e. the simulated data
+        or None, the number of retries and the error, in the order of the batches.
+        If a worker process dies, e.g. from a segfault in the simulator, the call
+        it ran has failed and the worker is replaced.
+    """
+
+    if simulation_executor not in SIMULATION_EXECUTORS:
+        raise ValueError(
+            f"`simulation_executor` must be one of {SIMULATION_EXECUTORS}, "
+            f"but is '{simulation_executor}'."
+        )
+    if simulation_executor == "threads" and timeout is not None:
+        raise ValueError(
+            "Simulator calls running in threads can't be stopped when they time "
+            "out. Use the 'processes' executor with a `timeout`."
+        )
+
+    # Parameters sampled from a neural posterior track gradients, which can't cross
+    # process boundaries.
+    parameter_batches = [batch.detach() for batch in parameter_batches]
+    num_batches = len(parameter_batches)
+
+    if simulation_executor == "threads":
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            return list(
+                executor.map(
+                    lambda batch: call_supervised(
+                        _batch_simulation(simulator, batch, None, num_batches),
+                        max_retries,
+                    ),
+                    parameter_batches,
+                )
+            )
+
+    # Seeds are fixed up front, so that the result of every batch does not depend on
+    # which worker runs it or on how many workers there are.
+    if seed is None:
+        seed = draw_seed()
+    seeds = [seed + i for i in range(num_batches)]
+    starts = np.cumsum([0] + [len(batch) for batch in parameter_batches[:-1]])
+
+    if process_pool is None:
+        pool_context = SimulationProcessPool(simulator, num_workers)
+    else:
+        pool_context = nullcontext(process_pool)
+    with pool_context as process_pool:
+        results = process_pool.simulate(
+            parameter_batches,
+            seeds,
+            num_batches,
+            max_retries,
+            timeout,
+            [
+                None if out is None else out[start : start + len(batch)]
+                for batch, start in zip(parameter_batches, starts)
+            ],
+        )
+    if out is not None:
+        results = [
+            (out[start : start + len(batch)] if error is None else x, retries, error)
+            for (x, retries, error), batch, start in zip(
+                results, parameter_batches, starts
+            )
+        ]
+    return results
+
+
+def simulation_process_pool(
+    simulator: Callable, simulation_executor: str, num_workers: int
+) -> SimulationProcessPool:
+    """Return a pool of the worker processes `simulate_batches` uses for an executor,
+    `num_workers` for 'processes' and one to run calls with a timeout otherwise."""
+    return SimulationProcessPool(
+        simulator, num_workers if simulation_executor == "processes" else 1
+    )
+
+
+class SimulationProcessPool:
+    """Forked worker processes simulating batches of a simulator.
+
+    Workers are forked, so that the simulator is inherited and need not be pickled
+    (processed simulators are nested functions). Only parameters and results are
+    sent between processes, and no data if workers write to shared memory. Processes
+    are started on the first batch, such that a pool that is never used costs
+    nothing.
+
+    Every worker runs one simulator call at a time, supervised by the parent: a
+    call that times out is stopped by killing its worker, and a worker that died,
+    e.g. from a segfault in the simulator, fails only the call it ran. Both are
+    replaced by a newly forked worker.
+    """
+
+    def __init__(self, simulator: Callable, num_workers: int):
+        self._simulator = simulator
+        self._num_workers = num_workers
+        self._workers: List[_SimulationWorker] = []
+        # Peak resident memory of any worker, as reported with their results.
+        self.peak_memory_bytes = 0
+
+    def start(self) -> None:
+        """Start all workers that are not running yet."""
+        while len(self._workers) < self._num_workers:
+            self._workers.append(_SimulationWorker(self._simulator))
+
+    def simulate(
+        self,
+        parameter_batches: List[Tensor],
+        seeds: List[int],
+        seed_stride: int,
+        max_retries: int,
+        timeout: Optional[float],
+        outs: List[Optional[Tensor]],
+    ) -> List[Tuple[Optional[Tensor], int, Optional[BaseException]]]:
+        """Return the data, number of retries and error of every batch.
+
+        Batch i is simulated with seed `seeds[i]`, and retry k of it with seed
+        `seeds[i] + k * seed_stride`. Calls that raise or time out are retried up to
+        `max_retries` times. The data of a batch with an `outs[i]` in shared memory
+        is written into it, and None is returned in its place.
+        """
+
+        self.start()
+        results = [None] * len(parameter_batches)
+        pending = deque((index, 0) for index in range(len(parameter_batches)))
+        idle = list(self._workers)
+        busy = {}
+        profiler = get_profiler()
+        try:
+            while pending or busy:
+                while pending and idle:
+                    index, attempt = pending.popleft()
+                    worker = idle.pop()
+                    task = (
+                        parameter_batches[index],
+                        seeds[index],
+                        seed_stride,
+                        attempt,
+                        outs[index],
+                    )
+                    try:
+                        worker.connection.send(task)
+                    except OSError:
+                        # The worker died while idle.
+                        worker = self._replace(worker)
+                        worker.connection.send(task)
+                    deadline = None if timeout is None else time.monotonic() + timeout
+                    busy[worker.connection] = (worker, index, attempt, deadline)
+
+                deadlines = [deadline for *_, deadline in busy.values() if deadline]
+                wait_time = None
+                if deadlines:
+                    wait_time = max(0, min(deadlines) - time.monotonic())
+                ready = wait(list(busy), wait_time)
+                now = time.monotonic()
+                for connection, (worker, index, attempt, deadline) in list(
+                    busy.items()
+                ):
+                    if connection in ready:
+                        try:
+                            x, error, events, peak_memory = connection.recv()
+                        except (EOFError, OSError):
+                            worker = self._replace(worker)
+                            x, error = None, ChildProcessError(
+                                "Simulator call crashed the process it ran in."
+                            )
+                        else:
+                            if profiler is not None:
+                                profiler.add_events(events)
+                            self.peak_memory_bytes = max(
+                                self.peak_memory_bytes, peak_memory or 0
+                            )
+                    elif deadline is not None and now >= deadline:
+                        worker = self._replace(worker)
+                        x, error = None, TimeoutError(
+                            f"Simulator call did not finish within {timeout} seconds."
+                        )
+                    else:
+                        continue
+
+                    del busy[connection]
+                    idle.append(worker)
+                    if error is not None and attempt < max_retries:
+                        pending.append((index, attempt + 1))
+                    else:
+                        results[index] = (x, attempt, error)
+        finally:
+            # Workers still running a call, e.g. after an interrupt, are stopped.
+            for worker, *_ in busy.values():
+                self._workers.remove(worker)
+                worker.kill()
+        return results
+
+    def _replace(self, worker: _SimulationWorker) -> _SimulationWorker:
+        worker.kill()
+        new_worker = _SimulationWorker(self._simulator)
+        self._workers[self._workers.index(worker)] = new_worker
+        return new_worker
+
+    def close(self) -> None:
+        for worker in self._workers:
+            worker.stop()
+        self._workers = []
+
+    def __enter__(self) -> "SimulationProcessPool":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class _SimulationWorker:
+    """Forked process running simulator calls sent through a pipe, see
+    `_run_simulation_worker`."""
+
+    def __init__(self, simulator: Callable):
+        context = mp.get_context("fork")
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=_run_simulation_worker,
+            args=(simulator, child_connection, self.connection),
+            daemon=True,
+        )
+        self.process.start()
+        child_connection.close()
+
+    def stop(self) -> None:
+        """Let the worker exit once its current call is done."""
+        try:
+            self.connection.send(None)
+        except OSError:
+            pass
+        self.process.join()
+        self.connection.close()
+
+    def kill(self) -> None:
+        self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+
+def _run_simulation_worker(
+    simulator: Callable, connection: Connection, parent_connection: Connection
+) -> None:
+    """Simulate the batches received through `connection` until told to stop.
+
+    Sends back the data, or None if it was written to shared memory, the error of
+    the call, if any, the spans recorded while profiling and the peak memory of the
+    worker.
+    """
+
+    parent_connection.close()
+    # Workers already run in parallel, avoid oversubscribing cores with torch threads.
+    torch.set_num_threads(1)
+    # Spans of the worker are sent back with every result, drop those inherited from
+    # the parent process.
+    if get_profiler() is not None:
+        get_profiler().take_events()
+
+    while True:
+        try:
+            task = connection.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+
+        parameters, seed, seed_stride, attempt, out = task
+        x, error = None, None
+        try:
+            x = torch.as_tensor(
+                _batch_simulation(simulator, parameters, seed, seed_stride)(attempt)
+            )
+            if out is not None:
+                if x.shape != out.shape:
+                    raise ValueError(
+                        f"Simulator returned data of shape {tuple(x.shape)}, "
+                        f"expected shape {tuple(out.shape)}."
+                    )
+                out.copy_(x)
+                x = None
+        except Exception as e:
+            x, error = None, e
+        events = [] if get_profiler() is None else get_profiler().take_events()
+        peak_memory = utils.peak_memory_bytes()
+
+        try:
+            connection.send((x, error, events, peak_memory))
+        except Exception:
+            # E.g. the error can't be pickled.
+            connection.send((None, RuntimeError(repr(error)), events, peak_memory))
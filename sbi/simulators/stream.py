@@ -0,0 +1,146 @@
+"""Simulation in a background thread, feeding finished chunks to the trainer."""
+
+import queue
+import threading
+from typing import Callable, List, Optional, Tuple
+
+import torch
+from torch import Tensor
+
+
+class SimulationStream:
+    """Simulates a set of parameters chunk by chunk in a background thread.
+
+    Finished chunks are handed over through a bounded queue, such that training can
+    start on the first chunks while later chunks are still being simulated. When the
+    queue is full, simulation pauses until the consumer catches up, which bounds the
+    memory held by chunks in flight.
+
+    Parameters replacing invalid simulations are never sampled in the background
+    thread, since the proposal may be a neural net that is being trained meanwhile.
+    The thread requests them instead, and waits until they are sampled by the
+    consumer in `receive`, i.e. while training pauses.
+    """
+
+    def __init__(
+        self,
+        simulate_chunk: Callable[
+            [Tensor, Callable[[int], Tensor]], Tuple[Tensor, Tensor]
+        ],
+        parameters: Tensor,
+        chunk_size: int,
+        max_queued_chunks: int = 2,
+        sample_replacements: Optional[Callable[[int], Tensor]] = None,
+    ):
+        """
+        Args:
+            simulate_chunk: function returning the parameters and simulated data
+                of a chunk of parameters, e.g. `simulate_in_batches` with fixed
+                settings. It is passed the chunk and a function returning a given
+                number of parameters to replace invalid simulations with.
+            parameters: all parameters to simulate, of shape (num_samples, dim).
+            chunk_size: number of parameters per chunk.
+            max_queued_chunks: maximal number of finished chunks waiting to be
+                received before simulation pauses.
+            sample_replacements: function sampling parameters to replace invalid
+                simulations with, called in the thread calling `receive`. Without
+                it, requesting replacements raises.
+        """
+
+        self._simulate_chunk = simulate_chunk
+        self._chunks = torch.split(parameters.detach(), chunk_size)
+        self._queue = queue.Queue(maxsize=max_queued_chunks)
+        self._sample_replacements = sample_replacements
+        self._replacements = queue.Queue(maxsize=1)
+        self._num_received = 0
+        self._stop = threading.Event()
+
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+        self._thread.start()
+
+    @property
+    def exhausted(self) -> bool:
+        """Whether all chunks have been received."""
+        return self._num_received == len(self._chunks)
+
+    def receive(self, block: bool = False) -> List[Tuple[Tensor, Tensor]]:
+        """Return the (parameters, data) chunks finished since the last call.
+
+        Replacement parameters requested in the meantime are sampled before
+        returning.
+
+        Args:
+            block: whether to wait for at least one chunk if none is finished yet.
+                Never waits once the stream is exhausted.
+
+        Raises:
+            Exceptions raised while simulating or sampling replacements, in the
+            thread calling `receive`.
+        """
+
+        chunks = []
+        while not self.exhausted:
+            try:
+                item = self._queue.get(block=block and not chunks)
+            except queue.Empty:
+                break
+            if isinstance(item, _ReplacementRequest):
+                try:
+                    self._replacements.put(self._sample(item.num_samples))
+                except BaseException:
+                    self.close()
+                    self._num_received = len(self._chunks)
+                    raise
+                continue
+            if isinstance(item, BaseException):
+                self._num_received = len(self._chunks)
+                raise item
+            self._num_received += 1
+            chunks.append(item)
+        return chunks
+
+    def close(self) -> None:
+        """Stop simulating chunks that were not started yet."""
+        self._stop.set()
+        # Unblock the producer in case it waits for a free slot.
+        while self._thread.is_alive():
+            try:
+                self._queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+    def _sample(self, num_samples: int) -> Tensor:
+        if self._sample_replacements is None:
+            raise RuntimeError(
+                "Simulations of the stream failed, but no function to sample "
+                "replacements was given."
+            )
+        return self._sample_replacements(num_samples).detach()
+
+    def _request_replacements(self, num_samples: int) -> Tensor:
+        """Return `num_samples` replacement parameters sampled by the consumer."""
+        self._queue.put(_ReplacementRequest(num_samples))
+        while True:
+            try:
+                return self._replacements.get(timeout=0.1)
+            except queue.Empty:
+                if self._stop.is_set():
+                    raise RuntimeError("The simulation stream was closed.")
+
+    def _produce(self) -> None:
+        for parameters in self._chunks:
+            if self._stop.is_set():
+                return
+            try:
+                item = self._simulate_chunk(parameters, self._request_replacements)
+            except BaseException as error:
+                self._queue.put(error)
+                return
+            self._queue.put(item)
+
+
+class _ReplacementRequest:
+    """Request of the background thread for replacement parameters."""
+
+    def __init__(self, num_samples: int):
+        self.num_samples = num_samples
@@ -0,0 +1,68 @@
+"""Supervision of simulator calls: retries and bookkeeping of failures.
+
+Timeouts are enforced by the worker processes of `SimulationProcessPool`.
+"""
+
+from typing import Callable, List, Optional, Tuple
+
+import torch
+from torch import Tensor
+
+
+class SimulationFailures:
+    """Record of failed simulator calls and of invalid simulations.
+
+    A simulation is invalid if its simulator call failed after all retries, or if it
+    returned non-finite data. Invalid (parameter, data) pairs are kept in quarantine
+    for inspection instead of being trained on; the data of failed calls is NaN.
+    """
+
+    def __init__(self):
+        self.num_failed_calls = 0
+        self.num_retries = 0
+        self.num_invalid = 0
+        self.last_error: Optional[BaseException] = None
+        self.parameters: List[Tensor] = []
+        self.observations: List[Tensor] = []
+
+    def record_call(self, num_retries: int, error: Optional[BaseException]) -> None:
+        """Record the retries of a simulator call, and its error if it failed."""
+        self.num_retries += num_retries
+        if error is not None:
+            self.num_failed_calls += 1
+            self.last_error = error
+
+    def quarantine(self, parameters: Tensor, observations: Tensor) -> None:
+        """Keep invalid simulations out of training."""
+        self.num_invalid += parameters.shape[0]
+        self.parameters.append(parameters.detach())
+        self.observations.append(observations)
+
+
+def call_supervised(
+    simulate: Callable[[int], Tensor], max_retries: int
+) -> Tuple[Optional[Tensor], int, Optional[BaseException]]:
+    """Call `simulate` until it succeeds, at most `max_retries + 1` times.
+
+    Args:
+        simulate: function of the attempt number, starting at zero, returning the
+            simulated data. Lets retries use a fresh seed.
+        max_retries: number of times a failed call is repeated.
+
+    Returns:
+        Simulated data or None if all attempts failed, the number of retries, and the
+        error of the last failed attempt, if any.
+    """
+
+    error = None
+    for attempt in range(max_retries + 1):
+        try:
+            return simulate(attempt), attempt, None
+        except Exception as e:
+            error = e
+    return None, max_retries, error
+
+
+def is_valid(observations: Tensor) -> Tensor:
+    """Return a boolean mask of the simulations whose data is finite everywhere."""
+    return torch.isfinite(observations.reshape(observations.shape[0], -1)).all(dim=1)
@@ -0,0 +1,164 @@
+"""Simulator of configurable cost, e.g. for benchmarks."""
+
+import time
+from typing import Sequence, Union
+
+import torch
+from torch import Tensor
+
+from sbi.simulators.simulator import Simulator
+
+SYNTHETIC_WORK = ("python", "native", "sleep")
+
+
+class SyntheticSimulator(Simulator):
+    """Simulator of configurable cost, for load and scaling tests.
+
+    The data of a parameter set is the parameters, repeated to fill the observation
+    shape, plus Gaussian noise. Inference thus works as for a linear Gaussian model,
+    while the simulator behaves like an expensive one:
+
+    - every call takes `seconds_per_call` plus `seconds_per_simulation` per parameter
+        set, spent as set by `work`:
+        - 'python': a pure Python loop holding the GIL, such that threads don't
+            run in parallel, like a simulator written in Python.
+        - 'native': torch operations releasing the GIL, like a simulator in
+            compiled code, which scales with threads.
+        - 'sleep': waiting without using the CPU, like a simulator waiting for
+            I/O or a remote service.
+        Work is measured in CPU time of the calling thread, such that calls that
+        compete for the GIL or for cores take longer, as real simulations would.
+    - every simulation holds `memory_bytes_per_simulation` while running.
+    - a call raises with probability `failure_rate`, and the data of a simulation is
+        NaN with probability `nan_rate`.
+
+    Randomness comes from the global torch RNG, such that results are reproducible
+    under `torch.manual_seed` and with seeded batches.
+    """
+
+    def __init__(
+        self,
+        parameter_dim: int = 2,
+        observation_shape: Union[int, Sequence[int]] = 2,
+        noise_std: float = 0.1,
+        seconds_per_simulation: float = 0.0,
+        seconds_per_call: float = 0.0,
+        work: str = "python",
+        memory_bytes_per_simulation: int = 0,
+        batched: bool = True,
+        failure_rate: float = 0.0,
+        nan_rate: float = 0.0,
+    ):
+        """
+        Args:
+            parameter_dim: number of parameters.
+            observation_shape: shape of the data of a single simulation, e.g. (64, 64)
+                for images.
+            noise_std: standard deviation of the noise added to the data.
+            seconds_per_simulation: time spent per parameter set.
+            seconds_per_call: time spent per call, whatever the batch size, e.g. to
+                start up an external program.
+            work: how the time is spent, one of 'python', 'native' or 'sleep'.
+            memory_bytes_per_simulation: memory allocated per parameter set while
+                simulating.
+            batched: whether batches of parameters can be simulated. If False, only
+                single parameter sets of shape (parameter_dim,) are accepted.
+            failure_rate: probability of a call to raise a RuntimeError.
+            nan_rate: probability of the data of a simulation to be NaN.
+        """
+
+        super().__init__()
+
+        if work not in SYNTHETIC_WORK:
+            raise ValueError(
+                f"`work` must be one of {SYNTHETIC_WORK}, but is '{work}'."
+            )
+
+        self._parameter_dim = parameter_dim
+        self._observation_shape = torch.Size(
+            (observation_shape,)
+            if isinstance(observation_shape, int)
+            else observation_shape
+        )
+        self._noise_std = noise_std
+        self._seconds_per_simulation = seconds_per_simulation
+        self._seconds_per_call = seconds_per_call
+        self._work = work
+        self._memory_bytes_per_simulation = memory_bytes_per_simulation
+        self._batched = batched
+        self._failure_rate = failure_rate
+        self._nan_rate = nan_rate
+
+    def __call__(self, parameters: Tensor) -> Tensor:
+        """Return simulated data for a batch of parameters, or a single parameter set
+        if the simulator is not batched.
+
+        Raises:
+            ValueError: if an unbatched simulator is called with a batch.
+            RuntimeError: with probability `failure_rate`.
+        """
+
+        parameters = torch.as_tensor(parameters, dtype=torch.float32)
+        if not self._batched:
+            if parameters.ndim != 1:
+                raise ValueError(
+                    "Simulator is not batched, it simulates a single parameter set of "
+                    f"shape ({self._parameter_dim},) per call."
+                )
+            return self._simulate(parameters.unsqueeze(0))[0]
+        return self._simulate(parameters)
+
+    def _simulate(self, parameters: Tensor) -> Tensor:
+        num_simulations = parameters.shape[0]
+        self.num_total_simulations += num_simulations
+
+        # Filled with ones, such that the memory is actually committed.
+        memory = torch.ones(num_simulations * self._memory_bytes_per_simulation // 4)
+        self._spend(
+            self._seconds_per_call + num_simulations * self._seconds_per_simulation
+        )
+        del memory
+
+        if torch.rand(1).item() < self._failure_rate:
+            raise RuntimeError("Synthetic simulator failed.")
+
+        # Repeat the parameters to fill the observation shape.
+        num_features = self._observation_shape.numel()
+        indices = torch.arange(num_features) % self._parameter_dim
+        x = parameters[:, indices].reshape(num_simulations, *self._observation_shape)
+        x = x + self._noise_std * torch.randn_like(x)
+
+        if self._nan_rate > 0:
+            x[torch.rand(num_simulations) < self._nan_rate] = float("nan")
+        return x
+
+    def _spend(self, seconds: float) -> None:
+        if seconds <= 0:
+            return
+        if self._work == "sleep":
+            time.sleep(seconds)
+            return
+
+        # A deadline in CPU time of this thread rather than wall-clock time, which
+        # would let threads waiting for the GIL finish together.
+        deadline = time.thread_time() + seconds
+        if self._work == "python":
+            while time.thread_time() < deadline:
+                pass
+        else:
+            # Large enough for the GIL to be released most of the time.
+            matrix = torch.ones(128, 128)
+            while time.thread_time() < deadline:
+                torch.mm(matrix, matrix)
+
+    @property
+    def parameter_dim(self) -> int:
+        return self._parameter_dim
+
+    @property
+    def observation_dim(self) -> int:
+        return self._observation_shape.numel()
+
+    @property
+    def name(self) -> str:
+        return "synthetic"
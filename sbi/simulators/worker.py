@@ -0,0 +1,161 @@
+"""Simulation worker of a `SimulationFarm`.
+
+Connects to the farm and simulates the batches it sends until the farm closes:
+
+    python -m sbi.simulators.worker ADDRESS --simulator module:function
+
+where ADDRESS is the `address` of the farm, 'host:port' or 'unix:path', and the
+simulator is imported from an importable module. Start as many workers as wanted, on
+any host that can reach the farm.
+"""
+
+import argparse
+import importlib
+import os
+import socket
+import threading
+import time
+from typing import Callable, List, Optional
+
+import torch
+
+from sbi.simulators.farm import parse_address, receive_message, send_message
+from sbi.simulators.simutils import (
+    SimulationProcessPool,
+    SimulatorSignature,
+    wrap_by_signature,
+)
+
+
+def run_worker(
+    address: str, simulator: Callable, connect_timeout: float = 60.0
+) -> None:
+    """Simulate batches sent by the farm at `address` until it disconnects.
+
+    Args:
+        address: address of the farm, 'host:port' or 'unix:path'.
+        simulator: batch simulator taking and returning Tensors.
+        connect_timeout: time in seconds to keep trying to connect, e.g. while the
+            farm is starting up.
+    """
+
+    connection = connect(address, connect_timeout)
+    process_pool = SimulationProcessPool(simulator, num_workers=1)
+    send_lock = threading.Lock()
+    stopped = threading.Event()
+
+    def send_heartbeats(interval: float) -> None:
+        while not stopped.wait(interval):
+            try:
+                with send_lock:
+                    send_message(connection, {"type": "heartbeat"})
+            except OSError:
+                return
+
+    try:
+        send_message(
+            connection,
+            {"type": "hello", "host": socket.gethostname(), "pid": os.getpid()},
+        )
+        header, _ = receive_message(connection)
+        # Batches run in a child process, which is killed when its call times out.
+        # It is forked before the heartbeat thread starts, and only forked again
+        # after a call timed out or crashed it.
+        process_pool.start()
+        threading.Thread(
+            target=send_heartbeats, args=(header["heartbeat_interval"],), daemon=True
+        ).start()
+
+        while True:
+            try:
+                header, parameters = receive_message(connection)
+            except ConnectionError:
+                return
+            if header["type"] == "stop":
+                return
+
+            [(x, _, error)] = process_pool.simulate(
+                [torch.from_numpy(parameters)],
+                [header["seed"]],
+                seed_stride=1,
+                max_retries=0,
+                timeout=header["timeout"],
+                outs=[None],
+            )
+            if error is None:
+                reply = {"type": "result"}, x.numpy()
+            else:
+                reply = {"type": "error", "error": repr(error)}, None
+            with send_lock:
+                send_message(connection, *reply)
+    finally:
+        stopped.set()
+        process_pool.close()
+        connection.close()
+
+
+def connect(address: str, timeout: float) -> socket.socket:
+    """Return a socket connected to `address`, retrying until `timeout` seconds."""
+
+    family, socket_address = parse_address(address)
+    deadline = time.monotonic() + timeout
+    while True:
+        connection = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            connection.connect(socket_address)
+            return connection
+        except OSError:
+            connection.close()
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.5)
+
+
+def load_simulator(path: str) -> Callable:
+    """Return the simulator at 'module:attribute', e.g. 'my_package.sims:simulate'."""
+    module_name, _, attribute = path.partition(":")
+    if not attribute:
+        raise ValueError(f"Simulator '{path}' must be of the form 'module:function'.")
+    simulator = importlib.import_module(module_name)
+    for name in attribute.split("."):
+        simulator = getattr(simulator, name)
+    return simulator
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Simulate batches sent by an sbi SimulationFarm."
+    )
+    parser.add_argument("address", help="'host:port' or 'unix:path' of the farm.")
+    parser.add_argument(
+        "--simulator",
+        required=True,
+        help="simulator to run, as 'module:function'. The module must be importable.",
+    )
+    parser.add_argument(
+        "--numpy",
+        action="store_true",
+        help="the simulator takes and returns numpy arrays instead of Tensors.",
+    )
+    parser.add_argument(
+        "--unbatched",
+        action="store_true",
+        help="the simulator takes a single parameter set instead of a batch.",
+    )
+    parser.add_argument(
+        "--connect-timeout",
+        type=float,
+        default=60.0,
+        help="seconds to keep trying to connect to the farm.",
+    )
+    args = parser.parse_args(argv)
+
+    simulator = wrap_by_signature(
+        load_simulator(args.simulator),
+        SimulatorSignature(batched=not args.unbatched, numpy=args.numpy),
+    )
+    run_worker(args.address, simulator, args.connect_timeout)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,17 @@
 from sbi.utils.get_nn_models import classifier_nn, likelihood_nn, posterior_nn
-from sbi.utils.io import get_data_root, get_log_root, get_project_root, get_timestamp
-from sbi.utils.logging import summarize
+from sbi.utils.designs import PriorDesign
+from sbi.utils.io import (
+    get_data_root,
+    get_log_root,
+    get_project_root,
+    get_timestamp,
+    load_simulations,
+    save_simulations,
+)
+from sbi.utils.logging import peak_memory_bytes, summarize
 from sbi.utils.mmd import biased_mmd, unbiased_mmd_squared
 from sbi.utils.plot import plot_hist_marginals, plot_hist_marginals_pair
+from sbi.utils.profiling import profile
 from sbi.utils.sbiutils import (
     Normalize,
     match_shapes_of_inputs_and_contexts,
@@ -10,6 +19,7 @@ from sbi.utils.sbiutils import (
 )
 from sbi.utils.torchutils import (
     BoxUniform,
+    TensorBatches,
     cbrt,
     create_alternating_binary_mask,
     create_mid_split_binary_mask,
@@ -21,6 +31,7 @@ from sbi.utils.torchutils import (
     merge_leading_dims,
     random_orthogonal,
     repeat_rows,
+    sample_contrasting_indices,
     searchsorted,
     split_leading_dim,
     sum_except_batch,
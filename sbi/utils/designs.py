@@ -0,0 +1,107 @@
+"""Space-filling designs for sampling parameters from the prior."""
+
+import warnings
+from typing import Callable, Optional
+
+import torch
+from torch import Tensor
+from torch.distributions import Independent, MultivariateNormal, Normal, Uniform
+from torch.quasirandom import SobolEngine
+
+PRIOR_DESIGNS = ("iid", "sobol", "lhs")
+
+
+class PriorDesign:
+    """Sampler of parameters from the prior, i.i.d. or from a space-filling design.
+
+    Space-filling designs cover the prior more evenly than i.i.d. samples, which
+    helps most when few simulations are affordable, e.g. in the first round:
+
+    - 'sobol': scrambled Sobol points. Consecutive calls continue the sequence, such
+        that all samples drawn so far form a single design, e.g. those of the pilot
+        run and of the first round.
+    - 'lhs': a Latin hypercube per call, with a single sample in each of the
+        `num_samples` equally probable intervals of every parameter.
+
+    The points in the unit cube are mapped to parameters with the inverse CDF of the
+    prior, which is available for uniform and normal priors with independent
+    parameters, such as `BoxUniform`, and for multivariate normal priors. Other priors
+    are sampled i.i.d. with a warning.
+
+    All designs are drawn from the global torch RNG, and thus reproducible under
+    `torch.manual_seed`.
+    """
+
+    def __init__(self, prior, design: str = "iid"):
+        """
+        Args:
+            prior: PyTorch prior.
+            design: one of 'iid', 'sobol' or 'lhs'.
+        """
+
+        if design not in PRIOR_DESIGNS:
+            raise ValueError(
+                f"`design` must be one of {PRIOR_DESIGNS}, but is '{design}'."
+            )
+
+        self._prior = prior
+        self._icdf = None
+        if design != "iid":
+            self._icdf = prior_icdf(prior)
+            if self._icdf is None:
+                warnings.warn(
+                    f"The prior has no inverse CDF, so the '{design}' design is not "
+                    f"available and parameters are sampled i.i.d. from the prior."
+                )
+                design = "iid"
+        self.design = design
+        self._sobol_engine: Optional[SobolEngine] = None
+
+    def sample(self, num_samples: int) -> Tensor:
+        """Return `num_samples` parameter sets, of shape (num_samples, dim)."""
+
+        if self.design == "iid":
+            return self._prior.sample((num_samples,))
+
+        dim = (self._prior.batch_shape + self._prior.event_shape).numel()
+        if self.design == "sobol":
+            if self._sobol_engine is None:
+                seed = torch.randint(2 ** 31 - 1, (1,)).item()
+                self._sobol_engine = SobolEngine(dim, scramble=True, seed=seed)
+            points = self._sobol_engine.draw(num_samples)
+        else:
+            points = latin_hypercube(num_samples, dim)
+
+        # Keep points off the boundary, where the inverse CDF can be infinite.
+        eps = torch.finfo(points.dtype).eps
+        return self._icdf(points.clamp(eps, 1 - eps))
+
+
+def prior_icdf(prior) -> Optional[Callable[[Tensor], Tensor]]:
+    """Return the map from the unit cube to the parameter space of the prior, which
+    transforms uniform samples into prior samples, or None if it is not known."""
+
+    distribution = prior.base_dist if isinstance(prior, Independent) else prior
+    if isinstance(distribution, (Uniform, Normal)):
+        return distribution.icdf
+
+    if isinstance(prior, MultivariateNormal):
+        standard_normal = Normal(0.0, 1.0)
+
+        def icdf(points: Tensor) -> Tensor:
+            z = standard_normal.icdf(points)
+            return prior.loc + (prior.scale_tril @ z.unsqueeze(-1)).squeeze(-1)
+
+        return icdf
+
+    return None
+
+
+def latin_hypercube(num_samples: int, dim: int) -> Tensor:
+    """Return a Latin hypercube sample of `num_samples` points in the unit cube.
+
+    Every dimension is split into `num_samples` intervals of equal width, and every
+    interval contains exactly one point, at a uniformly random position.
+    """
+    intervals = torch.stack([torch.randperm(num_samples) for _ in range(dim)], dim=1)
+    return (intervals + torch.rand(num_samples, dim)) / num_samples
@@ -3,6 +3,12 @@
 import os
 import time
 from pathlib import Path
+from typing import Iterator, Sequence, Tuple, Union
+
+import numpy as np
+import torch
+from torch import Tensor
+
 
 def get_timestamp():
     # TODO make time stamp iso format
@@ -20,3 +26,71 @@ def get_log_root():
 
 def get_data_root():
     return os.path.join(get_project_root(), "data")
+
+
+def save_simulations(
+    path: str,
+    parameters: Union[Tensor, np.ndarray],
+    observations: Union[Tensor, np.ndarray],
+) -> None:
+    """Save a shard of simulations as .npz file, readable by `load_simulations`."""
+    np.savez(
+        path,
+        parameters=np.asarray(parameters, dtype=np.float32),
+        observations=np.asarray(observations, dtype=np.float32),
+    )
+
+
+def load_simulations(
+    paths: Union[str, Sequence[str]],
+    parameters_key: str = "parameters",
+    observations_key: str = "observations",
+    chunk_size: int = 100_000,
+) -> Iterator[Tuple[Tensor, Tensor]]:
+    """Yield (parameters, observations) chunks from shards of simulations on disk.
+
+    Shards are read one at a time, such that archives larger than memory can be
+    streamed into a memory-mapped simulation bank. Supported formats are numpy
+    .npz files and HDF5 files (.h5, .hdf5), which require `h5py` and are read in
+    chunks of `chunk_size` simulations.
+
+    Args:
+        paths: path or list of paths of the shards.
+        parameters_key: name of the array holding the parameters in every shard.
+        observations_key: name of the array holding the observations in every shard.
+        chunk_size: maximal number of simulations per chunk read from HDF5 files.
+
+    Returns:
+        Iterator over (parameters, observations) tensors with matching leading
+        dimension.
+    """
+
+    if isinstance(paths, str):
+        paths = [paths]
+
+    for path in paths:
+        if path.endswith(".npz"):
+            with np.load(path) as shard:
+                yield (
+                    torch.from_numpy(shard[parameters_key]),
+                    torch.from_numpy(shard[observations_key]),
+                )
+        elif path.endswith((".h5", ".hdf5")):
+            try:
+                import h5py
+            except ImportError:
+                raise ImportError(
+                    f"Reading HDF5 shard {path} requires h5py: pip install h5py"
+                )
+            with h5py.File(path, "r") as shard:
+                num_simulations = shard[parameters_key].shape[0]
+                for start in range(0, num_simulations, chunk_size):
+                    end = start + chunk_size
+                    yield (
+                        torch.from_numpy(shard[parameters_key][start:end]),
+                        torch.from_numpy(shard[observations_key][start:end]),
+                    )
+        else:
+            raise ValueError(
+                f"Unsupported shard format of {path}, expected .npz, .h5 or .hdf5."
+            )
@@ -1,3 +1,6 @@
+import sys
+from typing import Optional
+
 import torch
 
 import sbi.simulators as simulators
@@ -118,6 +121,53 @@ def summarize(
         global_step=round_ + 1,
     )
 
+    # Failures are counted while simulating, rounds without simulations have none.
+    for key in (
+        "num_failed_simulation_calls",
+        "num_simulation_retries",
+        "num_invalid_simulations",
+    ):
+        if key in summary:
+            summary[key].extend([0] * (round_ + 1 - len(summary[key])))
+            summary_writer.add_scalar(
+                tag=key[len("num_") :],
+                scalar_value=summary[key][round_],
+                global_step=round_ + 1,
+            )
+
+    # Time spent in each phase, and the peak memory of the process so far.
+    for key, tag in (
+        ("simulation_times", "simulation_time"),
+        ("proposal_sampling_times", "proposal_sampling_time"),
+        ("neural_net_fit_times", "neural_net_fit_time"),
+        ("training_times", "training_time"),
+        ("validation_times", "validation_time"),
+        ("leakage_estimation_times", "leakage_estimation_time"),
+        ("num_forward_passes", "forward_passes"),
+    ):
+        if key in summary:
+            summary[key].extend([0] * (round_ + 1 - len(summary[key])))
+            summary_writer.add_scalar(
+                tag=tag, scalar_value=summary[key][round_], global_step=round_ + 1,
+            )
+
+    if "epoch_times" in summary:
+        summary["epoch_times"].append(
+            summary["training_times"][round_] / max(summary["epochs"][-1], 1)
+        )
+        summary_writer.add_scalar(
+            tag="epoch_time",
+            scalar_value=summary["epoch_times"][-1],
+            global_step=round_ + 1,
+        )
+
+    peak_memory = peak_memory_bytes()
+    if "peak_memory_bytes" in summary and peak_memory is not None:
+        summary["peak_memory_bytes"].append(peak_memory)
+        summary_writer.add_scalar(
+            tag="peak_memory_bytes", scalar_value=peak_memory, global_step=round_ + 1,
+        )
+
     if summary["mmds"]:
         summary_writer.add_scalar(
             tag="mmd", scalar_value=summary["mmds"][-1], global_step=round_ + 1,
@@ -126,3 +176,22 @@ def summarize(
     summary_writer.flush()
 
     return summary_writer, summary
+
+
+def peak_memory_bytes(include_children: bool = False) -> Optional[int]:
+    """Return the peak resident memory of this process, None if unknown.
+
+    Args:
+        include_children: whether to return the peak of this process or of any of
+            its finished child processes, e.g. simulation workers.
+    """
+    try:
+        import resource
+    except ImportError:
+        # Not available on Windows.
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if include_children:
+        peak = max(peak, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # Reported in bytes on macOS, in kilobytes elsewhere.
+    return peak if sys.platform == "darwin" else 1024 * peak
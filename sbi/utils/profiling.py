@@ -0,0 +1,130 @@
+"""Lightweight profiling spans, exported as Chrome trace.
+
+Inference, simulation and sampling record nested spans while profiling is switched
+on with `profile`:
+
+    with utils.profile("trace.json"):
+        posterior = inference(num_rounds=2, num_simulations_per_round=1000)
+
+The trace can be opened in chrome://tracing or https://ui.perfetto.dev. It has a row
+per process and thread, including simulation worker processes. When profiling is
+off, spans cost a function call.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, Iterator, List, Optional
+
+# Profiler recording spans, None while profiling is off.
+_profiler = None
+
+
+class Profiler:
+    """Record of spans, as events of the Chrome trace format.
+
+    Timestamps are taken with `time.perf_counter`, whose clock is shared by the
+    processes of a machine, such that spans of worker processes line up.
+    """
+
+    def __init__(self):
+        self.events: List[Dict[str, Any]] = []
+
+    def add_span(
+        self, name: str, start_time: float, end_time: float, args: Dict[str, Any]
+    ) -> None:
+        """Add a span from `start_time` to `end_time`, in seconds of
+        `time.perf_counter`."""
+        self.events.append(
+            dict(
+                name=name,
+                cat="sbi",
+                ph="X",
+                ts=start_time * 1e6,
+                dur=(end_time - start_time) * 1e6,
+                pid=os.getpid(),
+                tid=threading.get_ident(),
+                args=args,
+            )
+        )
+
+    def add_events(self, events: List[Dict[str, Any]]) -> None:
+        """Add events recorded elsewhere, e.g. by a worker process."""
+        self.events.extend(events)
+
+    def take_events(self) -> List[Dict[str, Any]]:
+        """Return the recorded events and start a new record."""
+        events, self.events = self.events, []
+        return events
+
+    def save(self, path: str) -> None:
+        """Write the spans to a Chrome trace JSON file."""
+        with open(path, "w") as f:
+            json.dump(dict(traceEvents=self.events, displayTimeUnit="ms"), f)
+
+
+def get_profiler() -> Optional[Profiler]:
+    """Return the active profiler, None if profiling is off."""
+    return _profiler
+
+
+@contextmanager
+def profile(path: Optional[str] = None) -> Iterator[Profiler]:
+    """Record spans within the context and write them to `path`, if given.
+
+    Yields:
+        The profiler, whose `events` can be inspected or saved.
+    """
+    global _profiler
+    previous_profiler, _profiler = _profiler, Profiler()
+    try:
+        yield _profiler
+    finally:
+        profiler, _profiler = _profiler, previous_profiler
+        if path is not None:
+            profiler.save(path)
+
+
+def span(name: str, **args):
+    """Return a context manager recording a span while profiling, e.g.
+
+        with span("simulate", num_simulations=100):
+            ...
+
+    Args:
+        name: name of the span.
+        args: details of the span shown in the trace.
+    """
+    if _profiler is None:
+        return nullcontext()
+    return _span(_profiler, name, args)
+
+
+@contextmanager
+def _span(profiler: Profiler, name: str, args: Dict[str, Any]) -> Iterator[None]:
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        profiler.add_span(name, start_time, time.perf_counter(), args)
+
+
+def add_span(
+    name: str, start_time: float, end_time: Optional[float] = None, **args
+) -> None:
+    """Record a span from `start_time` to `end_time` while profiling, for code that
+    already measures its time with `time.perf_counter`.
+
+    Args:
+        name: name of the span.
+        start_time: start of the span, in seconds of `time.perf_counter`.
+        end_time: end of the span, now if None.
+        args: details of the span shown in the trace.
+    """
+    if _profiler is None:
+        return
+    if end_time is None:
+        end_time = time.perf_counter()
+    _profiler.add_span(name, start_time, end_time, args)
@@ -5,6 +5,7 @@ from typing import Tuple, Sequence, Union
 import torch
 import torch.nn as nn
 import sbi.utils as utils
+from sbi.utils.profiling import add_span
 
 
 # XXX standardize? zscore?
@@ -132,6 +133,7 @@ def sample_posterior_within_prior(
         not posterior_nn.training
     ), "posterior nn is in training mode, but has to be in eval mode for sampling."
 
+    start_time = time.perf_counter()
     samples = []
     num_remaining = num_samples
     num_sampled_total = 0
@@ -158,6 +160,12 @@ def sample_posterior_within_prior(
 
     # estimate acceptance probability
     acceptance_prob = float((samples.shape[0]) / num_sampled_total)
+    add_span(
+        "sample_posterior_within_prior",
+        start_time,
+        num_samples=num_samples,
+        acceptance_rate=acceptance_prob,
+    )
 
     if num_remaining > 0:
         warnings.warn(
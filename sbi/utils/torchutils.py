@@ -1,6 +1,6 @@
 """Various PyTorch utility functions."""
 
-from typing import List, Union
+from typing import Iterator, List, Sequence, Tuple, Union
 
 import numpy as np
 import torch
@@ -141,6 +141,47 @@ def create_random_binary_mask(features):
     return mask
 
 
+def sample_contrasting_indices(batch_size: int, num_samples: int) -> Tensor:
+    """Return `num_samples` distinct indices of other elements of a batch, for every
+    element, e.g. to choose contrasting atoms.
+
+    Every row is a uniform random subset of the indices in `[0, batch_size)` except
+    its own, in no particular order. Instead of sampling from a dense
+    (batch_size, batch_size) matrix of probabilities, indices are drawn uniformly
+    from the `batch_size - 1` others and duplicates are redrawn until there are none,
+    which takes O(batch_size * num_samples) time and memory while few duplicates are
+    drawn, i.e. while at most an eighth of the others are sampled. Otherwise, the
+    others with the largest random keys are chosen, whose cost is of the same order.
+
+    Args:
+        batch_size: number of elements of the batch.
+        num_samples: number of indices per element, at most `batch_size - 1`.
+
+    Returns:
+        Indices of shape (batch_size, num_samples).
+    """
+
+    num_others = batch_size - 1
+    assert 0 <= num_samples <= num_others, "Can't sample more than the other indices."
+
+    if 8 * num_samples > num_others:
+        keys = torch.rand(batch_size, num_others)
+        choices = keys.topk(num_samples, dim=1, sorted=False).indices
+    else:
+        choices = torch.randint(num_others, (batch_size, num_samples))
+        while True:
+            choices, _ = choices.sort(dim=1)
+            is_duplicate = torch.zeros_like(choices, dtype=torch.bool)
+            is_duplicate[:, 1:] = choices[:, 1:] == choices[:, :-1]
+            num_duplicates = int(is_duplicate.sum())
+            if num_duplicates == 0:
+                break
+            choices[is_duplicate] = torch.randint(num_others, (num_duplicates,))
+
+    # Skip the own index of every row.
+    return choices + (choices >= torch.arange(batch_size)[:, None]).long()
+
+
 def searchsorted(bin_locations, inputs, eps=1e-6):
     bin_locations[..., -1] += eps
     return torch.sum(inputs[..., None] >= bin_locations, dim=-1) - 1
@@ -204,6 +245,55 @@ class BoxUniform(Independent):
         super().__init__(Uniform(low=low, high=high), reinterpreted_batch_ndims)
 
 
+class TensorBatches:
+    """Minibatches of in-memory tensors, a lean replacement of a `DataLoader` with a
+    `SubsetRandomSampler` over a `TensorDataset`.
+
+    Every pass permutes the indices once, and every batch is gathered from each
+    tensor with a single indexing operation, instead of indexing and collating the
+    examples of a batch one by one.
+    """
+
+    def __init__(
+        self,
+        tensors: Sequence[Tensor],
+        indices: Tensor,
+        batch_size: int,
+        shuffle: bool = True,
+        drop_last: bool = False,
+    ):
+        """
+        Args:
+            tensors: tensors with the examples along their first dimension.
+            indices: indices of the examples to iterate over, e.g. those of the
+                training set.
+            batch_size: number of examples per batch.
+            shuffle: whether to iterate over the examples in a new random order in
+                every pass, or in the order of `indices`.
+            drop_last: whether to drop the last batch if it is smaller than
+                `batch_size`.
+        """
+        self._tensors = tuple(tensors)
+        self._indices = torch.as_tensor(indices)
+        self._batch_size = batch_size
+        self._shuffle = shuffle
+        self._drop_last = drop_last
+
+    def __len__(self) -> int:
+        num_examples = len(self._indices)
+        if self._drop_last:
+            return num_examples // self._batch_size
+        return -(-num_examples // self._batch_size)
+
+    def __iter__(self) -> Iterator[Tuple[Tensor, ...]]:
+        indices = self._indices
+        if self._shuffle:
+            indices = indices[torch.randperm(len(indices))]
+        for start in range(0, len(self) * self._batch_size, self._batch_size):
+            batch_indices = indices[start : start + self._batch_size]
+            yield tuple(tensor[batch_indices] for tensor in self._tensors)
+
+
 def ensure_parameter_batched(parameter: Tensor) -> Tensor:
     """
     Return tensors that both have the same tensor.ndim
@@ -0,0 +1,92 @@
+import pytest
+import torch
+from torch.distributions import Gamma, Independent, MultivariateNormal, Normal
+from torch.utils.tensorboard import SummaryWriter
+
+from sbi.inference.base import NeuralInference
+from sbi.simulators.linear_gaussian import linear_gaussian
+from sbi.utils import PriorDesign
+from sbi.utils.torchutils import BoxUniform
+
+
+@pytest.mark.parametrize("design", ("sobol", "lhs"))
+@pytest.mark.parametrize(
+    "prior",
+    (
+        BoxUniform(-torch.ones(3), 2 * torch.ones(3)),
+        Independent(Normal(torch.zeros(3), torch.ones(3)), 1),
+        MultivariateNormal(
+            torch.zeros(3), torch.tensor([[2.0, 0.5, 0], [0.5, 1, 0], [0, 0, 1]])
+        ),
+    ),
+)
+def test_space_filling_designs_match_prior(design, prior):
+    """Test that designs are samples of the prior, of its shape and moments."""
+
+    torch.manual_seed(0)
+    samples = PriorDesign(prior, design).sample(2048)
+
+    assert samples.shape == (2048, 3)
+    assert torch.isfinite(prior.log_prob(samples)).all()
+    assert torch.allclose(samples.mean(dim=0), prior.mean, atol=0.05)
+    assert torch.allclose(samples.std(dim=0), prior.stddev, rtol=0.05)
+
+
+def test_latin_hypercube_is_stratified():
+    """Test that every parameter has one sample per interval of equal probability."""
+
+    prior = BoxUniform(torch.zeros(2), torch.ones(2))
+    samples = PriorDesign(prior, "lhs").sample(50)
+
+    intervals = (samples * 50).floor()
+    for dim in range(2):
+        assert torch.equal(intervals[:, dim].sort().values, torch.arange(50.0))
+
+
+def test_sobol_design_continues_across_calls():
+    """Test that consecutive calls return consecutive points of the sequence."""
+
+    prior = BoxUniform(torch.zeros(2), torch.ones(2))
+
+    torch.manual_seed(0)
+    design = PriorDesign(prior, "sobol")
+    samples = torch.cat((design.sample(16), design.sample(48)))
+
+    torch.manual_seed(0)
+    assert torch.equal(samples, PriorDesign(prior, "sobol").sample(64))
+
+
+def test_probe_simulations_are_part_of_the_first_round(tmp_path):
+    """Test that the probe parameters are the first points of the first round's
+    design, and that they count towards its number of simulations."""
+
+    prior = BoxUniform(torch.zeros(2), torch.ones(2))
+
+    torch.manual_seed(0)
+    inference = NeuralInference(
+        linear_gaussian,
+        prior,
+        torch.zeros(2),
+        summary_writer=SummaryWriter(str(tmp_path)),
+        prior_design="sobol",
+    )
+    inference._simulate_round(0, inference._prior_design.sample, num_samples=16)
+
+    # The first 16 points of a Sobol sequence have one point in each of 16 equal
+    # intervals of every parameter.
+    parameters = inference._simulation_bank.get("parameters")
+    intervals = (parameters * 16).floor()
+    assert len(parameters) == 16
+    for dim in range(2):
+        assert torch.equal(intervals[:, dim].sort().values, torch.arange(16.0))
+
+
+def test_prior_design_falls_back_to_iid():
+
+    prior = Independent(Gamma(torch.ones(2), torch.ones(2)), 1)
+    with pytest.warns(UserWarning):
+        design = PriorDesign(prior, "sobol")
+    assert design.design == "iid" and design.sample(10).shape == (10, 2)
+
+    with pytest.raises(ValueError):
+        PriorDesign(prior, "grid")
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+import torch
+from torch import nn
+
+from sbi.inference.snl.snl import PotentialFunctionProvider as SnlPotentialProvider
+from sbi.inference.snpe.snpe_base import (
+    PotentialFunctionProvider as SnpePotentialProvider,
+)
+from sbi.inference.sre.sre import PotentialFunctionProvider as SrePotentialProvider
+from sbi.utils.torchutils import BoxUniform
+
+
+class GaussianDensity(nn.Module):
+    """Density estimator of a standard normal, ignoring its context."""
+
+    def log_prob(self, inputs, context):
+        return torch.distributions.Normal(0.0, 1.0).log_prob(inputs).sum(-1)
+
+
+@pytest.mark.parametrize(
+    "provider, neural_net",
+    (
+        (SnpePotentialProvider(), GaussianDensity()),
+        (SnlPotentialProvider(), GaussianDensity()),
+        (SrePotentialProvider(), nn.Linear(4, 1)),
+    ),
+)
+@pytest.mark.parametrize("mcmc_method", ("slice-np", "slice"))
+def test_potential_statistics(provider, neural_net, mcmc_method):
+    """Test that calls, batch sizes and evaluations outside the prior are counted."""
+
+    prior = BoxUniform(-torch.ones(2), torch.ones(2))
+    potential_function = provider(prior, neural_net, torch.zeros(1, 2), mcmc_method)
+
+    parameters = [[0.5, 0.5], [0.0, -0.5], [2.0, 0.0]]
+    for parameter in parameters:
+        if mcmc_method == "slice-np":
+            potential_function(np.array(parameter))
+        else:
+            potential_function({"": torch.tensor([parameter])})
+
+    statistics = provider.statistics
+    assert statistics.num_calls == statistics.num_evaluations == 3
+    assert statistics.batch_sizes == {1: 3}
+    assert statistics.num_outside_prior == 1
+    assert statistics.fraction_outside_prior == pytest.approx(1 / 3)
+    assert statistics.network_time > 0 and statistics.prior_time > 0
+
+    # Statistics are those of the potential function returned last.
+    provider(prior, neural_net, torch.zeros(1, 2), mcmc_method)
+    assert provider.statistics.num_calls == 0
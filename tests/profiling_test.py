@@ -0,0 +1,53 @@
+import json
+import os
+
+import torch
+
+from sbi.simulators.linear_gaussian import linear_gaussian
+from sbi.simulators.simutils import simulate_in_batches
+from sbi.utils import profile
+from sbi.utils.profiling import get_profiler, span
+
+
+def test_spans_of_simulation_workers(tmp_path):
+    """Test that spans of worker processes are recorded, nested in the trace."""
+
+    path = str(tmp_path / "trace.json")
+    with profile(path) as profiler:
+        with span("outer"):
+            simulate_in_batches(
+                linear_gaussian,
+                lambda n: torch.randn(n, 2),
+                num_samples=40,
+                simulation_batch_size=10,
+                x_dim=torch.Size([2]),
+                simulation_executor="processes",
+                num_workers=2,
+            )
+    assert get_profiler() is None
+
+    with open(path) as f:
+        events = json.load(f)["traceEvents"]
+    assert events == profiler.events
+
+    spans = {}
+    for event in events:
+        spans.setdefault(event["name"], []).append(event)
+    outer = spans["outer"][0]
+    calls = spans["simulator_call"]
+
+    assert len(calls) == 4
+    assert all(call["pid"] != os.getpid() for call in calls)
+    assert all(call["args"]["batch_size"] == 10 for call in calls)
+    for call in calls + spans["simulate"] + spans["sample_parameters"]:
+        assert outer["ts"] <= call["ts"]
+        assert call["ts"] + call["dur"] <= outer["ts"] + outer["dur"]
+
+
+def test_no_spans_without_profiling():
+
+    with span("ignored"):
+        pass
+    with profile() as profiler:
+        pass
+    assert get_profiler() is None and profiler.events == []
@@ -0,0 +1,80 @@
+import pytest
+import torch
+
+from sbi.inference.simulation_bank import SimulationBank
+from sbi.utils import load_simulations, save_simulations
+
+
+@pytest.mark.parametrize("storage", ("memory", "memmap"))
+def test_simulation_bank_rounds_and_views(storage, tmp_path):
+    """Test that rounds are stored contiguously and returned as views."""
+
+    bank = SimulationBank(initial_capacity=4, storage=storage, directory=str(tmp_path))
+
+    parameters = [torch.randn(n, 2) for n in (3, 5, 10)]
+    observations = [torch.randn(n, 4) for n in (3, 5, 10)]
+    for theta, x in zip(parameters, observations):
+        bank.append_round(parameters=theta, observations=x)
+
+    assert len(bank) == 18 and bank.num_rounds == 3
+    assert torch.equal(bank.get("parameters"), torch.cat(parameters))
+    assert torch.equal(
+        bank.get("observations", start_round=1), torch.cat(observations[1:])
+    )
+    assert torch.equal(bank.get_round("parameters", -1), parameters[-1])
+    assert all(
+        torch.equal(stored, x)
+        for stored, x in zip(bank.rounds("observations"), observations)
+    )
+    assert torch.equal(
+        bank.round_indices(start_round=1), torch.tensor([1] * 5 + [2] * 10)
+    )
+
+    # Views share memory with the storage.
+    view = bank.get("parameters")
+    assert view.data_ptr() == bank.get_round("parameters", 0).data_ptr()
+
+
+def test_simulation_bank_rejects_inconsistent_fields():
+
+    bank = SimulationBank()
+    bank.append_round(parameters=torch.zeros(2, 3), observations=torch.zeros(2, 1))
+
+    with pytest.raises(ValueError):
+        bank.append_round(parameters=torch.zeros(2, 3))
+    with pytest.raises(ValueError):
+        bank.append_round(parameters=torch.zeros(2, 2), observations=torch.zeros(2, 1))
+    with pytest.raises(ValueError):
+        bank.append_round(parameters=torch.zeros(2, 3), observations=torch.zeros(3, 1))
+
+
+def test_simulation_bank_from_shards(tmp_path):
+    """Test that shards saved to disk are streamed into the first round."""
+
+    parameters, observations = torch.randn(10, 2), torch.randn(10, 3)
+    paths = []
+    for i, (theta, x) in enumerate(zip(parameters.split(4), observations.split(4))):
+        paths.append(str(tmp_path / f"shard{i}.npz"))
+        save_simulations(paths[-1], theta, x)
+
+    bank = SimulationBank(initial_capacity=2)
+    for theta, x in load_simulations(paths):
+        bank.extend(parameters=theta, observations=x)
+    bank.append_round(parameters=torch.zeros(1, 2), observations=torch.zeros(1, 3))
+
+    assert bank.num_rounds == 2
+    assert torch.equal(bank.get_round("parameters", 0), parameters)
+    assert torch.equal(bank.get_round("observations", 0), observations)
+
+
+def test_simulation_bank_converts_to_dtype():
+    """Test that floating point fields are converted into the bank's dtype."""
+
+    bank = SimulationBank(dtype=torch.float32)
+    x = torch.randn(3, 2, dtype=torch.float64)
+    bank.append_round(observations=x, masks=torch.ones(3, 1, dtype=torch.bool))
+    bank.extend(observations=x, masks=torch.zeros(3, 1, dtype=torch.bool))
+
+    assert bank.get("observations").dtype == torch.float32
+    assert bank.get("masks").dtype == torch.bool
+    assert torch.equal(bank.get("observations"), torch.cat((x, x)).float())
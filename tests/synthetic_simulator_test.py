@@ -0,0 +1,89 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import torch
+
+from sbi.simulators.simutils import prepare_sbi_problem, simulate_in_batches
+from sbi.simulators.supervision import SimulationFailures
+from sbi.simulators.synthetic import SYNTHETIC_WORK, SyntheticSimulator
+from sbi.utils.torchutils import BoxUniform
+
+
+def test_synthetic_simulator_data():
+    """Test shapes and reproducibility of the data, with and without batching."""
+
+    parameters = torch.randn(100, 3)
+
+    simulator = SyntheticSimulator(parameter_dim=3, observation_shape=(4, 4))
+    torch.manual_seed(0)
+    x = simulator(parameters)
+    torch.manual_seed(0)
+    assert torch.equal(x, simulator(parameters))
+
+    assert x.shape == (100, 4, 4) and simulator.num_total_simulations == 200
+    assert torch.allclose(x.reshape(100, -1)[:, :3], parameters, atol=0.5)
+
+    unbatched = SyntheticSimulator(parameter_dim=3, batched=False)
+    assert unbatched(parameters[0]).shape == (2,)
+    with pytest.raises(ValueError):
+        unbatched(parameters)
+
+    prior = BoxUniform(torch.zeros(3), torch.ones(3))
+    with pytest.warns(UserWarning):
+        batch_simulator, _, _ = prepare_sbi_problem(unbatched, prior, torch.zeros(2))
+    assert batch_simulator(parameters).shape == (100, 2)
+
+
+@pytest.mark.parametrize("work", ("python", "native", "sleep"))
+def test_synthetic_simulator_cost(work):
+
+    simulator = SyntheticSimulator(
+        seconds_per_simulation=0.01, seconds_per_call=0.02, work=work
+    )
+    start_time = time.perf_counter()
+    simulator(torch.zeros(3, 2))
+    assert time.perf_counter() - start_time >= 0.05
+
+
+@pytest.mark.parametrize("work", SYNTHETIC_WORK)
+def test_synthetic_simulator_on_threads(work):
+    """Test that only 'python' work holds the GIL, such that calls on threads run
+    one after the other."""
+
+    num_threads = 4
+    if work == "native" and (os.cpu_count() or 1) < num_threads:
+        pytest.skip("Native work needs a core per thread to run in parallel.")
+
+    simulator = SyntheticSimulator(seconds_per_call=0.1, work=work)
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(num_threads) as executor:
+        list(executor.map(simulator, [torch.zeros(1, 2)] * num_threads))
+    seconds = time.perf_counter() - start_time
+
+    if work == "python":
+        assert seconds >= 0.1 * (num_threads - 1)
+    else:
+        assert seconds < 0.1 * 2
+
+
+def test_synthetic_simulator_failures():
+    """Test that injected failures are replaced like real ones."""
+
+    torch.manual_seed(0)
+    simulator = SyntheticSimulator(failure_rate=0.2, nan_rate=0.2)
+    failures = SimulationFailures()
+
+    _, xs = simulate_in_batches(
+        simulator,
+        lambda n: torch.rand(n, 2),
+        num_samples=500,
+        simulation_batch_size=5,
+        x_dim=torch.Size([2]),
+        failures=failures,
+    )
+
+    assert torch.isfinite(xs).all()
+    assert failures.num_failed_calls > 0
+    assert failures.num_invalid > 5 * failures.num_failed_calls
@@ -1,19 +1,43 @@
 from __future__ import annotations
 
+import asyncio
+import os
+import socket
+import threading
+import time
 from typing import Callable, Union
 import pytest
 import torch
 from torch.distributions import Uniform, MultivariateNormal, Distribution
 from torch import Tensor
+from torch.utils.tensorboard import SummaryWriter
 from sbi.simulators.simutils import (
     prepare_sbi_problem,
+    prepare_sbi_problem_and_probe,
+    simulate_batches,
+    wrap_by_signature,
     process_prior,
     process_observed_data,
     process_simulator,
     ScipyPytorchWrapper,
     CustomPytorchWrapper,
+    SimulatorSignature,
+    SimulationProcessPool,
     simulate_in_batches,
+    tune_simulation_batch_size,
 )
+from sbi.inference.base import NeuralInference
+from sbi.simulators.async_simulator import AsyncSimulator
+from sbi.simulators.cache import SimulationCache
+from sbi.simulators.farm import (
+    SimulationFarm,
+    parse_address,
+    receive_message,
+    send_message,
+)
+from sbi.simulators.stream import SimulationStream
+from sbi.simulators.supervision import SimulationFailures
+from sbi.simulators.worker import run_worker
 from scipy.stats import multivariate_normal, uniform, beta
 from sbi.simulators.linear_gaussian import linear_gaussian
 from sbi.utils.torchutils import BoxUniform
@@ -271,3 +295,639 @@ def test_simulate_in_batches(
         batch_size,
         torch.Size([5]),
     )
+
+
+@pytest.mark.parametrize("simulation_executor", ("serial", "threads", "processes"))
+@pytest.mark.parametrize("num_workers", (1, 3))
+def test_simulate_in_batches_executors_keep_order(simulation_executor, num_workers):
+    """Test that parallel executors return data in the order of the parameters."""
+
+    prior = BoxUniform(torch.zeros(2), torch.ones(2))
+
+    parameters, xs = simulate_in_batches(
+        identity_simulator,
+        lambda n: prior.sample((n,)),
+        num_samples=100,
+        simulation_batch_size=7,
+        x_dim=torch.Size([2]),
+        simulation_executor=simulation_executor,
+        num_workers=num_workers,
+    )
+
+    assert torch.equal(parameters, xs)
+
+
+def test_simulate_in_batches_processes_reproducible():
+    """Test that seeded process workers give the same data for any number of workers."""
+
+    prior = BoxUniform(torch.zeros(3), torch.ones(3))
+
+    xs = []
+    for num_workers in (1, 2, 4):
+        torch.manual_seed(1)
+        _, x = simulate_in_batches(
+            linear_gaussian,
+            lambda n: prior.sample((n,)),
+            num_samples=50,
+            simulation_batch_size=5,
+            x_dim=torch.Size([3]),
+            simulation_executor="processes",
+            num_workers=num_workers,
+        )
+        xs.append(x)
+
+    assert torch.equal(xs[0], xs[1]) and torch.equal(xs[0], xs[2])
+
+
+def test_simulate_in_batches_reuses_worker_processes(tmp_path):
+    """Test that passes of replacements run in the same worker processes, and that
+    a worker that died is replaced without failing the calls of other workers."""
+
+    crashed = tmp_path / "crashed"
+
+    def simulator(theta):
+        if not crashed.exists():
+            crashed.touch()
+            os._exit(1)
+        x = torch.full((len(theta), 1), float(os.getpid()))
+        # Every other batch is invalid and replaced in the next pass.
+        if theta[0, 0] > 0.5:
+            x[:] = float("nan")
+        return x
+
+    failures = SimulationFailures()
+    _, xs = simulate_in_batches(
+        simulator,
+        lambda n: torch.rand(n, 1),
+        num_samples=40,
+        simulation_batch_size=1,
+        x_dim=torch.Size([1]),
+        simulation_executor="processes",
+        num_workers=2,
+        failures=failures,
+    )
+
+    # Two workers and the replacement of the crashed one, instead of two per pass.
+    assert crashed.exists() and failures.num_failed_calls == 1
+    assert len(xs.unique()) <= 3
+
+
+def test_simulate_batches_processes_return_data_in_shared_memory():
+    """Test that process workers write their data into shared memory."""
+
+    parameters = torch.arange(12.0).reshape(6, 2)
+
+    def simulator(theta):
+        if (theta[:, 0] == 4).any():
+            raise RuntimeError("Simulator failed.")
+        return theta.double()
+
+    failures = SimulationFailures()
+    xs = simulate_batches(
+        simulator,
+        parameters,
+        2,
+        "processes",
+        2,
+        x_dim=torch.Size([2]),
+        failures=failures,
+    )
+
+    assert xs.is_shared() and xs.dtype == torch.float32
+    assert torch.equal(xs[[0, 1, 4, 5]], parameters[[0, 1, 4, 5]])
+    assert torch.isnan(xs[2:4]).all() and failures.num_failed_calls == 1
+
+    # Data of the simulator's dtype is handed back without conversion.
+    xs = simulate_batches(
+        simulator,
+        parameters,
+        2,
+        "processes",
+        2,
+        x_dim=torch.Size([2]),
+        failures=SimulationFailures(),
+        x_dtype=torch.float64,
+    )
+    assert xs.is_shared() and xs.dtype == torch.float64
+    assert torch.equal(xs[:2], parameters[:2].double())
+
+    # Data of the wrong shape is not written, but counts as a failed call.
+    failures = SimulationFailures()
+    xs = simulate_batches(
+        lambda theta: theta[:, :1],
+        parameters,
+        3,
+        "processes",
+        2,
+        x_dim=torch.Size([2]),
+        failures=failures,
+    )
+    assert torch.isnan(xs).all() and failures.num_failed_calls == 2
+
+
+def test_simulation_cache_skips_cached_parameters(tmp_path):
+    """Test that cached parameters are not simulated again and evicted beyond size."""
+
+    prior = BoxUniform(torch.zeros(2), torch.ones(2))
+    parameters = prior.sample((20,))
+    num_simulated = []
+
+    def counting_simulator(theta):
+        num_simulated.append(theta.shape[0])
+        return linear_gaussian(theta)
+
+    cache = SimulationCache(str(tmp_path))
+
+    def simulate(num_samples):
+        return simulate_in_batches(
+            counting_simulator,
+            lambda n: parameters[:n],
+            num_samples,
+            simulation_batch_size=5,
+            x_dim=torch.Size([2]),
+            simulation_cache=cache,
+        )
+
+    _, xs_first = simulate(10)
+    _, xs_second = simulate(20)
+
+    assert sum(num_simulated) == 20
+    assert torch.equal(xs_first, xs_second[:10])
+    # A new cache object on the same directory finds all entries.
+    assert len(SimulationCache(str(tmp_path))) == 20
+
+    # Shrink the cache, least recently used entries are evicted first.
+    small_cache = SimulationCache(str(tmp_path), max_size_bytes=cache.size_bytes // 2)
+    small_cache.store(parameters[:1], xs_second[:1])
+    assert small_cache.size_bytes <= cache.size_bytes // 2
+    assert small_cache.lookup(parameters[:1])[0] is not None
+
+
+@pytest.mark.parametrize("timeout", (None, 10.0))
+def test_cached_rerun_leaves_rng_stream_unchanged(timeout, tmp_path):
+    """Test that the global RNG advances identically whether parameters were
+    cached or simulated, also when calls run in processes with a timeout."""
+
+    prior = BoxUniform(torch.zeros(2), torch.ones(2))
+    cache = SimulationCache(str(tmp_path))
+
+    def run():
+        torch.manual_seed(0)
+        _, xs = simulate_in_batches(
+            linear_gaussian,
+            lambda n: prior.sample((n,)),
+            20,
+            simulation_batch_size=5,
+            x_dim=torch.Size([2]),
+            simulation_cache=cache,
+            timeout=timeout,
+        )
+        return xs, torch.rand(1)
+
+    xs_first, next_first = run()
+    xs_cached, next_cached = run()
+
+    assert torch.equal(xs_first, xs_cached)
+    assert torch.equal(next_first, next_cached)
+
+
+def test_simulation_stream_delivers_chunks_in_order():
+    """Test that streamed chunks arrive in order and simulator errors are raised."""
+
+    parameters = torch.randn(25, 2)
+    stream = SimulationStream(
+        lambda theta, sample_replacements: (theta, 2 * theta),
+        parameters,
+        chunk_size=10,
+        max_queued_chunks=1,
+    )
+
+    chunks = []
+    while not stream.exhausted:
+        chunks.extend(stream.receive(block=True))
+
+    assert [len(theta) for theta, _ in chunks] == [10, 10, 5]
+    assert torch.equal(torch.cat([x for _, x in chunks]), 2 * parameters)
+    assert stream.receive(block=True) == []
+
+    def failing_simulator(theta, sample_replacements):
+        raise RuntimeError("simulator failed")
+
+    stream = SimulationStream(failing_simulator, parameters, chunk_size=10)
+    with pytest.raises(RuntimeError):
+        stream.receive(block=True)
+
+
+def test_async_simulator_bounded_concurrency_and_timeout():
+    """Test that coroutine simulators run concurrently, in order and time out."""
+
+    prior = BoxUniform(torch.zeros(2), torch.ones(2))
+    num_running, max_running = 0, 0
+
+    async def async_simulator(theta):
+        nonlocal num_running, max_running
+        num_running += 1
+        max_running = max(max_running, num_running)
+        await asyncio.sleep(0.01 * float(theta[0]))
+        num_running -= 1
+        return 2 * theta
+
+    simulator, prior, _ = prepare_sbi_problem(
+        async_simulator, prior, torch.zeros(2), max_concurrent_simulations=4
+    )
+    parameters, xs = simulate_in_batches(
+        simulator,
+        lambda num_samples: prior.sample((num_samples,)),
+        num_samples=20,
+        simulation_batch_size=1,
+        x_dim=torch.Size([2]),
+    )
+
+    assert torch.allclose(xs, 2 * parameters)
+    assert max_running == 4
+
+    async def hanging_simulator(theta):
+        await asyncio.sleep(10)
+        return theta
+
+    simulator = AsyncSimulator(hanging_simulator, timeout=0.01)
+    with pytest.raises(TimeoutError):
+        simulator(prior.sample((2,)))
+
+
+@pytest.mark.parametrize("simulation_executor", ("serial", "threads"))
+def test_simulate_in_batches_replaces_failed_simulations(simulation_executor):
+    """Test retries, quarantine of non-finite data and topping up of simulations."""
+
+    # Seeded, since a top-up of a single simulation can be all non-finite by chance.
+    torch.manual_seed(0)
+    prior = BoxUniform(torch.zeros(2), torch.ones(2))
+    num_calls = 0
+
+    def flaky_simulator(theta):
+        nonlocal num_calls
+        num_calls += 1
+        if num_calls == 1:
+            raise RuntimeError("simulator crashed")
+        x = linear_gaussian(theta)
+        x[theta[:, 0] > 0.8] = float("nan")
+        return x
+
+    failures = SimulationFailures()
+    parameters, xs = simulate_in_batches(
+        flaky_simulator,
+        lambda num_samples: prior.sample((num_samples,)),
+        num_samples=50,
+        simulation_batch_size=5,
+        x_dim=torch.Size([2]),
+        simulation_executor=simulation_executor,
+        max_retries=1,
+        failures=failures,
+    )
+
+    assert parameters.shape == (50, 2) and torch.isfinite(xs).all()
+    assert failures.num_retries == 1 and failures.num_failed_calls == 0
+    assert failures.num_invalid == sum(len(theta) for theta in failures.parameters)
+    assert all((theta[:, 0] > 0.8).all() for theta in failures.parameters)
+
+    def broken_simulator(theta):
+        raise RuntimeError("simulator is broken")
+
+    with pytest.raises(RuntimeError):
+        simulate_in_batches(
+            broken_simulator,
+            lambda num_samples: prior.sample((num_samples,)),
+            num_samples=10,
+            simulation_batch_size=5,
+            x_dim=torch.Size([2]),
+        )
+
+
+@pytest.mark.parametrize("simulation_executor", ("serial", "processes"))
+def test_timed_out_simulator_calls_are_killed(simulation_executor, tmp_path):
+    """Test that a hanging simulator call is killed on timeout and retried, without
+    changing the RNG state of the caller or failing other calls."""
+
+    started, finished = tmp_path / "started", tmp_path / "finished"
+
+    def hanging_simulator(theta):
+        if not started.exists():
+            started.touch()
+            time.sleep(1.0)
+            finished.touch()
+        return linear_gaussian(theta)
+
+    torch.manual_seed(0)
+    np.random.seed(0)
+    numpy_state = np.random.get_state()
+    failures = SimulationFailures()
+    xs = simulate_batches(
+        hanging_simulator,
+        torch.rand(4, 2),
+        simulation_batch_size=2,
+        simulation_executor=simulation_executor,
+        num_workers=2,
+        seed=1,
+        x_dim=torch.Size([2]),
+        max_retries=1,
+        timeout=0.5,
+        failures=failures,
+    )
+    time.sleep(1.0)
+
+    assert torch.isfinite(xs).all()
+    assert failures.num_retries == 1 and failures.num_failed_calls == 0
+    assert started.exists() and not finished.exists()
+    assert np.array_equal(np.random.get_state()[1], numpy_state[1])
+
+    with pytest.raises(ValueError):
+        simulate_batches(
+            linear_gaussian,
+            torch.rand(4, 2),
+            simulation_batch_size=2,
+            simulation_executor="threads",
+            x_dim=torch.Size([2]),
+            timeout=0.5,
+            failures=failures,
+        )
+
+
+@pytest.mark.parametrize("simulation_batch_size", (10, "auto"))
+def test_streamed_round_replaces_failed_simulations(simulation_batch_size, tmp_path):
+    """Test that invalid simulations of a streamed chunk are replaced by
+    simulations of new parameters, which are stored along with their data, and that
+    no other parameters are sampled, also when tuning the batch size."""
+
+    torch.manual_seed(0)
+    prior = BoxUniform(torch.zeros(2), torch.ones(2))
+    num_calls = 0
+    num_sampled = 0
+
+    def sample_parameters(num_samples):
+        nonlocal num_sampled
+        num_sampled += num_samples
+        return prior.sample((num_samples,))
+
+    def simulator_failing_once(theta):
+        nonlocal num_calls
+        num_calls += 1
+        x = linear_gaussian(theta)
+        if num_calls == 1:
+            x[0] = float("nan")
+        return x
+
+    inference = NeuralInference(
+        simulator_failing_once,
+        prior,
+        torch.zeros(2),
+        simulation_batch_size=simulation_batch_size,
+        summary_writer=SummaryWriter(str(tmp_path)),
+        stream_simulations=True,
+        stream_chunk_size=50,
+        simulator_signature=SimulatorSignature(batched=True),
+    )
+    inference._simulate_round(0, sample_parameters, num_samples=200)
+    while inference._receive_simulations(block=True):
+        pass
+
+    parameters, xs = inference._simulation_bank.get("parameters"), (
+        inference._simulation_bank.get("observations")
+    )
+    quarantined_parameters, quarantined_xs = inference.quarantined_simulations
+    assert parameters.shape == xs.shape == (200, 2)
+    assert torch.isfinite(xs).all()
+    assert len(quarantined_parameters) == 1 and torch.isnan(quarantined_xs).all()
+    assert not (parameters == quarantined_parameters).all(dim=1).any()
+    assert num_sampled == 201
+
+
+def test_streamed_replacements_are_sampled_while_training_pauses(tmp_path):
+    """Test that parameters replacing invalid simulations of a later round are
+    sampled in the main thread and never while the proposal is being trained."""
+
+    torch.manual_seed(0)
+    prior = BoxUniform(torch.zeros(2), torch.ones(2))
+    training = False
+    num_calls = 0
+
+    def sample_parameters(num_samples):
+        assert threading.current_thread() is threading.main_thread()
+        assert not training
+        return prior.sample((num_samples,))
+
+    def simulator_failing_sometimes(theta):
+        nonlocal num_calls
+        num_calls += 1
+        time.sleep(0.01)
+        x = linear_gaussian(theta)
+        if num_calls % 3 == 0:
+            x[0] = float("nan")
+        return x
+
+    def train():
+        nonlocal training
+        training = True
+        time.sleep(0.05)
+        training = False
+
+    inference = NeuralInference(
+        simulator_failing_sometimes,
+        prior,
+        torch.zeros(2),
+        simulation_batch_size=10,
+        summary_writer=SummaryWriter(str(tmp_path)),
+        stream_simulations=True,
+        stream_chunk_size=20,
+        simulator_signature=SimulatorSignature(batched=True),
+    )
+    inference._round = 1
+    inference._simulate_round(1, sample_parameters, num_samples=100)
+    while inference._simulation_stream is not None:
+        train()
+        inference._receive_simulations(block=True)
+
+    parameters = inference._simulation_bank.get("parameters")
+    xs = inference._simulation_bank.get("observations")
+    assert parameters.shape == xs.shape == (100, 2)
+    assert torch.isfinite(xs).all()
+    assert len(inference.quarantined_simulations[0]) > 0
+
+
+def test_tune_simulation_batch_size():
+    """Test that tuning prefers large batches for a vectorized simulator with
+    overhead per call, and returns the data of the simulations run while tuning."""
+
+    def vectorized_simulator(theta):
+        time.sleep(0.002)
+        return linear_gaussian(theta)
+
+    parameters = torch.rand(500, 2)
+    batch_size, xs, throughputs = tune_simulation_batch_size(
+        vectorized_simulator, parameters, x_dim=torch.Size([2])
+    )
+
+    assert batch_size in throughputs and batch_size >= 16
+    assert xs.shape == (sum(2 * size for size in throughputs), 2)
+
+    # The memory cap limits the batch size.
+    batch_size, _, throughputs = tune_simulation_batch_size(
+        vectorized_simulator,
+        parameters,
+        x_dim=torch.Size([2]),
+        max_batch_memory_bytes=4 * xs[0].numel() * xs.element_size(),
+    )
+    assert max(throughputs) <= 4
+
+
+def test_tune_simulation_batch_size_reuses_workers_and_cache(tmp_path):
+    """Test that tuning simulates with the worker processes it is given, and looks
+    up cached parameters instead of simulating and timing them again."""
+
+    def simulator(theta):
+        return torch.full((len(theta), 1), float(os.getpid()))
+
+    parameters = torch.rand(200, 1)
+    cache = SimulationCache(str(tmp_path))
+
+    def tune():
+        return tune_simulation_batch_size(
+            simulator,
+            parameters,
+            x_dim=torch.Size([1]),
+            simulation_executor="processes",
+            num_workers=2,
+            simulation_cache=cache,
+            process_pool=process_pool,
+        )
+
+    with SimulationProcessPool(simulator, num_workers=2) as process_pool:
+        _, xs, throughputs = tune()
+        _, cached_xs, cached_throughputs = tune()
+
+    # The same two workers simulate every batch size of both runs.
+    assert len(torch.cat((xs, cached_xs)).unique()) == 2
+    assert torch.equal(cached_xs[: len(xs)], xs)
+    assert cache.num_hits == len(xs)
+    assert not set(throughputs) & set(cached_throughputs)
+
+
+@pytest.mark.parametrize(
+    "simulator, num_probe_calls, num_probe_simulations",
+    ((linear_gaussian, 1, 2), (torch_simulator_no_batch, 2, 1)),
+)
+def test_prepare_sbi_problem_probes_once(
+    simulator, num_probe_calls, num_probe_simulations
+):
+    """Test that the simulator is probed at most twice, and not at all if declared."""
+
+    prior = BoxUniform(torch.zeros(3), torch.ones(3))
+    num_calls = 0
+
+    def counting_simulator(theta):
+        nonlocal num_calls
+        num_calls += 1
+        return simulator(theta)
+
+    (
+        batch_simulator,
+        _,
+        _,
+        (parameters, data),
+        signature,
+    ) = prepare_sbi_problem_and_probe(counting_simulator, prior, torch.zeros(1, 3))
+    assert num_calls == num_probe_calls
+    assert parameters.shape == data.shape == (num_probe_simulations, 3)
+    assert signature.output_dtype == torch.float32
+
+    num_calls = 0
+    signature = SimulatorSignature(batched=num_probe_calls == 1, output_shape=(3,))
+    batch_simulator, _, _, probe, _ = prepare_sbi_problem_and_probe(
+        counting_simulator, prior, torch.zeros(1, 3), simulator_signature=signature
+    )
+    assert num_calls == 0 and probe is None
+    assert batch_simulator(prior.sample((4,))).shape == (4, 3)
+
+
+def test_numpy_simulator_output_is_not_copied():
+    """Test that numpy simulator outputs are handed over without copying."""
+
+    outputs = []
+
+    def numpy_simulator(theta):
+        outputs.append(np.asarray(theta, dtype=np.float64) * 2)
+        return outputs[-1]
+
+    simulator = wrap_by_signature(
+        numpy_simulator, SimulatorSignature(batched=True, numpy=True)
+    )
+    x = simulator(torch.ones(4, 2))
+
+    assert x.dtype == torch.float64
+    assert x.data_ptr() == outputs[-1].ctypes.data
+
+
+def start_farm_worker(farm: SimulationFarm, simulator: Callable) -> threading.Thread:
+    worker = threading.Thread(
+        target=run_worker, args=(farm.address, simulator), daemon=True
+    )
+    worker.start()
+    return worker
+
+
+@pytest.mark.parametrize("unix_socket", (False, True))
+def test_simulation_farm(unix_socket, tmp_path):
+    """Test that batches simulated by farm workers are returned in order."""
+
+    address = f"unix:{tmp_path / 'farm.sock'}" if unix_socket else "localhost:0"
+    with SimulationFarm(address) as farm:
+        for _ in range(2):
+            start_farm_worker(farm, lambda theta: 2 * theta)
+        farm.wait_for_workers(2, timeout=10)
+
+        parameters, xs = simulate_in_batches(
+            farm, lambda n: torch.randn(n, 2), 20, 3, x_dim=torch.Size([2])
+        )
+        assert torch.equal(xs, 2 * parameters)
+
+
+def test_simulation_farm_redispatches_lost_batches():
+    """Test that batches of workers that go silent or fail are simulated again."""
+
+    with SimulationFarm(heartbeat_timeout=0.5) as farm:
+        # A worker that takes a batch and then neither answers nor sends heartbeats.
+        silent_worker = socket.create_connection(parse_address(farm.address)[1])
+        send_message(silent_worker, {"type": "hello", "host": "silent", "pid": 0})
+        receive_message(silent_worker)
+        farm.wait_for_workers(1, timeout=10)
+
+        parameters = torch.randn(6, 2)
+        failures = SimulationFailures()
+        result = {}
+        simulation = threading.Thread(
+            target=lambda: result.update(
+                x=simulate_batches(
+                    farm,
+                    parameters,
+                    2,
+                    x_dim=torch.Size([2]),
+                    max_retries=1,
+                    failures=failures,
+                )
+            )
+        )
+        simulation.start()
+        receive_message(silent_worker)
+
+        def flaky_simulator(theta):
+            if flaky_simulator.num_calls == 0:
+                flaky_simulator.num_calls += 1
+                raise RuntimeError("Simulator failed.")
+            return theta + 1
+
+        flaky_simulator.num_calls = 0
+        start_farm_worker(farm, flaky_simulator)
+        simulation.join(timeout=20)
+        silent_worker.close()
+
+    assert torch.equal(result["x"], parameters + 1)
+    assert failures.num_retries == 1 and failures.num_failed_calls == 0
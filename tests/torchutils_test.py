@@ -156,3 +156,48 @@ def test_dkl_gauss():
             f"Monte-Carlo-based KLd={monte_carlo_dkl} is too far from the torch"
             f" implementation, {torch_dkl}."
         )
+
+
+def test_tensor_batches():
+    """Test that batches cover the indices once per pass, like a DataLoader."""
+
+    parameters = torch.arange(20.0).unsqueeze(1)
+    observations = 2 * parameters
+    indices = torch.arange(3, 20)
+
+    batches = torchutils.TensorBatches(
+        (parameters, observations), indices, batch_size=5, drop_last=True
+    )
+    assert len(batches) == 3
+    seen = torch.cat([batch_parameters for batch_parameters, _ in batches])
+    assert len(seen) == 15 and len(set(seen.flatten().tolist())) == 15
+    assert set(seen.flatten().tolist()) <= set(indices.tolist())
+    for batch_parameters, batch_observations in batches:
+        assert torch.equal(batch_observations, 2 * batch_parameters)
+
+    batches = torchutils.TensorBatches(
+        (parameters,), indices, batch_size=5, shuffle=False
+    )
+    assert len(batches) == 4
+    batch_parameters = [batch[0] for batch in batches]
+    assert torch.equal(torch.cat(batch_parameters).flatten(), indices.float())
+    assert batch_parameters[-1].shape == (2, 1)
+
+
+def test_sample_contrasting_indices():
+    """Test that every row gets distinct indices of other rows, uniformly."""
+
+    for batch_size, num_samples in ((50, 3), (50, 40), (2, 1), (5, 0)):
+        choices = torchutils.sample_contrasting_indices(batch_size, num_samples)
+        assert choices.shape == (batch_size, num_samples)
+        assert ((choices >= 0) & (choices < batch_size)).all()
+        assert (choices != torch.arange(batch_size)[:, None]).all()
+        for row in choices:
+            assert len(row.unique()) == num_samples
+
+    # Every other index of a row is chosen with probability 2 / 19.
+    choices = torch.cat(
+        [torchutils.sample_contrasting_indices(20, 2) for _ in range(1000)]
+    )
+    counts = torch.stack([(choices[i::20] == 1).sum() for i in (0, 2, 19)])
+    assert ((counts > 70) & (counts < 140)).all()
@@ -0,0 +1,190 @@
+import pytest
+import torch
+from torch import nn, optim
+from torch.optim.lr_scheduler import StepLR
+from torch.utils.tensorboard import SummaryWriter
+
+from sbi.inference.base import NeuralInference
+from sbi.inference.trainer import Trainer, TrainingHook
+from sbi.utils.torchutils import BoxUniform, TensorBatches
+
+
+class RecordingHook(TrainingHook):
+    def __init__(self):
+        self.calls = []
+
+    def on_train_begin(self, trainer):
+        self.calls.append("begin")
+
+    def on_epoch_end(self, trainer, start_time):
+        self.calls.append("epoch")
+
+    def on_validation_end(self, trainer, start_time, validation_log_prob):
+        self.calls.append("validation")
+
+    def on_train_end(self, trainer):
+        self.calls.append("end")
+
+
+def make_trainer(lr_scheduler=None, **kwargs):
+    """Return a trainer fitting a linear regression."""
+    torch.manual_seed(0)
+    inputs = torch.randn(100, 2)
+    targets = inputs @ torch.tensor([[1.0], [-2.0]]) + 0.1 * torch.randn(100, 1)
+    model = nn.Linear(2, 1)
+    optimizer = optim.SGD(model.parameters(), lr=0.1)
+
+    def loss_fn(inputs, targets):
+        return ((model(inputs) - targets) ** 2).mean()
+
+    tensors = (inputs, targets)
+    kwargs.setdefault("stop_after_epochs", 5)
+    if lr_scheduler is not None:
+        kwargs["lr_scheduler"] = lr_scheduler(optimizer)
+    return Trainer(
+        model,
+        optimizer,
+        loss_fn,
+        TensorBatches(tensors, torch.arange(80), batch_size=10),
+        TensorBatches(tensors, torch.arange(80, 100), batch_size=10, shuffle=False),
+        **kwargs,
+    )
+
+
+def test_trainer_fits_and_restores_best_model():
+    trainer = make_trainer()
+    best_validation_log_prob = trainer.train()
+
+    assert best_validation_log_prob > -0.02
+    assert best_validation_log_prob == max(trainer.validation_log_probs)
+    assert trainer.epoch == len(trainer.validation_log_probs)
+    assert trainer.epoch - trainer.best_epoch == 5
+    assert trainer.stop_reason == "converged"
+    assert trainer.num_steps == 8 * trainer.epoch
+
+    # The restored model has the best validation performance.
+    trainer._validate()
+    assert trainer.validation_log_probs[-1] == pytest.approx(best_validation_log_prob)
+
+
+def test_trainer_budgets_validation_and_hooks():
+    hook = RecordingHook()
+    trainer = make_trainer(
+        validate_every_epochs=3,
+        accumulate_grad_batches=3,
+        max_num_epochs=4,
+        hooks=[hook],
+    )
+    trainer.train()
+
+    # The last epoch is validated when the budget is exhausted.
+    assert trainer.stop_reason == "max_num_epochs"
+    assert trainer.epoch == 4
+    assert len(trainer.validation_log_probs) == 2
+    assert trainer.num_steps == 3 * 4
+    assert hook.calls == ["begin"] + ["epoch"] * 3 + ["validation"] + [
+        "epoch",
+        "validation",
+        "end",
+    ]
+
+
+def test_trainer_steps_lr_scheduler():
+    trainer = make_trainer(
+        lambda optimizer: StepLR(optimizer, step_size=1, gamma=0.5), max_num_epochs=2
+    )
+    trainer.train()
+
+    assert trainer.optimizer.param_groups[0]["lr"] == pytest.approx(0.025)
+
+
+@pytest.mark.parametrize(
+    "budget, stop_reason",
+    (
+        (dict(max_num_steps=12), "max_num_steps"),
+        (dict(max_seconds=0.0), "max_seconds"),
+    ),
+)
+def test_trainer_cuts_epoch_short_when_budget_is_exhausted(budget, stop_reason):
+    trainer = make_trainer(**budget)
+    trainer.train()
+
+    assert trainer.stop_reason == stop_reason
+    assert trainer.num_steps == budget.get("max_num_steps", 1)
+    assert trainer.epoch == -(-trainer.num_steps // 8)
+    assert len(trainer.validation_log_probs) == trainer.epoch
+    # Only the batches that were run are counted.
+    assert trainer.num_train_batches == trainer.num_steps
+    assert trainer.num_validation_batches == 2 * trainer.epoch
+
+
+@pytest.mark.parametrize(
+    "stop_tolerance, validation_smoothing, num_epochs, stop_reason",
+    (
+        (0.0, 0.0, 10, "max_num_epochs"),
+        (0.05, 0.0, 4, "converged"),
+        (0.0, 0.5, 5, "converged"),
+    ),
+)
+def test_trainer_stopping_rule(
+    stop_tolerance, validation_smoothing, num_epochs, stop_reason
+):
+    """Test convergence on a slowly improving and a noisy validation curve."""
+
+    if validation_smoothing:
+        # Alternating improvements and setbacks, flat on average.
+        validation_losses = iter([1.0, 0.9, 1.1] + [0.89, 1.1] * 10)
+    else:
+        validation_losses = iter([0.99 ** epoch for epoch in range(20)])
+    model = nn.Linear(1, 1)
+
+    def loss_fn(inputs):
+        loss = model(inputs).mean()
+        return loss if model.training else 0 * loss + next(validation_losses)
+
+    batches = TensorBatches((torch.ones(10, 1),), torch.arange(10), batch_size=10)
+    trainer = Trainer(
+        model,
+        optim.SGD(model.parameters(), lr=0.0),
+        loss_fn,
+        batches,
+        batches,
+        stop_after_epochs=3,
+        max_num_epochs=10,
+        stop_tolerance=stop_tolerance,
+        validation_smoothing=validation_smoothing,
+    )
+    trainer.train()
+
+    assert trainer.stop_reason == stop_reason
+    assert trainer.epoch == num_epochs
+
+
+@pytest.mark.parametrize("replay_decay", (1.0, 0.1))
+def test_replay_sample_of_earlier_rounds(replay_decay, tmp_path):
+    """Test that the latest round is trained on in full, with a capped replay
+    sample weighted towards recent rounds."""
+
+    inference = NeuralInference(
+        simulator=None,
+        prior=BoxUniform(-torch.ones(2), torch.ones(2)),
+        true_observation=torch.zeros(2),
+        summary_writer=SummaryWriter(str(tmp_path)),
+        replay_size=200,
+        replay_decay=replay_decay,
+    )
+    for round_ in range(4):
+        inference._store_simulations(round_, torch.randn(1000, 2), torch.randn(1000, 2))
+
+    train_indices, val_indices = inference._split_simulations(0.1, start_round=1)
+    indices = torch.cat((train_indices, val_indices))
+    rounds = inference._simulation_bank.round_indices(start_round=1)[indices]
+
+    assert len(train_indices) == int(0.9 * 1200)
+    assert len(indices.unique()) == 1200
+    assert (rounds == 3).sum() == 1000
+    num_round_1, num_round_2 = (rounds == 1).sum(), (rounds == 2).sum()
+    if replay_decay == 1.0:
+        assert 50 < num_round_1 < 150
+    else:
+        assert num_round_1 < 0.2 * num_round_2